@@ -16,7 +16,8 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this library.  If not, see <http://www.gnu.org/licenses/>.
 
-import serial,sys,time
+import sys,time,threading,transport,varicode
+from collections import deque
 
 try:
     import RPi.GPIO as GPIO
@@ -25,16 +26,119 @@ except ImportError:
     print "No RPi library detected. Disabling RPi GPIO routines."
     rpi_enabled = False
     
+# A serial port, or any of the other device names transport.py takes, i.e. tcp://host:port
+# for a transmitter behind ser2net, or pty:/dev/pts/3 for the simulator.
 default_serial_device = '/dev/arduino'
 
+# The firmware turns the transmitter off after this many seconds (TX_TIMEOUT in QITX_Remote.ino).
+TX_TIMEOUT = varicode.TX_TIMEOUT
+
+# How long to wait for a reply to a parameter command, and to a transmit command.
+command_timeout = 2.0
+transmit_timeout = TX_TIMEOUT + 10.0
+
+# How often a thread waiting for a reply wakes up, so signals get handled (s).
+wait_interval = 0.5
+
+# Read without side effects, sent to get back in step with the firmware's replies after a
+# command goes unanswered.
+sync_command = 'INHIBIT'
+
+# Order in which configure() sends parameters. The firmware checks FREQ against the
+# offset and sideband, so keep the order the scripts have always used.
+parameter_order = ['FREQ','FREQOFF','FREQSSB','POWER','CALL','MSG']
+
+# First firmware version (from the VERSION command) with PSKFLOW. Firmware from before VERSION
+# answers ERROR to it, and is taken as version 1.
+pskflow_version = 2
+
+# Parameters which only change when we set them, so are cached on the host. INHIBIT can
+# also be set by the button on the transmitter, so always goes to the device.
+cached_parameters = ['FREQ','FREQOFF','FREQSSB','POWER','CALL','MSG']
+
+
+class Response(object):
+    # A future for the reply to a single command. The reader thread fills in any
+    # PARAM,value lines, and completes it when the OK or ERROR line arrives.
+
+    def __init__(self,command):
+        self.command = command
+        self.params = []
+        self.status = None
+        self.sent = time.time()
+        self.received = None
+        self.deadline = None
+        self._event = threading.Event()
+        
+    def complete(self,status):
+        self.status = status
+        self.received = time.time()
+        self._event.set()
+        
+    def done(self):
+        return self._event.is_set()
+        
+    def wait(self,timeout=None):
+        # Returns 'OK' or 'ERROR', or None if no reply arrived within the timeout.
+        # The reader thread enforces the deadline. We still wake up regularly, as on Python 2 a
+        # wait without a timeout can't be interrupted, and Ctrl-C or a SIGTERM handler (to turn
+        # the PA off) would have to wait for the reply.
+        if timeout is not None:
+            self.deadline = time.time() + timeout
+        while not self._event.wait(wait_interval):
+            pass
+        return self.status
+        
+    @property
+    def ok(self):
+        return self.status == 'OK'
+        
+    @property
+    def value(self):
+        # The argument of the last PARAM,value line, if there was one.
+        if len(self.params) == 0:
+            return None
+        return self.params[-1][1]
+        
+    @property
+    def latency(self):
+        if self.received is None:
+            return None
+        return self.received - self.sent
+
+
 class QITX(object):
     
     def __init__(self,serial_device=default_serial_device,power_pin=25):
     
-        try:
-            self.s = serial.Serial(serial_device, 38400, timeout=1)
-        except serial.serialutil.SerialException as e:
-            print "ERROR:",e
+        # Commands awaiting a reply, oldest first. The firmware handles commands strictly in order.
+        self.pending = deque()
+        self.write_lock = threading.Lock()
+        # Lines which weren't a reply to anything we sent.
+        self.unsolicited = deque(maxlen=100)
+        self.timeout_count = 0
+        self.last_timeout = None
+        self.timeout_callbacks = []
+        # The command sent to resynchronise, while we're waiting for its reply, and how many
+        # times that has been needed.
+        self.sync = None
+        self.resyncs = 0
+        # Recent round trip times of single get/set commands, and timing of the last configure().
+        self.rtt = deque(maxlen=50)
+        self.configure_stats = None
+        # Last known value of each of the cached_parameters on the device.
+        self.state = {}
+        # Credit for the PSKFLOW stream in progress, if any.
+        self.credit = None
+        # Firmware version, asked for once per connection.
+        self.version = None
+        self.serial_device = serial_device
+        self.s = None
+        self.rx = None
+        self.running = False
+        self.reader = None
+        
+        self.connect()
             
         if rpi_enabled:
             self.power_pin = power_pin
@@ -43,40 +147,245 @@ class QITX(object):
             GPIO.output(self.power_pin,False)
             
 
+    def connect(self):
+        # Open the port, start the reader thread, and fill the parameter cache.
+        self.invalidate()
+        try:
+            # Short read timeout, so the reader thread checks reply deadlines regularly.
+            self.s = transport.open_transport(self.serial_device,38400,0.1)
+        except transport.TransportError as e:
+            print "ERROR:",e
+            return False
+            
+        self.rx = transport.LineBuffer()
+        self.version = None
+        self.running = True
+        self.reader = threading.Thread(target=self.read_loop)
+        self.reader.daemon = True
+        self.reader.start()
+        
+        self.refresh_state()
+        return True
+        
+    def reconnect(self):
+        self.close()
+        return self.connect()
+
     def close(self):
-        self.s.close()
+        self.running = False
+        if self.s is not None:
+            self.s.close()
+        if self.reader is not None and self.reader is not threading.current_thread():
+            self.reader.join(2)
+            
+    def invalidate(self):
+        # Forget everything we know about the device's settings.
+        self.state.clear()
+        
+    def refresh_state(self):
+        # Read all of the cached parameters in one pipelined batch.
+        self.invalidate()
+        responses = [(name,self.send_command(name)) for name in cached_parameters]
+        for name,r in responses:
+            if r.wait(command_timeout) == 'OK' and r.value is not None:
+                self.state[name] = r.value
+        return len(self.state) == len(cached_parameters)
+        
+    def read_loop(self):
+        # Read straight into the receive buffer, and hand each complete line to handle_line().
+        rx = self.rx
+        try:
+            while self.running:
+                try:
+                    n = self.s.read_into(rx.space())
+                except transport.TransportError as e:
+                    if self.running:
+                        print "ERROR:",e
+                        self.running = False
+                    break
+                for line in rx.feed(n):
+                    self.handle_line(line)
+                    
+                now = time.time()
+                for r in list(self.pending):
+                    if r.deadline is not None and now > r.deadline:
+                        self.resync()
+                        break
+        finally:
+            # Nothing more is going to arrive, so wake up anyone still waiting. If the port has
+            # gone away the transmitter has probably been reset, so the cache can't be trusted either.
+            # This has to happen even if the thread died, or the waiters would block forever.
+            self.invalidate()
+            # Under the write lock, so send_command() can't queue a Response after the drain.
+            with self.write_lock:
+                self.running = False
+                while self.pending:
+                    self.pending.popleft().complete(None)
+            credit = self.credit
+            if credit is not None:
+                credit.close()
+            
+    def resync(self):
+        # A command has gone unanswered past its deadline. Replies are matched to commands
+        # purely by order, so from here on they can't be trusted to line up: give up on
+        # everything pending, then send sync_command and throw away every line until its reply
+        # comes back. If the firmware has hung, the sync is never answered, and the next
+        # command to time out starts another one.
+        with self.write_lock:
+            credit = self.credit
+            while self.pending:
+                r = self.pending.popleft()
+                r.complete(None)
+                if credit is not None and r.command.startswith('PSKFLOW'):
+                    credit.close()
+            # Whatever the abandoned commands set, or didn't, is unknown.
+            self.invalidate()
+            self.resyncs += 1
+            self.sync = Response(sync_command)
+            self.pending.append(self.sync)
+            try:
+                self.s.write(sync_command+"\n")
+            except transport.TransportError:
+                # The next read will fail too, and end the reader thread.
+                pass
+                
+    def handle_line(self,line):
+        if self.sync is not None and self.pending and self.pending[0] is self.sync:
+            # Resynchronising. Only the sync's own reply (a value line, then OK) counts, anything
+            # else is a late reply to an abandoned command.
+            if line.startswith(sync_command+','):
+                self.sync.params.append(tuple(line.split(',',1)))
+                return
+            if line == 'OK' and len(self.sync.params) > 0:
+                self.pending.popleft().complete(line)
+                self.sync = None
+                return
+            if line != 'TIMEOUT':
+                if len(line) > 0:
+                    self.unsolicited.append(line)
+                return
+        # The stream's credit window can be dropped by the transmitting thread at any time.
+        credit = self.credit
+        if line == 'OK' or line == 'ERROR':
+            if self.pending:
+                r = self.pending.popleft()
+                r.complete(line)
+                # The stream is over (or never started), so no more credit is coming.
+                if credit is not None and r.command.startswith('PSKFLOW'):
+                    credit.close()
+            else:
+                self.unsolicited.append(line)
+        elif line.startswith('CREDIT,') and credit is not None:
+            # PSKFLOW flow control. Not the reply to a command.
+            try:
+                credit.grant(int(line[7:]))
+            except ValueError:
+                self.unsolicited.append(line)
+        elif line == 'TIMEOUT':
+            # The firmware hit TX_TIMEOUT and turned the transmitter off. This isn't the reply to a command.
+            self.timeout_count += 1
+            self.last_timeout = time.time()
+            self.invalidate()
+            for callback in self.timeout_callbacks:
+                # A broken callback mustn't take the reader thread down with it.
+                try:
+                    callback()
+                except Exception as e:
+                    print "ERROR: Timeout callback failed:",repr(e)
+        elif line.find(',') != -1 and self.pending:
+            self.pending[0].params.append(tuple(line.split(',',1)))
+        elif len(line) > 0:
+            self.unsolicited.append(line)
+            
+    def write(self,data):
+        with self.write_lock:
+            self.s.write(data)
+        
+    def send_command(self,string):
+        # Send a command without waiting for the reply. Returns a Response.
+        r = Response(string)
+        with self.write_lock:
+            # Checked under the lock the reader thread drains pending with when it stops.
+            if not self.running:
+                r.complete(None)
+                return r
+            self.pending.append(r)
+            self.s.write(string+"\n")
+        return r
+        
+    def command(self,string,timeout=command_timeout):
+        return self.send_command(string).wait(timeout) == 'OK'
         
     def get_parameter(self,string):
-        self.s.write(string+"\n")
-        return self.get_argument()
+        if string in self.state:
+            return self.state[string]
+        r = self.send_command(string)
+        if r.wait(command_timeout) == 'OK' and r.value is not None:
+            self.rtt.append(r.latency)
+            self.update_state(string,r)
+            return r.value
+        return -1
         
     def set_parameter(self,string,arg):
-        self.s.write(string+","+arg+"\n")
-        if self.get_argument() == arg:
+        # Setting a parameter to the value it already has is a no-op. This saves a round trip
+        # and, for FREQ, FREQOFF and CALL, a rewrite of the transmitter's EEPROM.
+        if self.state.get(string) == arg:
+            return True
+        r = self.send_command(string+","+arg)
+        r.wait(command_timeout)
+        self.update_state(string,r)
+        if r.ok and r.value == arg:
+            self.rtt.append(r.latency)
             return True
         else:
             return False
-    
-    def get_argument(self):
-        data1 = self.s.readline()
-        # Do a couple of quick checks to see if there is useful data here
-        if len(data1) == 0:
-            return -1
             
-        # Maybe we didn't catch an OK line?
-        if data1.startswith('OK'):
-            data1 = self.s.readline()
+    def update_state(self,name,r):
+        # Write-through: cache whatever value the device echoed back.
+        if name not in cached_parameters:
+            return
+        if r.ok and r.value is not None:
+            self.state[name] = r.value
+        else:
+            self.state.pop(name,None)
             
-        # Check to see if we have a comma in the string. If not, there is no argument.
-        if data1.find(',') == -1:
-            return -1
+    def configure(self,**params):
+        # Set several parameters at once, i.e. configure(FREQ='7040000',POWER='HIGH').
+        # The commands are written back to back and the replies matched up in order, so this
+        # costs roughly one round trip rather than one per parameter.
+        # Returns a dictionary of parameter name -> True/False.
+        params = dict((name.upper(),str(value)) for name,value in params.items())
+        names = [x for x in parameter_order if x in params] + sorted(x for x in params if x not in parameter_order)
+        
+        start = time.time()
+        results = {}
+        responses = []
+        for name in names:
+            if self.state.get(name) == params[name]:
+                results[name] = True
+            else:
+                responses.append((name,self.send_command(name+","+params[name])))
         
-        data1 = data1.split(',')[1].rstrip('\r\n')
+        for name,r in responses:
+            r.wait(command_timeout)
+            self.update_state(name,r)
+            results[name] = (r.ok and r.value == params[name])
+        elapsed = time.time() - start
         
-        # Check for the OK string
-        data2 = self.s.readline()
-        if data2.startswith('OK'):
-            return data1
+        # Estimate what the same settings would have cost one at a time, from recent
+        # single command round trips (or failing that, the first reply of this batch).
+        if len(self.rtt) > 0:
+            rtt = sum(self.rtt)/len(self.rtt)
+        elif len(responses) > 0 and responses[0][1].latency is not None:
+            rtt = responses[0][1].latency
+        else:
+            rtt = 0.0
+        # It's only an estimate, so the saving can come out below zero if this batch was slow. Clamp it.
+        sequential = rtt*len(responses)
+        self.configure_stats = {'count': len(responses), 'elapsed': elapsed,
+            'sequential_estimate': sequential, 'saved_estimate': max(0.0,sequential - elapsed)}
+        
+        return results
             
     def tx_inhibited(self):
         data = self.get_parameter('INHIBIT')
@@ -93,70 +402,120 @@ class QITX(object):
             GPIO.output(self.power_pin, power)
     
     def transmit_psk(self,baudrate=31):
-        self.s.write('PSK,'+str(baudrate)+'\n')
+        return self.command('PSK,'+str(baudrate),transmit_timeout)
+        
+    def transmit_psk_stream(self,data,baudrate=31,preamble=3,postamble=1):
+        # Stream a string through the PSKTERM command at the channel's full character rate.
+        # Writes are paced against a model of the firmware ring buffer, which is kept
+        # nearly full without ever overflowing it (store_char() silently drops characters).
+        if '\x04' in data:
+            print "ERROR: EOT would terminate the PSKTERM stream."
+            return False
+        # Raises a ValueError now, before we key up, if a character has no varicode.
+        varicode.airtime(data,baudrate)
+        pacer = varicode.PSKPacer(baudrate)
         
-        # Wait until we have either an OK or an ERROR in our serial RX buffer
-        while self.s.inWaiting()<4 :
-            time.sleep(0.5)
+        # The OK only arrives once we've ended the stream with an EOT.
+        r = self.send_command('PSKTERM,'+str(baudrate))
         
-        data = self.s.readline()
-        if data.startswith('OK'):
-            return True
-        else:
+        # Phase reversals only, to allow the receiver to lock on
+        time.sleep(preamble)
+        pacer.reset(time.time())
+        
+        for c in data:
+            wait = pacer.wait_time(time.time())
+            if wait > 0:
+                time.sleep(wait)
+            self.write(c)
+            pacer.push(c,time.time())
+        
+        # Wait for the buffer to drain, then idle for a bit before ending the transmission.
+        time.sleep(max(0,pacer.air_free - time.time()) + postamble)
+        self.write('\x04')
+        
+        return r.wait(command_timeout) == 'OK'
+            
+    def firmware_version(self):
+        # The firmware version, from the VERSION command, which has no side effects. Firmware
+        # from before VERSION answers ERROR, and is version 1. None if there was no reply.
+        if self.version is None:
+            r = self.send_command('VERSION')
+            status = r.wait(command_timeout)
+            if status == 'OK' and r.value is not None and r.value.isdigit():
+                self.version = int(r.value)
+            elif status == 'ERROR':
+                self.version = 1
+        return self.version
+        
+    def transmit_psk_flow(self,data,baudrate=31,preamble=3,postamble=1):
+        # Stream a string using the PSKFLOW command, which tells us how much room there is in
+        # the firmware ring buffer rather than us having to model it. Every character is sent
+        # as soon as there's a free slot for it, so the buffer stays full with nothing dropped.
+        # Older firmware doesn't have PSKFLOW, and would take it as PSK,<baud> (sending the stored
+        # MSG), so the firmware version is checked before keying up, and older firmware gets
+        # transmit_psk_stream() instead.
+        if '\x04' in data:
+            print "ERROR: EOT would terminate the PSKFLOW stream."
             return False
+        varicode.airtime(data,baudrate)
+        version = self.firmware_version()
+        if version is None:
+            print "ERROR: No reply from the transmitter."
+            return False
+        if version < pskflow_version:
+            print "Firmware has no PSKFLOW, using PSKTERM."
+            return self.transmit_psk_stream(data,baudrate,preamble,postamble)
+        # Longest we should ever wait for credit: a batch of the slowest characters.
+        stall_timeout = command_timeout + varicode.CREDIT_BATCH*max([varicode.char_airtime(c,baudrate) for c in data] or [0])
+        
+        window = varicode.CreditWindow()
+        self.credit = window
+        r = self.send_command('PSKFLOW,'+str(baudrate))
+        try:
+            if not window.wait_credit(command_timeout):
+                print "ERROR: No credit from the transmitter."
+                # End the stream, in case it did start.
+                if not r.done():
+                    self.write('\x04')
+                return False
+            
+            # Phase reversals only, to allow the receiver to lock on
+            time.sleep(preamble)
             
+            sent = 0
+            while sent < len(data):
+                n = window.take(len(data) - sent,stall_timeout)
+                if n == 0:
+                    print "ERROR: No credit from the transmitter."
+                    break
+                self.write(data[sent:sent+n])
+                sent += n
+            
+            # All credit back means the last character has been taken from the buffer. Let it
+            # finish going out, idle for a bit, then end the transmission. With no data, that's
+            # just the postamble, as in transmit_psk_stream().
+            if sent == len(data):
+                window.wait_empty(varicode.airtime(data,baudrate) + command_timeout)
+                last = 0
+                if len(data) > 0:
+                    last = varicode.char_airtime(data[-1],baudrate)
+                time.sleep(last + postamble)
+            self.write('\x04')
+            return r.wait(command_timeout) == 'OK' and sent == len(data)
+        finally:
+            self.credit = None
             
     def transmit_rtty(self,baudrate=50,shift=170):
-        self.s.write('RTTY,'+str(baudrate)+','+str(shift)+'\n')
-        
-        # Wait until we have either an OK or an ERROR in our serial RX buffer
-        while self.s.inWaiting()<4 :
-            time.sleep(0.5)
-        
-        data = self.s.readline()
-        if data.startswith('OK'):
-            return True
-        else:
-            return False
+        return self.command('RTTY,'+str(baudrate)+','+str(shift),transmit_timeout)
             
     def transmit_selcall(self,source=1881,dest=1882,chantest=True):
         if chantest:
-            self.s.write('SELTEST,'+str(source)+','+str(dest)+'\n')
+            return self.command('SELTEST,'+str(source)+','+str(dest),transmit_timeout)
         else:
-            self.s.write('SELCALL,'+str(source)+','+str(dest)+'\n')
-        
-        # Wait until we have either an OK or an ERROR in our serial RX buffer
-        while self.s.inWaiting()<4 :
-            time.sleep(0.5)
-        
-        data = self.s.readline()
-        if data.startswith('OK'):
-            return True
-        else:
-            return False
+            return self.command('SELCALL,'+str(source)+','+str(dest),transmit_timeout)
     
     def transmit_ident(self):
-        self.s.write('IDENT\n')
-        
-        # Wait until we have either an OK or an ERROR in our serial RX buffer
-        while self.s.inWaiting()<4 :
-            time.sleep(0.5)
-        
-        data = self.s.readline()
-        if data.startswith('OK'):
-            return True
-        else:
-            return False
+        return self.command('IDENT',transmit_timeout)
         
     def transmit_domino(self):
-        self.s.write('DOMINO\n')
-        
-        # Wait until we have either an OK or an ERROR in our serial RX buffer
-        while self.s.inWaiting()<4 :
-            time.sleep(0.5)
-        
-        data = self.s.readline()
-        if data.startswith('OK'):
-            return True
-        else:
-            return False
\ No newline at end of file
+        return self.command('DOMINO',transmit_timeout)
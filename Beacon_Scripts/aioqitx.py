@@ -0,0 +1,482 @@
+#!/usr/bin/env python3
+# aioqitx.py - asyncio QITX Communication library
+#
+# An asyncio counterpart to QITX.py, for use alongside other devices, monitoring or a network
+# API in the one event loop. Every operation is a coroutine, so a transmission only ties up
+# the task awaiting it. Requires Python 3.
+#
+# Commands work as they do in QITX.py: they are written straight away, the firmware answers
+# them strictly in order, and each reply is matched to the oldest command still waiting.
+# A command that is cancelled stays queued until its late reply arrives, so later replies
+# still line up. One that times out may never be answered, so, as in QITX.py, everything
+# pending is given up on and the client resynchronises before matching replies again. Cancelling a transmission stops waiting for it; the firmware
+# carries on until it's done, except for PSKTERM streams, which are ended with an EOT.
+#
+# Uses pyserial-asyncio if it's installed, otherwise watches the pyserial file descriptor
+# directly (POSIX only).
+#
+# Usage: python3 aioqitx.py [serial_device]
+# Runs a short demonstration, against the simulator (qitx_sim.py) if no device is given.
+#
+# Copyright 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio,sys,time,serial,varicode
+from collections import deque
+
+try:
+    import serial_asyncio
+    serial_asyncio_enabled = True
+except ImportError:
+    serial_asyncio_enabled = False
+
+default_serial_device = '/dev/arduino'
+
+# The same timeouts and parameter handling as QITX.py.
+TX_TIMEOUT = varicode.TX_TIMEOUT
+command_timeout = 2.0
+transmit_timeout = TX_TIMEOUT + 10.0
+parameter_order = ['FREQ','FREQOFF','FREQSSB','POWER','CALL','MSG']
+cached_parameters = ['FREQ','FREQOFF','FREQSSB','POWER','CALL','MSG']
+sync_command = 'INHIBIT'
+
+
+class Response(object):
+    # The reply to a single command. PARAM,value lines are collected in params, and the
+    # future completes with 'OK', 'ERROR', or None if the connection went away.
+
+    def __init__(self,command,loop,client=None):
+        self.command = command
+        # The AsyncQITX to resynchronise if no reply arrives in time.
+        self.client = client
+        self.params = []
+        self.sent = time.time()
+        self.received = None
+        self.future = loop.create_future()
+
+    def complete(self,status):
+        self.received = time.time()
+        if not self.future.done():
+            self.future.set_result(status)
+
+    async def wait(self,timeout=None):
+        # Returns the status, or None on timeout. Being cancelled leaves the command queued, so
+        # its reply is still consumed when it turns up. Timing out resynchronises the client.
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.future),timeout)
+        except asyncio.TimeoutError:
+            if self.client is not None and not self.future.done():
+                self.client.resync()
+            return self.status
+
+    @property
+    def status(self):
+        if self.future.done():
+            return self.future.result()
+        return None
+
+    @property
+    def ok(self):
+        return self.status == 'OK'
+
+    @property
+    def value(self):
+        if len(self.params) > 0:
+            return self.params[-1][1]
+        return None
+
+    @property
+    def latency(self):
+        if self.received is None:
+            return None
+        return self.received - self.sent
+
+
+class QITXProtocol(asyncio.Protocol):
+    # Frames incoming data into lines for an AsyncQITX.
+
+    def __init__(self,client):
+        self.client = client
+        self.buf = b''
+
+    def connection_made(self,transport):
+        self.client.transport = transport
+
+    def data_received(self,data):
+        self.buf += data
+        while b'\n' in self.buf:
+            line,self.buf = self.buf.split(b'\n',1)
+            self.client.handle_line(line.rstrip(b'\r').decode('ascii','replace'))
+
+    def connection_lost(self,exc):
+        self.client.connection_lost(exc)
+
+
+class SerialTransport(asyncio.Transport):
+    # Minimal transport for when pyserial-asyncio isn't installed. Reads are driven by the
+    # event loop watching the port's file descriptor. Writes go straight to the port; commands
+    # are short, and PSKTERM data is paced well below the link rate, so they don't block.
+
+    def __init__(self,loop,port,protocol):
+        asyncio.Transport.__init__(self)
+        self.loop = loop
+        self.port = port
+        self.protocol = protocol
+        self.closing = False
+        self.loop.add_reader(self.port.fileno(),self.read_ready)
+        self.protocol.connection_made(self)
+
+    def read_ready(self):
+        try:
+            data = self.port.read(self.port.in_waiting or 1)
+        except (serial.SerialException,OSError) as e:
+            self.abort(e)
+            return
+        if data:
+            self.protocol.data_received(data)
+
+    def write(self,data):
+        try:
+            self.port.write(data)
+        except (serial.SerialException,OSError) as e:
+            self.abort(e)
+
+    def is_closing(self):
+        return self.closing
+
+    def close(self):
+        self.abort(None)
+
+    def abort(self,exc=None):
+        if self.closing:
+            return
+        self.closing = True
+        self.loop.remove_reader(self.port.fileno())
+        self.port.close()
+        self.loop.call_soon(self.protocol.connection_lost,exc)
+
+
+class AsyncQITX(object):
+
+    def __init__(self,serial_device=default_serial_device):
+        self.serial_device = serial_device
+        self.transport = None
+        self.running = False
+        self.closed = None
+        # Set during a PSKTERM stream, when anything written would be transmitted as data.
+        self.streaming = False
+        # Commands awaiting a reply, oldest first.
+        self.pending = deque()
+        self.unsolicited = deque(maxlen=100)
+        self.timeout_count = 0
+        self.last_timeout = None
+        self.timeout_callbacks = []
+        # The command sent to resynchronise, while we're waiting for its reply, and how many
+        # times that has been needed.
+        self.sync = None
+        self.resyncs = 0
+        self.rtt = deque(maxlen=50)
+        self.configure_stats = None
+        # Last known value of each of the cached_parameters on the device.
+        self.state = {}
+
+    async def connect(self):
+        # Open the serial port and fill the parameter cache.
+        loop = asyncio.get_running_loop()
+        self.invalidate()
+        self.closed = loop.create_future()
+        try:
+            if serial_asyncio_enabled:
+                await serial_asyncio.create_serial_connection(loop,lambda: QITXProtocol(self),self.serial_device,baudrate=38400)
+            else:
+                port = serial.Serial(self.serial_device,38400,timeout=0)
+                SerialTransport(loop,port,QITXProtocol(self))
+        except (serial.SerialException,OSError) as e:
+            print("ERROR: " + str(e))
+            return False
+
+        self.running = True
+        await self.refresh_state()
+        return True
+
+    async def reconnect(self):
+        await self.close()
+        return await self.connect()
+
+    async def close(self):
+        if self.transport is not None and self.running:
+            self.transport.close()
+            await self.closed
+        self.transport = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self,*args):
+        await self.close()
+
+    def connection_lost(self,exc):
+        if exc is not None:
+            print("ERROR: " + str(exc))
+        self.running = False
+        # As in QITX.py: wake everyone up, and don't trust the cache after a disconnect.
+        self.invalidate()
+        while self.pending:
+            self.pending.popleft().complete(None)
+        if self.closed is not None and not self.closed.done():
+            self.closed.set_result(True)
+
+    def invalidate(self):
+        self.state.clear()
+
+    async def refresh_state(self):
+        # Read all of the cached parameters in one pipelined batch.
+        self.invalidate()
+        responses = [(name,self.send_command(name)) for name in cached_parameters]
+        for name,r in responses:
+            if await r.wait(command_timeout) == 'OK' and r.value is not None:
+                self.state[name] = r.value
+        return len(self.state) == len(cached_parameters)
+
+    def resync(self):
+        # A command has gone unanswered past its deadline, as in QITX.resync(): give up on
+        # everything pending, send sync_command, and throw away every line until its reply.
+        if not self.running or self.streaming:
+            # Anything written now would be transmitted. The stream's own reply will time
+            # out after its EOT if the firmware really has stopped answering.
+            return
+        while self.pending:
+            self.pending.popleft().complete(None)
+        self.invalidate()
+        self.resyncs += 1
+        self.sync = Response(sync_command,asyncio.get_running_loop())
+        self.pending.append(self.sync)
+        self.write(sync_command+"\n")
+
+    def handle_line(self,line):
+        if self.sync is not None and self.pending and self.pending[0] is self.sync:
+            # Resynchronising. Only the sync's own reply (a value line, then OK) counts, anything
+            # else is a late reply to an abandoned command.
+            if line.startswith(sync_command+','):
+                self.sync.params.append(tuple(line.split(',',1)))
+                return
+            if line == 'OK' and len(self.sync.params) > 0:
+                self.pending.popleft().complete(line)
+                self.sync = None
+                return
+            if line != 'TIMEOUT':
+                if len(line) > 0:
+                    self.unsolicited.append(line)
+                return
+        if line == 'OK' or line == 'ERROR':
+            if self.pending:
+                self.pending.popleft().complete(line)
+            else:
+                self.unsolicited.append(line)
+        elif line == 'TIMEOUT':
+            self.timeout_count += 1
+            self.last_timeout = time.time()
+            self.invalidate()
+            for callback in self.timeout_callbacks:
+                # A broken callback mustn't take data_received() down with it.
+                try:
+                    callback()
+                except Exception as e:
+                    print("ERROR: Timeout callback failed: " + repr(e))
+        elif line.find(',') != -1 and self.pending:
+            self.pending[0].params.append(tuple(line.split(',',1)))
+        elif len(line) > 0:
+            self.unsolicited.append(line)
+
+    def write(self,data):
+        if isinstance(data,str):
+            data = data.encode('ascii')
+        self.transport.write(data)
+
+    def send_command(self,string):
+        # Send a command without waiting for the reply. Returns a Response.
+        r = Response(string,asyncio.get_running_loop(),self)
+        if not self.running:
+            r.complete(None)
+            return r
+        if self.streaming:
+            print("ERROR: PSKTERM stream in progress, not sending " + string)
+            r.complete(None)
+            return r
+        self.pending.append(r)
+        self.write(string+"\n")
+        return r
+
+    async def command(self,string,timeout=command_timeout):
+        return await self.send_command(string).wait(timeout) == 'OK'
+
+    async def get_parameter(self,string):
+        if string in self.state:
+            return self.state[string]
+        r = self.send_command(string)
+        if await r.wait(command_timeout) == 'OK' and r.value is not None:
+            self.rtt.append(r.latency)
+            self.update_state(string,r)
+            return r.value
+        return -1
+
+    async def set_parameter(self,string,arg):
+        # Setting a parameter to the value it already has is a no-op, as in QITX.py.
+        if self.state.get(string) == arg:
+            return True
+        r = self.send_command(string+","+arg)
+        await r.wait(command_timeout)
+        self.update_state(string,r)
+        if r.ok and r.value == arg:
+            self.rtt.append(r.latency)
+            return True
+        else:
+            return False
+
+    def update_state(self,name,r):
+        if name not in cached_parameters:
+            return
+        if r.ok and r.value is not None:
+            self.state[name] = r.value
+        else:
+            self.state.pop(name,None)
+
+    async def configure(self,**params):
+        # Set several parameters at once, pipelined. Returns a dictionary of parameter name -> True/False.
+        params = dict((name.upper(),str(value)) for name,value in params.items())
+        names = [x for x in parameter_order if x in params] + sorted(x for x in params if x not in parameter_order)
+
+        start = time.time()
+        results = {}
+        responses = []
+        for name in names:
+            if self.state.get(name) == params[name]:
+                results[name] = True
+            else:
+                responses.append((name,self.send_command(name+","+params[name])))
+
+        for name,r in responses:
+            await r.wait(command_timeout)
+            self.update_state(name,r)
+            results[name] = (r.ok and r.value == params[name])
+        self.configure_stats = {'count': len(responses), 'elapsed': time.time() - start}
+
+        return results
+
+    async def tx_inhibited(self):
+        return await self.get_parameter('INHIBIT') == "ON"
+
+    async def clear_inhibit(self):
+        return await self.set_parameter('INHIBIT','OFF')
+
+    async def transmit_psk(self,baudrate=31):
+        return await self.command('PSK,'+str(baudrate),transmit_timeout)
+
+    async def transmit_psk_stream(self,data,baudrate=31,preamble=3,postamble=1):
+        # Stream a string through PSKTERM, paced against varicode.PSKPacer as in QITX.py.
+        # If cancelled, the stream is ended with an EOT (whatever is already in the firmware
+        # buffer still goes out) before the cancellation is passed on.
+        if '\x04' in data:
+            print("ERROR: EOT would terminate the PSKTERM stream.")
+            return False
+        varicode.airtime(data,baudrate)
+        pacer = varicode.PSKPacer(baudrate)
+
+        r = self.send_command('PSKTERM,'+str(baudrate))
+        if r.future.done():
+            return False
+        self.streaming = True
+        try:
+            await asyncio.sleep(preamble)
+            pacer.reset(time.time())
+
+            for c in data:
+                wait = pacer.wait_time(time.time())
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self.write(c)
+                pacer.push(c,time.time())
+
+            await asyncio.sleep(max(0,pacer.air_free - time.time()) + postamble)
+        finally:
+            if self.running:
+                self.write('\x04')
+            self.streaming = False
+
+        return await r.wait(command_timeout) == 'OK'
+
+    async def transmit_rtty(self,baudrate=50,shift=170):
+        return await self.command('RTTY,'+str(baudrate)+','+str(shift),transmit_timeout)
+
+    async def transmit_selcall(self,source=1881,dest=1882,chantest=True):
+        if chantest:
+            return await self.command('SELTEST,'+str(source)+','+str(dest),transmit_timeout)
+        else:
+            return await self.command('SELCALL,'+str(source)+','+str(dest),transmit_timeout)
+
+    async def transmit_ident(self):
+        return await self.command('IDENT',transmit_timeout)
+
+    async def transmit_domino(self):
+        return await self.command('DOMINO',transmit_timeout)
+
+
+async def demo(serial_device):
+    async with AsyncQITX(serial_device) as tx:
+        if not tx.running:
+            return
+        print("Connected. Frequency: " + str(await tx.get_parameter('FREQ')))
+        print("Configure: " + str(await tx.configure(FREQ='7038000',POWER='HIGH',CALL='VK5QI')))
+
+        # Something else for the event loop to do while we transmit.
+        async def ticker():
+            while True:
+                await asyncio.sleep(1)
+                print("... %d commands waiting" % len(tx.pending))
+        tick = asyncio.ensure_future(ticker())
+
+        start = time.time()
+        print("Ident: " + str(await tx.transmit_ident()) + " (%.1f s)" % (time.time() - start))
+
+        # A stream cut short by a timeout.
+        start = time.time()
+        try:
+            await asyncio.wait_for(tx.transmit_psk_stream("DE VK5QI "*10,63,1,0),5)
+        except asyncio.TimeoutError:
+            print("PSK63 stream cancelled after %.1f s" % (time.time() - start))
+        print("Still talking: " + str(await tx.get_parameter('INHIBIT')))
+
+        tick.cancel()
+
+def main():
+    sim = None
+    if len(sys.argv) >= 2:
+        serial_device = sys.argv[1]
+    else:
+        import qitx_sim
+        sim = qitx_sim.QITXSimulator()
+        sim.start()
+        serial_device = sim.port
+        print("Using simulator on " + serial_device)
+
+    asyncio.run(demo(serial_device))
+
+    if sim is not None:
+        print("Transmissions: " + ", ".join("%s %.1fs" % (t['mode'],t['end']-t['start']) for t in sim.transmissions if t['end'] is not None))
+        sim.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# QITX Beacon Daemon
+#
+# A long-running alternative to starting beacon_json.py from cron every cycle.
+# The config and schedule files are read once, and only read again when they change on disk.
+# The transmitter connection and PA control are held for the life of the daemon, so the serial
+# port isn't reopened (resetting the Leonardo) and the parameters aren't re-sent before every cycle.
+# The schedule is repeated every cycle_period seconds, with cycles aligned to UTC.
+# The transmitter is looked after by supervisor.py, which hard resets and reconnects it if it
+# hangs, sends TIMEOUT or drops off the USB bus, then carries on from the next slot.
+#
+# Usage: python beacon_daemon.py config.cfg schedule.json
+#
+# The config file may contain an optional [Daemon] section:
+#   cycle_period = 300                  Seconds between schedule starts. Defaults to the length
+#                                       of the schedule, rounded up to whole minutes.
+#   status_file = ./beacon_status.json  Run status, rewritten whenever the daemon changes state.
+#
+# Stop with SIGTERM or Ctrl-C. The PA is switched off on the way out.
+#
+# Copyright 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+import os,sys,time,math,json,signal,ConfigParser
+import scheduler,beacon_json,schedule_compiler,supervisor
+
+default_status_file = "./beacon_status.json"
+
+# How long before each cycle the files are checked and the transmitter set up.
+setup_time = 10.0
+
+# Number of slot start errors kept in the status file.
+status_log_length = 20
+
+
+def read_daemon_config(filename):
+    # Read the optional [Daemon] section. Missing settings are returned as None.
+    options = {'cycle_period': None, 'status_file': default_status_file}
+    config = ConfigParser.RawConfigParser()
+    config.read(filename)
+    if config.has_option('Daemon','cycle_period'):
+        options['cycle_period'] = int(config.get('Daemon','cycle_period'))
+    if config.has_option('Daemon','status_file'):
+        options['status_file'] = config.get('Daemon','status_file')
+    return options
+
+def schedule_length(schedule,callsign):
+    # When the last transmission of the schedule finishes, relative to its start, with the
+    # slowest possible payload.
+    entries,errors = schedule_compiler.compile_schedule(schedule,callsign=callsign)
+    return max([e['end'] for e in entries] + [0])
+
+
+class BeaconDaemon(object):
+
+    def __init__(self,config_path,schedule_path):
+        self.config_path = config_path
+        self.schedule_path = schedule_path
+        self.mtimes = None
+        self.conf = None
+        self.options = None
+        self.schedule = None
+        self.cycle_period = 60
+        self.supervisor = None
+        self.table = None
+        self.slots = scheduler.SlotScheduler()
+        self.status = {'pid': os.getpid(), 'started': time.time(), 'state': 'starting',
+            'cycles': 0, 'reloads': 0, 'next_cycle': None, 'current': None}
+
+        if not self.load_files():
+            print "Could not load config and schedule."
+            sys.exit(1)
+
+    def load_files(self):
+        # (Re)read the config and schedule if either has changed on disk since we last read them.
+        # Returns True if new files were loaded.
+        try:
+            mtimes = (os.path.getmtime(self.config_path),os.path.getmtime(self.schedule_path))
+        except OSError as e:
+            print "ERROR:",e
+            return False
+        if mtimes == self.mtimes:
+            return False
+
+        try:
+            conf = beacon_json.read_config(self.config_path)
+            schedule = beacon_json.read_schedule(self.schedule_path)
+            options = read_daemon_config(self.config_path)
+        except (SystemExit,ValueError):
+            # read_config() and read_schedule() exit on a bad file. Carry on with what we had.
+            print "Not reloading, keeping the previous config and schedule."
+            return False
+        errors = beacon_json.check_schedule(schedule,conf)
+        if len(errors) > 0:
+            for error in errors:
+                print "Schedule error: " + error
+            print "Not reloading, keeping the previous config and schedule."
+            return False
+
+        self.mtimes = mtimes
+        self.conf = conf
+        self.schedule = schedule
+        self.options = options
+        if self.table is not None:
+            self.table.close()
+        self.table = beacon_json.open_payload_table(conf)
+
+        if options['cycle_period'] is not None:
+            self.cycle_period = options['cycle_period']
+        else:
+            length = schedule_length(schedule,conf['mycall'])
+            self.cycle_period = max(1,int(math.ceil(length/60.0)))*60
+
+        print "Loaded " + self.config_path + " and " + self.schedule_path
+        beacon_json.print_config(conf)
+        beacon_json.print_schedule(schedule)
+        print "Cycle period: %d seconds" % self.cycle_period
+
+        self.status['reloads'] += 1
+        self.status['loaded'] = time.time()
+        self.status['cycle_period'] = self.cycle_period
+        return True
+
+    def write_status(self,state=None):
+        if state is not None:
+            self.status['state'] = state
+        self.status['updated'] = time.time()
+        self.status['connected'] = self.supervisor is not None and self.supervisor.tx is not None and self.supervisor.tx.running
+        if self.supervisor is not None:
+            self.status['recoveries'] = self.supervisor.recoveries[-status_log_length:]
+        self.status['slots'] = [{'mode': label, 'scheduled': utc, 'error_ms': error*1000.0}
+            for (label,utc,error) in self.slots.log[-status_log_length:]]
+        # Write to a temporary file and rename it over the old one, so readers never see half a file.
+        filename = self.options['status_file']
+        try:
+            f = open(filename + ".tmp",'w')
+            f.write(json.dumps(self.status,indent=2,sort_keys=True))
+            f.close()
+            os.rename(filename + ".tmp",filename)
+        except (IOError,OSError) as e:
+            print "Could not write status file:",e
+
+    def setup_transmitter(self):
+        # Open the transmitter if we don't have it (or the config now points somewhere else),
+        # recover it if it has stopped answering, then make sure its settings match the config.
+        # Values already on the device aren't sent again, so this is normally free.
+        conf = self.conf
+        if self.supervisor is not None and self.supervisor.conf['serial_device'] != conf['serial_device']:
+            self.supervisor.close()
+            self.supervisor = None
+
+        if self.supervisor is None:
+            self.supervisor = supervisor.Supervisor(conf)
+        self.supervisor.conf = conf
+        return self.supervisor.connect()
+
+    def on_start(self,tx_setting,scheduled_time):
+        self.status['current'] = {'mode': tx_setting["mode"], 'scheduled': scheduled_time}
+        self.write_status('transmitting')
+
+    def run_cycle(self,start_time):
+        self.slots.wait_until(start_time - setup_time,"setup")
+        # Only the transmissions belong in the slot log.
+        self.slots.log.pop()
+
+        if self.load_files() and start_time % self.cycle_period != 0:
+            # The cycle period changed. Start again on the new cycle boundary.
+            return
+
+        if not self.setup_transmitter():
+            print "No transmitter, skipping cycle."
+            self.status['skipped'] = self.status.get('skipped',0) + 1
+            self.write_status('disconnected')
+            return
+
+        txdata = beacon_json.generate_txstring(start_time,self.table)
+        print "Start Time: " + txdata["timeseed"]
+        print "Data Sequence: " + txdata["randomdata"]
+
+        # Switches the PA on for the schedule, and off again afterwards.
+        self.supervisor.run_schedule(self.schedule,txdata,start_time,self.on_start,self.slots)
+
+        self.status['cycles'] += 1
+        self.status['current'] = None
+        self.status['last_cycle'] = start_time
+        # Don't let the slot log grow forever.
+        del self.slots.log[:-status_log_length]
+
+    def run(self):
+        try:
+            while True:
+                start_time = self.slots.next_boundary(self.cycle_period)
+                self.status['next_cycle'] = start_time
+                self.write_status('waiting')
+                print "Next cycle at " + time.strftime("%H:%M:%S",time.gmtime(start_time)) + " UTC"
+                self.run_cycle(start_time)
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        print "Shutting down."
+        if self.supervisor is not None:
+            self.supervisor.close()
+        self.write_status('stopped')
+
+
+def handle_sigterm(signum,frame):
+    # Unwind through the finally blocks, so the PA is switched off.
+    sys.exit(0)
+
+def main():
+    config_path = beacon_json.configfile
+    schedule_path = beacon_json.schedulefile
+
+    if len(sys.argv)>=3:
+        config_path = sys.argv[1]
+        schedule_path = sys.argv[2]
+
+    signal.signal(signal.SIGTERM,handle_sigterm)
+
+    daemon = BeaconDaemon(config_path,schedule_path)
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
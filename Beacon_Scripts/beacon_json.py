@@ -23,8 +23,7 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this library.  If not, see <http://www.gnu.org/licenses/>.
 
-import time,sys,random,string,ConfigParser,QITX,binascii,json
-from datetime import datetime,timedelta
+import time,sys,ConfigParser,QITX,json,scheduler,payload,schedule_compiler
 
 configfile = "./example.cfg"
 
@@ -48,6 +47,9 @@ def read_config(filename=configfile):
         conf['inhibitactive'] = config.getboolean('SiteInfo','inhibitactive')
         conf['gracetime'] = int(config.get('SiteInfo','gracetime'))
         conf['gracecount'] = int(config.get('SiteInfo','gracecount'))
+        conf['payload_table'] = None
+        if config.has_option('SiteInfo','payload_table'):
+            conf['payload_table'] = config.get('SiteInfo','payload_table')
     except:
         print "Error reading config file"
         sys.exit(1)
@@ -65,6 +67,13 @@ def read_schedule(filename=schedulefile):
         
     return schedule
     
+def check_schedule(sked,conf):
+    # Check the schedule's timing with the slowest possible payload. Returns a list of the
+    # entries which would overlap, run into the firmware's TX_TIMEOUT, or can't be sent,
+    # empty if the schedule is good.
+    entries,errors = schedule_compiler.compile_schedule(sked,callsign=conf['mycall'])
+    return errors
+
 def print_schedule(sked):
     print "\nSchedule as follows:\n"
     print "Time, Mode"
@@ -78,130 +87,138 @@ def print_config(conf):
     print "Transmit Offset:    " + conf["freqoff"]
     print "Transmit Power:     " + conf["power"]
 
-def generate_txstring():
-    
-    txdata = {} 
-    
-    #Generate our random string, using the current date and time as a seed.
-    next_minute = datetime.utcnow() + timedelta(0,0,0,0,1,0)
+def generate_txstring(start_time=None,table=None):
     
-    txdata["timeseed"] = next_minute.strftime("%d-%m-%Y %H:%M")
+    #Generate our random string, using the start time (by default, the next minute) as a seed.
+    if start_time is None:
+        start_time = time.time() + 60
     
-    new_random = random.WichmannHill()
-    new_random.seed(binascii.crc32(txdata["timeseed"]))
-    txdata["randomdata"] = ''.join(new_random.choice(string.ascii_uppercase + string.ascii_lowercase + string.digits) for x in range(64))
-    txdata["txstring"] = "DE VK5QI VK5QI $$$$$" + txdata["randomdata"] + "$$$$$" 
-    
-    return txdata
+    return payload.txdata(start_time,table)
+
+def open_payload_table(conf):
+    # Open the precomputed payload table named in the config, if there is one.
+    if conf['payload_table'] is None:
+        return None
+    try:
+        return payload.PayloadTable(conf['payload_table'])
+    except (IOError,ValueError) as e:
+        print "Could not open payload table, generating payloads instead:",e
+        return None
 
 
+# PSKTERM baud rates for each of the schedule's BPSK modes.
+psk_modes = {"BPSK31": 31, "BPSK63": 63, "BPSK125": 125, "BPSK250": 250}
+
 def psk(tx,mode,data):
 
-    if(mode == "BPSK31"):
-        print "Transmitting: PSK31"
-        tx.s.write("PSKTERM,31\n")
-        interchar_delay = 0.4
-    elif(mode == "BPSK63"):
-        print "Transmitting: PSK63"
-        tx.s.write("PSKTERM,63\n")
-        interchar_delay = 0.25
-    elif(mode == "BPSK125"):
-        print "Transmitting: PSK125"
-        tx.s.write("PSKTERM,125\n")
-        interchar_delay = 0.1
-    elif(mode == "BPSK250"):
-        print "Transmitting: PSK250"
-        tx.s.write("PSKTERM,250\n")
-        interchar_delay = 0.1
-    else:
+    if mode not in psk_modes:
         print "Invalid BPSK Mode"
         return -1
         
-    print "Expected TX Time: " + str(len(data)*interchar_delay + 4) + " seconds."
-    
-    # Transmit phase reversals for a few seconds, to allow the receiver to lock on
-    time.sleep(3)
-    # Transmit our string character by character
-    for x in data:
-        tx.s.write(x)
-        time.sleep(interchar_delay)
+    baudrate = psk_modes[mode]
+    print "Transmitting: PSK" + str(baudrate)
     
-    # Transmit phase reversals for a second, then end transmission.
-    time.sleep(1)
-    tx.s.write("\x04")
+    # 3 seconds of phase reversals to allow the receiver to lock on, the data, then 1 more second of reversals.
+    print "Expected TX Time: %.1f seconds." % schedule_compiler.psk_airtime(data,baudrate)
     
-    # Wait for Modem to report it has finished
-    while tx.s.inWaiting()<4 :
-        time.sleep(0.5)
-        
-    data = tx.s.readline()
-    if data.startswith('OK'):
+    # PSKFLOW, or PSKTERM if the firmware is too old for flow control.
+    if tx.transmit_psk_flow(data,baudrate,3,1):
         print "... OK"
     else:
         print "... something broke?"
+        return -1
 
     return 0
 
 
-# Main Script
-wait_for_minute = True
-
-if len(sys.argv)>=3:
-    configfile = sys.argv[1]
-    schedulefile = sys.argv[2]
-
-if len(sys.argv)>=4:
-    wait_for_minute = False
-conf =  read_config(configfile)
-schedule =  read_schedule(schedulefile)
-
-print_config(conf)
-print_schedule(schedule)
-txdata = generate_txstring()
-print "Start Time: " + txdata["timeseed"]
-print "Data Sequence: " + txdata["randomdata"]
+def run_schedule(tx,schedule,txdata,start_time,on_start=None,slots=None):
+    # Transmit each entry in the schedule, with start times relative to start_time.
+    # If given, on_start(tx_setting,scheduled_time) is called just before each transmission.
+    # Returns the start error, duration and result of each transmission.
+    if slots is None:
+        slots = scheduler.SlotScheduler()
+    
+    results = []
+    for tx_setting in schedule:
+        # Wait until the set start time
+        print "Next: " + str(tx_setting["starttime"]) + " , " + tx_setting["mode"]
+        
+        # Set up frequency now:
+        if "freq" in tx_setting:
+            tx.set_parameter("FREQ",str(tx_setting['freq']))
+        
+        # Wait until the correct time to start. Transmit immediately if we're past that time for some reason.
+        scheduled_time = start_time + int(tx_setting["starttime"])
+        error = slots.wait_until(scheduled_time,tx_setting["mode"])
+        print "Start error: %.1f ms" % (error*1000)
+            
+        if on_start is not None:
+            on_start(tx_setting,scheduled_time)
+
+        started = time.time()
+        ok = False
+        if(tx_setting["mode"] == "IDENT"):
+            ok = tx.transmit_ident()
+        elif(tx_setting["mode"].find("BPSK") != -1):
+            ok = psk(tx,tx_setting["mode"],txdata["txstring"]) == 0
+        
+        results.append({'mode': tx_setting["mode"], 'scheduled': scheduled_time, 'start_error': error,
+            'duration': time.time() - started, 'ok': ok})
+    
+    return results
 
 
-# Connect to the transmitter
-tx = QITX.QITX(conf['serial_device'])
+def main():
+    wait_for_minute = True
+    config_path = configfile
+    schedule_path = schedulefile
 
-# Setup the transmitter
-tx.set_parameter("FREQ",conf['freq'])
-tx.set_parameter("FREQOFF",conf['freqoff'])
-tx.set_parameter("FREQSSB",conf['freqssb'])
-tx.set_parameter("POWER",conf['power'])
-tx.set_parameter("CALL",conf['mycall'])
+    if len(sys.argv)>=3:
+        config_path = sys.argv[1]
+        schedule_path = sys.argv[2]
 
-# Turn the PA on.
-tx.power_on(True)
+    if len(sys.argv)>=4:
+        wait_for_minute = False
+    conf =  read_config(config_path)
+    schedule =  read_schedule(schedule_path)
 
-print "Waiting until start of minute."
-# Wait until 0 seconds (start of next minute)
-while(time.gmtime().tm_sec != 0 and wait_for_minute):
-    time.sleep(0.1)
+    print_config(conf)
+    print_schedule(schedule)
+    errors = check_schedule(schedule,conf)
+    for error in errors:
+        print "Schedule error: " + error
+    if len(errors) > 0:
+        sys.exit(1)
+    txdata = generate_txstring(table=open_payload_table(conf))
+    print "Start Time: " + txdata["timeseed"]
+    print "Data Sequence: " + txdata["randomdata"]
 
-start_time = int(time.time())
 
-for tx_setting in schedule:
-    # Wait until the set start time
-    print "Next: " + str(tx_setting["starttime"]) + " , " + tx_setting["mode"]
-    
-    # Set up frequency now:
-    if "freq" in tx_setting:
-        tx.set_parameter("FREQ",str(tx_setting['freq']))
-    
-    # Wait until the correct time to start. Transmit immediately if we're past that time for some reason.
-    while (int(time.time()) - start_time) < int(tx_setting["starttime"]):
-        time.sleep(0.1)
+    # Connect to the transmitter
+    tx = QITX.QITX(conf['serial_device'])
 
-    if(tx_setting["mode"] == "IDENT"):
-        tx.transmit_ident()
-    elif(tx_setting["mode"].find("BPSK") != -1):
-        psk(tx,tx_setting["mode"],txdata["txstring"])
+    # Setup the transmitter
+    results = tx.configure(FREQ=conf['freq'],FREQOFF=conf['freqoff'],FREQSSB=conf['freqssb'],POWER=conf['power'],CALL=conf['mycall'])
+    for name in results:
+        if not results[name]:
+            print "Failed to set " + name
+    print "Setup took %.1f ms (about %.1f ms saved)" % (tx.configure_stats['elapsed']*1000, tx.configure_stats['saved_estimate']*1000)
 
+    # Turn the PA on.
+    tx.power_on(True)
 
-tx.power_on(False)
-tx.close()
+    slots = scheduler.SlotScheduler()
+    if wait_for_minute:
+        print "Waiting until start of minute."
+        # Wait until 0 seconds (start of next minute)
+        start_time = slots.wait_for_next(60,"minute")
+    else:
+        start_time = time.time()
 
+    run_schedule(tx,schedule,txdata,start_time,slots=slots)
 
+    tx.power_on(False)
+    tx.close()
 
+if __name__ == "__main__":
+    main()
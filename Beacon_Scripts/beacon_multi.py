@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# QITX Multi-Transmitter Beacon Script
+#
+# Runs the schedules of several QITX boards from one process, in place of one beacon_json.py
+# per board. Like beacon_json.py, this needs to be run in the minute before the transmissions
+# are scheduled to start.
+#
+# Each board gets its own thread, which sets the board up and then works through its schedule,
+# so a board busy with a long ident or PSK transmission never holds up another board's slots.
+# Once every board has finished, the start error and duration of every transmission is reported.
+# Each board's schedule is checked (beacon_json.check_schedule()) before anything is set up, and
+# everything a board's thread prints is prefixed with its name. Ctrl-C turns every board's PA
+# off straight away, then stops the threads, letting a transmission already under way finish
+# for up to stop_timeout seconds.
+#
+# The devices file is a json array with one dictionary per board, e.g.:
+# [
+# {"name": "40m", "config": "example.cfg", "schedule": "schedules/standard.json"},
+# {"name": "20m", "config": "example.cfg", "schedule": "schedules/psk_highspeed.json",
+#  "serial_device": "/dev/ttyACM1", "power_control_pin": 24, "freq": 14070000}
+# ]
+# "serial_device", "power_control_pin" and "freq", if given, override the values in the config file,
+# so boards at the one site can share a config file. A device's "freq" also replaces any "freq" in its
+# schedule entries, so the board stays on that frequency for the whole schedule.
+#
+# Usage: python beacon_multi.py [-o report.json] [--now] devices.json
+# See example_devices.json.
+#
+# Copyright 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse,json,sys,threading,time
+import QITX,scheduler,beacon_json,transport
+
+# Settings which may be given per device, and the config entries they replace.
+device_overrides = {'serial_device': 'serial_device', 'power_control_pin': 'power_pin', 'freq': 'freq'}
+
+# How long to wait for the boards to stop after Ctrl-C (s).
+stop_timeout = 10.0
+
+
+class Stopped(Exception):
+    # Raised in a DeviceRunner's thread to abandon its schedule.
+    pass
+
+
+class PrefixedOutput(object):
+    # Stands in for sys.stdout, putting the device name in front of every line printed by a
+    # DeviceRunner, so the output of several boards can be told apart.
+
+    def __init__(self,stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        # Device name -> the part of a line printed so far.
+        self.partial = {}
+        self.local = threading.local()
+
+    # The print statement keeps track of whether it owes a space in the file's softspace. Keep
+    # it per thread, or one thread's print puts a stray space at the start of another's line.
+    @property
+    def softspace(self):
+        return getattr(self.local,'softspace',0)
+
+    @softspace.setter
+    def softspace(self,value):
+        self.local.softspace = value
+
+    def write(self,data):
+        runner = threading.current_thread()
+        if not isinstance(runner,DeviceRunner):
+            self.stream.write(data)
+            return
+        name = runner.device['name']
+        with self.lock:
+            lines = (self.partial.pop(name,'') + data).split('\n')
+            if lines[-1] != '':
+                self.partial[name] = lines[-1]
+            for line in lines[:-1]:
+                self.stream.write(name + ": " + line + "\n")
+
+    def flush(self):
+        self.stream.flush()
+
+
+class StoppableSlots(scheduler.SlotScheduler):
+    # A SlotScheduler whose waits end early, raising Stopped, once 'stopping' is set.
+
+    def __init__(self,stopping):
+        scheduler.SlotScheduler.__init__(self)
+        self.stopping = stopping
+
+    def wait_until(self,utc,label=None):
+        # Leave the last second to the accurate wait.
+        while utc - time.time() > 1.0:
+            if self.stopping.wait(min(utc - time.time() - 1.0,1.0)):
+                raise Stopped()
+        if self.stopping.is_set():
+            raise Stopped()
+        return scheduler.SlotScheduler.wait_until(self,utc,label)
+
+
+def read_devices(filename):
+    try:
+        f = open(filename)
+        devices = json.loads(f.read())
+        f.close()
+    except:
+        print "Error reading devices file"
+        sys.exit(1)
+
+    for i in range(len(devices)):
+        device = devices[i]
+        device.setdefault('name',str(i))
+        device['conf'] = beacon_json.read_config(device['config'])
+        for key in device_overrides:
+            if key in device:
+                device['conf'][device_overrides[key]] = str(device[key])
+        device['sked'] = beacon_json.read_schedule(device['schedule'])
+        if 'freq' in device:
+            # run_schedule() would otherwise move the board to each entry's frequency.
+            device['sked'] = [dict((k,v) for k,v in entry.items() if k != 'freq') for entry in device['sked']]
+
+    # Check every schedule before any board is set up, as beacon_json.py does.
+    failed = False
+    for device in devices:
+        errors = beacon_json.check_schedule(device['sked'],device['conf'])
+        for error in errors:
+            print device['name'] + ": Schedule error: " + error
+        failed = failed or len(errors) > 0
+    if failed:
+        sys.exit(1)
+    return devices
+
+
+class DeviceRunner(threading.Thread):
+    # Sets up one board and runs its schedule.
+
+    def __init__(self,device,start_time):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.device = device
+        self.start_time = start_time
+        self.stopping = threading.Event()
+        self.slots = StoppableSlots(self.stopping)
+        self.tx = None
+        self.results = []
+        self.error = None
+        self.setup_time = None
+
+    def run(self):
+        conf = self.device['conf']
+        tx = None
+        try:
+            began = time.time()
+            tx = QITX.QITX(conf['serial_device'],int(conf['power_pin']))
+            self.tx = tx
+            if not tx.running:
+                self.error = "Could not open " + conf['serial_device']
+                return
+
+            results = tx.configure(FREQ=conf['freq'],FREQOFF=conf['freqoff'],FREQSSB=conf['freqssb'],POWER=conf['power'],CALL=conf['mycall'])
+            failed = [name for name in results if not results[name]]
+            if len(failed) > 0:
+                print "Failed to set " + ", ".join(failed)
+            self.setup_time = time.time() - began
+
+            txdata = beacon_json.generate_txstring(self.start_time,beacon_json.open_payload_table(conf))
+
+            if self.stopping.is_set():
+                raise Stopped()
+            tx.power_on(True)
+            try:
+                self.results = beacon_json.run_schedule(tx,self.device['sked'],txdata,self.start_time,self.check_stop,self.slots)
+            finally:
+                tx.power_on(False)
+        except Stopped:
+            self.error = "Stopped"
+        except Exception as e:
+            self.error = repr(e)
+        finally:
+            if tx is not None:
+                tx.close()
+
+
+    def check_stop(self,tx_setting,scheduled_time):
+        # run_schedule()'s on_start. Don't start another transmission once we're stopping.
+        if self.stopping.is_set():
+            raise Stopped()
+
+    def stop(self):
+        # Called from the main thread. Turns the PA off now, and stops the schedule at the next
+        # slot. A transmission already under way carries on, with the PA off.
+        self.stopping.set()
+        tx = self.tx
+        if tx is not None:
+            tx.power_on(False)
+
+
+def report(runners):
+    # Combined timing report for all devices.
+    devices = []
+    for runner in runners:
+        entry = {'name': runner.device['name'], 'serial_device': runner.device['conf']['serial_device'],
+            'setup_time': runner.setup_time, 'error': runner.error, 'transmissions': runner.results}
+        errors = [abs(r['start_error']) for r in runner.results]
+        if len(errors) > 0:
+            entry['max_start_error'] = max(errors)
+            entry['mean_start_error'] = sum(errors)/len(errors)
+        devices.append(entry)
+    return devices
+
+def print_report(devices,start_time):
+    print "\nDevice, Port, Slot, Mode, Start error (ms), Duration (s), Result"
+    for d in devices:
+        if d['error'] is not None:
+            print "%s, %s, ERROR: %s" % (d['name'],d['serial_device'],d['error'])
+        for r in d['transmissions']:
+            print "%s, %s, %d, %s, %.1f, %.1f, %s" % (d['name'],d['serial_device'],r['scheduled']-start_time,
+                r['mode'],r['start_error']*1000,r['duration'],"OK" if r['ok'] else "FAILED")
+    print ""
+    for d in devices:
+        if 'max_start_error' in d:
+            print "%s: %d transmissions, start error mean %.1f ms, max %.1f ms, setup %.1f ms" % (d['name'],
+                len(d['transmissions']),d['mean_start_error']*1000,d['max_start_error']*1000,d['setup_time']*1000)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run beacon schedules on several QITX boards")
+    parser.add_argument("devices")
+    parser.add_argument("-o","--output",default=None,help="Write the report to this json file.")
+    parser.add_argument("--now",action="store_true",help="Start straight away, instead of at the next minute.")
+    args = parser.parse_args()
+
+    sys.stdout = PrefixedOutput(sys.stdout)
+    devices = read_devices(args.devices)
+    for device in devices:
+        print "%s: %s (pin %s), %s" % (device['name'],device['conf']['serial_device'],device['conf']['power_pin'],device['schedule'])
+
+    if args.now:
+        # Allow a moment for the boards to be set up.
+        start_time = time.time() + 2
+    else:
+        start_time = scheduler.SlotScheduler().next_boundary(60)
+    print "Start Time: " + time.strftime("%H:%M:%S",time.gmtime(start_time)) + " UTC"
+
+    runners = [DeviceRunner(device,start_time) for device in devices]
+    for runner in runners:
+        runner.start()
+    # Join with a timeout, so Ctrl-C still gets through.
+    try:
+        for runner in runners:
+            while runner.is_alive():
+                runner.join(1)
+    except KeyboardInterrupt:
+        print "Stopping, PA off."
+        for runner in runners:
+            runner.stop()
+        deadline = time.time() + stop_timeout
+        for runner in runners:
+            runner.join(max(0,deadline - time.time()))
+        for runner in runners:
+            if runner.is_alive():
+                print "%s: Still busy, closing the port." % runner.device['name']
+                runner.error = "Stopped during a transmission"
+                tx = runner.tx
+                if tx is not None:
+                    tx.power_on(False)
+                    # End a PSKTERM or PSKFLOW stream, if one is running. Otherwise the firmware
+                    # ignores it.
+                    try:
+                        tx.write('\x04')
+                    except transport.TransportError:
+                        pass
+                    tx.close()
+                    runner.join(2)
+
+    devices_report = report(runners)
+    print_report(devices_report,start_time)
+
+    if args.output is not None:
+        f = open(args.output,'w')
+        f.write(json.dumps({'start_time': start_time, 'devices': devices_report},indent=2,sort_keys=True))
+        f.close()
+
+if __name__ == "__main__":
+    main()
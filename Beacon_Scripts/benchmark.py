@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# QITX Host Benchmarks
+#
+# Drives QITX.py against the firmware simulator (qitx_sim.py) and measures:
+#  - get_parameter/set_parameter latency, both as seen by callers and for a full device round trip.
+#  - Start time error for every entry of one or more schedule files, run through beacon_json.run_schedule().
+#  - Achieved PSKTERM and PSKFLOW characters/second against the theoretical varicode rate, for each BPSK baud rate.
+#
+# Results are written out as JSON, so runs can be compared against each other.
+#
+# --transport picks how QITX.py reaches the simulator: serial (pyserial on its pty, as with a real
+# transmitter), pty (transport.py's PtyTransport) or tcp (through qitx_sim.TCPBridge, standing in
+# for ser2net).
+#
+# Usage: python benchmark.py [-o results.json] [--iterations N] [--skip-schedules] [--transport serial|pty|tcp] [schedule.json ...]
+# With no schedule files given, schedules/standard.json and schedules/psk_highspeed.json are used.
+# The schedules run in real time, so allow a few minutes.
+#
+# Copyright 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse,json,math,platform,time
+import QITX,qitx_sim,varicode,beacon_json
+
+default_schedules = ["schedules/standard.json","schedules/psk_highspeed.json"]
+
+
+def summarise(samples):
+    # Distribution summary of a list of times, in milliseconds.
+    if len(samples) == 0:
+        return None
+    samples = sorted(x*1000.0 for x in samples)
+    def percentile(p):
+        return samples[min(len(samples)-1,int(math.ceil(p/100.0*len(samples)))-1)]
+    return {'count': len(samples), 'min': samples[0], 'mean': sum(samples)/len(samples),
+        'p50': percentile(50), 'p90': percentile(90), 'p99': percentile(99), 'max': samples[-1]}
+
+def timed(function,*args,**kwargs):
+    start = time.time()
+    function(*args,**kwargs)
+    return time.time() - start
+
+def bench_latency(tx,iterations):
+    results = {}
+    results['get_parameter'] = summarise([timed(tx.get_parameter,'FREQ') for i in range(iterations)])
+    results['get_roundtrip'] = summarise([timed(lambda: tx.send_command('FREQ').wait(QITX.command_timeout)) for i in range(iterations)])
+    # Alternate between two frequencies so every set goes to the device (and its EEPROM).
+    freqs = ['7038000','7040000']
+    results['set_parameter'] = summarise([timed(tx.set_parameter,'FREQ',freqs[i%2]) for i in range(iterations)])
+    tx.set_parameter('FREQ',freqs[0])
+    results['set_parameter_unchanged'] = summarise([timed(tx.set_parameter,'FREQ',freqs[0]) for i in range(iterations)])
+    params = {'FREQ': '7038000','FREQOFF': '1000','FREQSSB': 'LSB','POWER': 'HIGH','CALL': 'VK5QI','MSG': 'TEST'}
+    configure_times = []
+    for i in range(max(1,iterations/10)):
+        tx.invalidate()
+        configure_times.append(timed(tx.configure,**params))
+    results['configure'] = summarise(configure_times)
+    return results
+
+def bench_schedule(sim,tx,filename):
+    schedule = beacon_json.read_schedule(filename)
+    txdata = beacon_json.generate_txstring()
+    scheduled = []
+    def on_start(tx_setting,scheduled_time):
+        scheduled.append((tx_setting["mode"],scheduled_time,time.time()))
+
+    first = len(sim.transmissions)
+    start_time = int(time.time()) + 2
+    beacon_json.run_schedule(tx,schedule,txdata,start_time,on_start)
+    transmissions = sim.transmissions[first:]
+
+    entries = []
+    for i in range(len(scheduled)):
+        mode,scheduled_time,host_start = scheduled[i]
+        entry = {'mode': mode, 'scheduled': scheduled_time, 'host_error_ms': (host_start - scheduled_time)*1000.0}
+        if i < len(transmissions):
+            entry['keyed_error_ms'] = (transmissions[i]['start'] - scheduled_time)*1000.0
+            entry['duration'] = transmissions[i]['end'] - transmissions[i]['start']
+        entries.append(entry)
+    return {'file': filename, 'entries': entries,
+        'keyed_error': summarise([x['keyed_error_ms']/1000.0 for x in entries if 'keyed_error_ms' in x])}
+
+def bench_psk(sim,tx):
+    # Both the paced PSKTERM stream, and PSKFLOW with flow control.
+    data = beacon_json.generate_txstring()["txstring"]
+    results = {}
+    for suffix,transmit in [("",tx.transmit_psk_stream),("_FLOW",tx.transmit_psk_flow)]:
+        for baudrate in [31,63,125,250]:
+            dropped = sim.dropped
+            elapsed = timed(transmit,data,baudrate,0,0)
+            sent = sim.transmissions[-1]['data']
+            results["BPSK" + str(baudrate) + suffix] = {'chars': len(data), 'elapsed': elapsed,
+                'achieved_cps': len(data)/elapsed, 'theoretical_cps': varicode.char_rate(data,baudrate),
+                'efficiency': varicode.airtime(data,baudrate)/elapsed,
+                'dropped': sim.dropped - dropped, 'intact': sent == data}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="QITX host benchmarks")
+    parser.add_argument("schedules",nargs="*",default=default_schedules)
+    parser.add_argument("-o","--output",default="benchmark_results.json")
+    parser.add_argument("--iterations",type=int,default=200)
+    parser.add_argument("--skip-schedules",action="store_true")
+    parser.add_argument("--transport",choices=["serial","pty","tcp"],default="serial")
+    args = parser.parse_args()
+
+    sim = qitx_sim.QITXSimulator()
+    sim.start()
+    bridge = None
+    if args.transport == "tcp":
+        bridge = qitx_sim.TCPBridge(sim.port)
+        bridge.start()
+        tx = QITX.QITX(bridge.url)
+    elif args.transport == "pty":
+        tx = QITX.QITX("pty:" + sim.port)
+    else:
+        tx = QITX.QITX(sim.port)
+
+    results = {'time': time.time(), 'python': platform.python_version(), 'platform': platform.platform(),
+        'transport': args.transport}
+
+    print "Measuring command latency..."
+    results['latency'] = bench_latency(tx,args.iterations)
+
+    print "Measuring PSK throughput..."
+    results['psk'] = bench_psk(sim,tx)
+
+    results['schedules'] = []
+    if not args.skip_schedules:
+        for filename in args.schedules:
+            print "Running schedule: " + filename
+            results['schedules'].append(bench_schedule(sim,tx,filename))
+
+    tx.close()
+    if bridge is not None:
+        bridge.stop()
+    sim.stop()
+
+    f = open(args.output,'w')
+    f.write(json.dumps(results,indent=2,sort_keys=True))
+    f.close()
+
+    for name in sorted(results['latency']):
+        print "%-24s p50 %7.2f ms   p99 %7.2f ms" % (name,results['latency'][name]['p50'],results['latency'][name]['p99'])
+    for mode in sorted(results['psk']):
+        r = results['psk'][mode]
+        print "%-13s %6.2f chars/s of %6.2f (%.0f%%), %d dropped" % (mode,r['achieved_cps'],r['theoretical_cps'],r['efficiency']*100,r['dropped'])
+    for sked in results['schedules']:
+        if sked['keyed_error'] is not None:
+            print "%s: start error p50 %.1f ms, max %.1f ms" % (sked['file'],sked['keyed_error']['p50'],sked['keyed_error']['max'])
+    print "Results written to " + args.output
+
+if __name__ == "__main__":
+    main()
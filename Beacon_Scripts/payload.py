@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# payload.py - Beacon payload generation and lookup
+#
+# Every beacon cycle transmits a pseudo-random string, seeded from the cycle's start minute, so
+# receivers can work out what they should have received. The string is the output of Python 2's
+# random.WichmannHill(), seeded with crc32() of the "%d-%m-%Y %H:%M" UTC timestamp and picking
+# characters with choice(). This module is the one place that logic lives, for the transmitters
+# and the receivers alike.
+#
+# The generator is reimplemented here rather than calling random.WichmannHill(), so that it can run
+# over many seeds at once with NumPy (it falls back to plain Python if NumPy isn't installed), and
+# so it gives the same results under Python 3, which no longer has WichmannHill.
+#
+# Payloads for a range of dates can be generated in one pass and saved as a table: a fixed header
+# followed by one fixed-length record per minute, so any minute is found with a single seek.
+#
+# Usage:
+#   python payload.py build table.qpl 2013-06-01 2013-07-01
+#   python payload.py lookup table.qpl "01-06-2013 12:34"
+#
+# Copyright 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+import binascii,calendar,string,struct,sys,time
+
+try:
+    import numpy as np
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
+alphabet = string.ascii_uppercase + string.ascii_lowercase + string.digits
+
+# Number of random characters in a payload, and what is sent around them.
+payload_length = 64
+prefix = "DE VK5QI VK5QI $$$$$"
+suffix = "$$$$$"
+
+# Payloads change every minute.
+step = 60
+
+timeseed_format = "%d-%m-%Y %H:%M"
+
+# Table file header: magic, version, record length, first start time, step, record count.
+table_magic = b"QIPL"
+table_version = 1
+table_header = struct.Struct("<4sHHqII")
+
+# Seeds generated per NumPy pass when building a table, to bound memory use.
+chunk_size = 100000
+
+
+def native(data):
+    # bytes to str, on both Python 2 (where they're the same thing) and Python 3.
+    if str is bytes:
+        return data
+    return data.decode('ascii')
+
+def timeseed(start_time):
+    # The seed string for the minute containing start_time (seconds since the epoch, UTC).
+    return time.strftime(timeseed_format,time.gmtime(start_time))
+
+def parse_timeseed(seed):
+    return calendar.timegm(time.strptime(seed,timeseed_format))
+
+def minute(start_time):
+    # Start of the minute containing start_time.
+    return int(start_time//step)*step
+
+def crc_seed(seed):
+    # crc32() of the seed string, as the signed value Python 2 gives on every platform.
+    crc = binascii.crc32(seed.encode('ascii')) & 0xffffffff
+    if crc >= 0x80000000:
+        crc -= 0x100000000
+    return crc
+
+def generate_seeds(seeds,length=payload_length):
+    # Payload strings for a list of integer seeds.
+    if numpy_enabled:
+        return _generate_numpy(seeds,length)
+    return [_generate_python(seed,length) for seed in seeds]
+
+def _generate_python(seed,length):
+    # WichmannHill.seed(), then choice(alphabet) 'length' times.
+    a, x = divmod(seed,30268)
+    a, y = divmod(a,30306)
+    a, z = divmod(a,30322)
+    x, y, z = x+1, y+1, z+1
+    chars = []
+    for i in range(length):
+        x = (171*x) % 30269
+        y = (172*y) % 30307
+        z = (170*z) % 30323
+        r = (x/30269.0 + y/30307.0 + z/30323.0) % 1.0
+        chars.append(alphabet[int(r*len(alphabet))])
+    return ''.join(chars)
+
+def _generate_numpy(seeds,length):
+    # The same as _generate_python(), for every seed at once. NumPy's integer // and % round
+    # towards minus infinity like Python's, so negative seeds come out the same.
+    a = np.array(seeds,dtype=np.int64)
+    x = a % 30268 + 1
+    a = a // 30268
+    y = a % 30306 + 1
+    a = a // 30306
+    z = a % 30322 + 1
+
+    lookup = np.frombuffer(alphabet.encode('ascii'),dtype=np.uint8)
+    out = np.empty((len(a),length),dtype=np.uint8)
+    for i in range(length):
+        x = (171*x) % 30269
+        y = (172*y) % 30307
+        z = (170*z) % 30323
+        r = (x/30269.0 + y/30307.0 + z/30323.0) % 1.0
+        out[:,i] = lookup[(r*len(alphabet)).astype(np.int64)]
+    data = native(out.tobytes())
+    return [data[i*length:(i+1)*length] for i in range(len(out))]
+
+def generate(start_times,length=payload_length):
+    # Payload strings for a list of start times.
+    return generate_seeds([crc_seed(timeseed(t)) for t in start_times],length)
+
+def txstring(randomdata):
+    return prefix + randomdata + suffix
+
+def txdata(start_time,table=None):
+    # Everything about the payload for the minute containing start_time. Uses the table if one is
+    # given and covers that minute, otherwise generates the payload.
+    randomdata = None
+    if table is not None:
+        randomdata = table.lookup(start_time)
+    if randomdata is None:
+        randomdata = generate([start_time])[0]
+    return {'timeseed': timeseed(start_time), 'randomdata': randomdata, 'txstring': txstring(randomdata)}
+
+
+def build_table(filename,start_time,end_time,length=payload_length):
+    # Write payloads for every minute from start_time up to (not including) end_time.
+    first = minute(start_time)
+    count = max(0,int((end_time - first + step - 1)//step))
+    f = open(filename,'wb')
+    f.write(table_header.pack(table_magic,table_version,length,first,step,count))
+    for i in range(0,count,chunk_size):
+        n = min(chunk_size,count-i)
+        payloads = generate([first + (i+j)*step for j in range(n)],length)
+        f.write(''.join(payloads).encode('ascii'))
+    f.close()
+    return count
+
+class PayloadTable(object):
+
+    def __init__(self,filename):
+        self.filename = filename
+        self.f = open(filename,'rb')
+        header = self.f.read(table_header.size)
+        if len(header) != table_header.size:
+            raise ValueError("Not a payload table: " + filename)
+        magic, version, self.length, self.start, self.step, self.count = table_header.unpack(header)
+        if magic != table_magic or version != table_version:
+            raise ValueError("Not a payload table: " + filename)
+        self.end = self.start + self.count*self.step
+
+    def lookup(self,start_time):
+        # Payload for the minute containing start_time, or None if the table doesn't cover it.
+        index = int((start_time - self.start)//self.step)
+        if index < 0 or index >= self.count:
+            return None
+        self.f.seek(table_header.size + index*self.length)
+        return native(self.f.read(self.length))
+
+    def close(self):
+        self.f.close()
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == "build":
+        start = calendar.timegm(time.strptime(sys.argv[3],"%Y-%m-%d"))
+        end = calendar.timegm(time.strptime(sys.argv[4],"%Y-%m-%d"))
+        began = time.time()
+        count = build_table(sys.argv[2],start,end)
+        print("Wrote %d payloads in %.1f seconds." % (count,time.time()-began))
+    elif len(sys.argv) == 4 and sys.argv[1] == "lookup":
+        table = PayloadTable(sys.argv[2])
+        randomdata = table.lookup(parse_timeseed(sys.argv[3]))
+        if randomdata is None:
+            print("Not in table.")
+        else:
+            print(txstring(randomdata))
+        table.close()
+    else:
+        print("Usage: payload.py build <table> <start YYYY-MM-DD> <end YYYY-MM-DD>")
+        print("       payload.py lookup <table> \"<dd-mm-YYYY HH:MM>\"")
+
+if __name__ == "__main__":
+    main()
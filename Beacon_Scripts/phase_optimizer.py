@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# phase_optimizer.py - BPSK Phase-Shaping Profile Optimizer
+#
+# The BPSK modulator can't pulse-shape, so each phase reversal is instead shaped by stepping
+# the AD9834 phase register through a profile of values, in bpsk_phase_switch() (PSK_STEPS.ino).
+# This searches for a profile with better spectral occupancy than the linear ramp in use now.
+#
+# Each candidate profile is simulated with synth.py at the rate the phase register is written
+# (one step per AD9834_SendWord()), with 12-bit phase words, carrying the beacon payload. The PA
+# is driven from the AD9834's sign bit output, a square wave whose fundamental carries the same
+# phase as the DAC output, so the spectrum around the carrier is that of the complex envelope.
+# From its spectrum we get the power outside the wanted channel (2x the baud rate wide), the
+# adjacent channel power ratio and the 99% occupied bandwidth.
+#
+# A profile is described by its number of steps and the first few coefficients of a sine series
+# added to a linear ramp. Length isn't free: the reversal runs in the Timer1 interrupt, holding off
+# the serial port, and every step is unrolled into flash. So each profile's score has a penalty
+# for every serial byte time it spends in the interrupt, and the length is capped by the ISR time
+# and flash available (step_limit()).
+# The search is a simple evolutionary one: each generation, the best
+# profiles so far are mutated, and the new candidates are simulated in parallel on all CPU cores.
+# Results are kept in a cache file keyed on the phase words, so repeated runs (and candidates
+# which round to the same words) aren't simulated twice.
+#
+# The best profile is printed as the bpsk_phase_switch() source, in the form produced by
+# phase_generator_ad9834.m, ready to be pasted into (or written over) PSK_STEPS.ino.
+#
+# Usage: python phase_optimizer.py [--baud 31] [--generations 20] [--population 32] [-o PSK_STEPS.ino]
+#
+# Copyright 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse,hashlib,json,math,multiprocessing,os,random,sys,time
+import numpy as np
+import varicode,payload,synth
+
+default_cache_file = "./phase_cache.json"
+
+# Sample rate the simulated envelope is averaged down to before taking its spectrum.
+analysis_rate = 8000.0
+
+# Number of sine series coefficients describing a profile's shape.
+shape_terms = 4
+
+# The whole reversal runs inside the BPSK timer interrupt, with interrupts off. Meanwhile PSKTERM
+# and PSKFLOW data keeps arriving at 115200 baud (Serial.begin() in QITX_Remote.ino), ten bits a byte.
+serial_baud = 115200
+byte_time = 10.0/serial_baud
+# Longest the reversal may hold interrupts off (s). The current 181 step profile takes ~0.63ms.
+max_isr_time = 1.0e-3
+# Score penalty for each byte time spent in the interrupt, in the objective's units (dB, or Hz for obw).
+default_byte_penalty = 0.1
+
+# Every step is two AD9834_SendWord() calls in flash (one for each direction of the reversal),
+# about 8 bytes each. The current profile's ~2.9KB fits comfortably, so allow a bit more than that.
+sendword_flash = 8
+flash_budget = 4096
+
+min_steps = 16
+default_max_steps = 256
+
+# Payload used as the test signal. Any fixed minute will do.
+test_time = 1370044800
+
+
+def step_limit(sendword_time):
+    # Most steps a profile can have within max_isr_time and flash_budget.
+    return min(int(max_isr_time/sendword_time),flash_budget//(2*sendword_flash))
+
+def phase_words(degrees):
+    # As phase_generator_ad9834.m: 0-180 degrees to AD9834 phase register values.
+    return [int(round(2047*d/180.0)) for d in degrees]
+
+def profile_degrees(steps,coeffs):
+    # A linear 0-180 degree ramp plus a sine series, which leaves the end points alone.
+    x = np.linspace(0,1,int(steps))
+    shape = x.copy()
+    for i in range(len(coeffs)):
+        shape += coeffs[i]*np.sin(np.pi*(i+1)*x)
+    return list(180*np.clip(shape,0,1))
+
+def switch_source(words):
+    # bpsk_phase_switch(), exactly as phase_generator_ad9834.m prints it.
+    lines = ['void bpsk_phase_switch(){','    bpsk_phase_state++;','    PORTC |= _BV(7);','    if(bpsk_phase_state&1){']
+    lines += ['        AD9834_SendWord(0xC%03X);' % w for w in words]
+    lines += ['    }else{']
+    lines += ['        AD9834_SendWord(0xC%03X);' % w for w in reversed(words)]
+    lines += ['    }','    PORTC &= ~_BV(7);','}']
+    return "\n".join(lines) + "\n"
+
+
+def spectrum(signal,fs,nfft):
+    # Welch power spectral density, Hann window with 50% overlap. Returns (freqs, psd) centred on 0Hz.
+    window = np.hanning(nfft)
+    starts = np.arange(0,len(signal)-nfft+1,nfft//2)
+    segments = signal[starts[:,np.newaxis] + np.arange(nfft)[np.newaxis,:]]*window
+    psd = np.mean(np.abs(np.fft.fft(segments,axis=1))**2,axis=0)
+    freqs = np.fft.fftfreq(nfft,1.0/fs)
+    return np.fft.fftshift(freqs),np.fft.fftshift(psd)
+
+def occupied_bandwidth(freqs,psd,fraction=0.99):
+    # Width holding 'fraction' of the power, leaving equal amounts outside on either side.
+    cumulative = np.cumsum(psd)/np.sum(psd)
+    low = freqs[np.searchsorted(cumulative,(1-fraction)/2)]
+    high = freqs[np.searchsorted(cumulative,1-(1-fraction)/2)]
+    return high - low
+
+def adjacent_power(freqs,psd,channel):
+    # Power in the channels either side, relative to the wanted channel, in dB.
+    wanted = np.sum(psd[np.abs(freqs) <= channel/2.0])
+    adjacent = np.sum(psd[(np.abs(freqs) > channel/2.0) & (np.abs(freqs) <= 1.5*channel)])
+    return 10*math.log10(adjacent/wanted)
+
+def out_of_channel_power(freqs,psd,channel):
+    # Power anywhere outside the wanted channel, relative to the total, in dB. Unlike the adjacent
+    # channel power, this also catches splatter further out.
+    outside = np.sum(psd[np.abs(freqs) > channel/2.0])
+    return 10*math.log10(outside/np.sum(psd))
+
+def evaluate(job):
+    # Simulate one profile. Run in the worker processes, so takes and returns plain data.
+    words, settings = job
+    baudrate = settings['baudrate']
+    sendword_time = settings['sendword_time']
+
+    period = varicode.symbol_period(baudrate)
+    text = payload.txdata(test_time)['txstring']
+    text = text*int(math.ceil(settings['symbols']/float(len(synth.bpsk_reversals(text,baudrate)))))
+
+    # Simulate with one sample per phase register write, then average down to analysis_rate.
+    fine = synth.Synthesizer(1.0/sendword_time,0,words,sendword_time)
+    envelope = fine.bpsk(text,baudrate,0,0)[:int(settings['symbols']*period/sendword_time)]
+    decimation = max(1,int(fine.fs/analysis_rate))
+    envelope = envelope[:len(envelope)//decimation*decimation].reshape(-1,decimation).mean(axis=1)
+    fs = fine.fs/decimation
+
+    # Resolution of at least 1/16th of the baud rate.
+    nfft = 1 << int(math.ceil(math.log(fs*16/baudrate,2)))
+    freqs,psd = spectrum(envelope,fs,nfft)
+    return {'steps': len(words), 'duration': len(words)*sendword_time,
+        'obw': occupied_bandwidth(freqs,psd), 'acpr': adjacent_power(freqs,psd,settings['channel']),
+        'oob': out_of_channel_power(freqs,psd,settings['channel'])}
+
+def describe(result):
+    return "%d steps (%.2f ms, %.1f byte times), out of channel %.1f dB, ACPR %.1f dB, OBW %.1f Hz" % (result['steps'],
+        result['duration']*1000,result['duration']/byte_time,result['oob'],result['acpr'],result['obw'])
+
+
+class ProfileOptimizer(object):
+
+    def __init__(self,baudrate=31,max_steps=default_max_steps,sendword_time=synth.SENDWORD_TIME,
+            objective='oob',cache_file=default_cache_file,processes=None,symbols=256,channel=None,
+            byte_penalty=default_byte_penalty):
+        self.settings = {'baudrate': baudrate, 'sendword_time': sendword_time, 'symbols': symbols,
+            'channel': channel if channel is not None else 2.0/varicode.symbol_period(baudrate)}
+        limit = step_limit(sendword_time)
+        if max_steps > limit:
+            print("Limiting profiles to %d steps, the most that fit the ISR time and flash budgets." % limit)
+            max_steps = limit
+        self.max_steps = max_steps
+        self.objective = objective
+        self.byte_penalty = byte_penalty
+        self.cache_file = cache_file
+        self.cache = {}
+        self.load_cache()
+        self.pool = multiprocessing.Pool(processes)
+        self.evaluations = 0
+
+    def load_cache(self):
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return
+        try:
+            f = open(self.cache_file)
+            self.cache = json.loads(f.read())
+            f.close()
+        except (IOError,ValueError):
+            print("Could not read cache file, starting with an empty cache.")
+
+    def save_cache(self):
+        if self.cache_file is None:
+            return
+        f = open(self.cache_file + ".tmp",'w')
+        f.write(json.dumps(self.cache))
+        f.close()
+        os.rename(self.cache_file + ".tmp",self.cache_file)
+
+    def key(self,words):
+        # Results depend on the phase words and the simulation settings.
+        text = json.dumps([words,self.settings],sort_keys=True)
+        return hashlib.sha1(text.encode('ascii')).hexdigest()
+
+    def score(self,result):
+        # Lower is better. Time in the interrupt counts against a profile, or the search would
+        # always go for the longest one allowed.
+        return result[self.objective] + self.byte_penalty*result['duration']/byte_time
+
+    def evaluate_all(self,candidates):
+        # Results for a list of (steps, coeffs) candidates, simulating those not already in the cache.
+        words = [phase_words(profile_degrees(steps,coeffs)) for (steps,coeffs) in candidates]
+        keys = [self.key(w) for w in words]
+        todo = {}
+        for i in range(len(keys)):
+            if keys[i] not in self.cache:
+                todo[keys[i]] = words[i]
+        todo_keys = list(todo.keys())
+        results = self.pool.map(evaluate,[(todo[k],self.settings) for k in todo_keys])
+        for i in range(len(todo_keys)):
+            self.cache[todo_keys[i]] = results[i]
+        self.evaluations += len(todo_keys)
+        return [self.cache[k] for k in keys]
+
+    def mutate(self,candidate,rng,scale):
+        steps,coeffs = candidate
+        steps = int(min(self.max_steps,max(min_steps,round(steps + rng.gauss(0,scale*self.max_steps/4)))))
+        coeffs = tuple(c + rng.gauss(0,scale*0.1) for c in coeffs)
+        return (steps,coeffs)
+
+    def search(self,generations=20,population=32,survivors=8,seed=None):
+        # Returns the best (steps, coeffs) candidate and its result.
+        rng = random.Random(seed)
+        zero = (0.0,)*shape_terms
+        # Start from the current profile, smooth profiles of a few lengths, and some random ones.
+        candidates = [(181,zero)]
+        for steps in (min_steps,self.max_steps//4,self.max_steps//2,self.max_steps):
+            candidates.append((steps,(-1/(2*np.pi),) + zero[1:]))
+        while len(candidates) < population:
+            candidates.append(self.mutate((rng.randint(min_steps,self.max_steps),zero),rng,1.0))
+
+        ranked = []
+        for generation in range(generations):
+            results = self.evaluate_all(candidates)
+            ranked += zip(candidates,results)
+            ranked.sort(key=lambda c: self.score(c[1]))
+            ranked = ranked[:survivors]
+            best = ranked[0]
+            print("Generation %d: %s (%d simulated)" % (generation,describe(best[1]),self.evaluations))
+            self.save_cache()
+
+            # Narrow the mutations as the search goes on.
+            scale = 1.0 - 0.9*generation/max(1,generations-1)
+            candidates = [self.mutate(ranked[rng.randrange(len(ranked))][0],rng,scale) for i in range(population)]
+        return ranked[0]
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search for a BPSK phase-shaping profile and generate bpsk_phase_switch()")
+    parser.add_argument("--baud",type=int,default=31,choices=sorted(varicode.bpsk_timer_period.keys()))
+    parser.add_argument("--generations",type=int,default=20)
+    parser.add_argument("--population",type=int,default=32)
+    parser.add_argument("--max-steps",type=int,default=default_max_steps,help="Longest profile, in phase register writes.")
+    parser.add_argument("--sendword-time",type=float,default=synth.SENDWORD_TIME,help="Time per AD9834_SendWord() (s).")
+    parser.add_argument("--byte-penalty",type=float,default=default_byte_penalty,
+        help="Score penalty per serial byte time the reversal spends in the interrupt.")
+    parser.add_argument("--objective",default="oob",choices=["oob","acpr","obw"],
+        help="Minimise out of channel power, adjacent channel power or occupied bandwidth.")
+    parser.add_argument("--cache",default=default_cache_file)
+    parser.add_argument("--processes",type=int,default=None,help="Worker processes. Defaults to the number of CPUs.")
+    parser.add_argument("--seed",type=int,default=None)
+    parser.add_argument("-o","--output",default=None,help="Write the C source to this file, instead of printing it.")
+    args = parser.parse_args()
+
+    optimizer = ProfileOptimizer(args.baud,args.max_steps,args.sendword_time,args.objective,args.cache,args.processes,
+        byte_penalty=args.byte_penalty)
+    try:
+        current = evaluate((list(synth.default_profile()),optimizer.settings))
+        print("Current profile: " + describe(current))
+
+        began = time.time()
+        (steps,coeffs),result = optimizer.search(args.generations,args.population,seed=args.seed)
+        print("Best profile: %s, found in %.1f seconds" % (describe(result),time.time()-began))
+        print("Shape coefficients: " + ", ".join("%.4f" % c for c in coeffs))
+    finally:
+        optimizer.close()
+
+    source = switch_source(phase_words(profile_degrees(steps,coeffs)))
+    if args.output is None:
+        sys.stdout.write(source)
+    else:
+        f = open(args.output,'w')
+        f.write(source)
+        f.close()
+        print("Wrote " + args.output)
+
+if __name__ == "__main__":
+    main()
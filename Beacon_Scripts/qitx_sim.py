@@ -0,0 +1,732 @@
+#!/usr/bin/env python
+# qitx_sim.py - QITX Transmitter Simulator
+#
+# Emulates the QITX_Remote firmware on a pseudo-terminal, so QITX.py and the beacon
+# scripts can be run (and timed) without an Arduino on the bench.
+#
+# The command parser follows parseCommand() in QITX_Remote.ino, quirks included, and
+# transmissions take as long as they would on air: the PSK and RTTY ring buffer is drained
+# at the Timer1 rate set by bpsk_start()/rtty_start(), Morse at the ident's dit length,
+# SELCALL at SELCALL_DELAY per bit, and EEPROM writes at ~3.3ms/byte. Nothing is processed
+# while a blocking command runs, and the TX_TIMEOUT check only happens in the main loop,
+# just like the real thing.
+#
+# Faults can be injected for testing recovery (supervisor.py):
+#  - unplug(duration) drops the USB connection: the pty goes away, as if the port had vanished,
+#    and a new one appears after 'duration' seconds. The firmware carries on regardless, so a
+#    PSKTERM stream in progress is left waiting for an EOT that never comes.
+#  - hang() stops the firmware responding to anything, including its own TX_TIMEOUT check.
+#  - timeout() makes the TX_TIMEOUT check fire, sending TIMEOUT.
+#  - Opening the port at 1200 baud resets the firmware, as the Leonardo's bootloader does (the
+#    "1200 baud touch" reset_tx.py uses). The port goes away for bootloader_time, then comes
+#    back with the firmware freshly started (but the EEPROM kept).
+# The pty's name changes every time it comes back, so give the simulator a link path to keep
+# pointing at the current one, as the udev rule for /dev/arduino would.
+#
+# QITXSimulator(version=1) behaves as firmware from before the VERSION command, which has no
+# PSKFLOW either, for testing QITX.py's fallback to PSKTERM.
+#
+# TCPBridge serves the simulator on a TCP port, the way ser2net serves a serial port in raw
+# mode, to stand in for a transmitter at a remote site (QITX('tcp://localhost:port')).
+#
+# Usage: python qitx_sim.py [speed] [tcp_port]
+# Prints the pty device to connect to. A speed > 1 runs the firmware clock faster than real time.
+#
+# Copyright 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+import os,sys,time,pty,tty,termios,select,socket,threading,varicode
+from collections import deque
+
+# Constants from QITX_Remote.ino. The ones the host needs as well (TX_TIMEOUT, and the RTTY,
+# Morse and SELCALL timings) are in varicode.py.
+INPUTBUFLEN = 64
+MSG_LEN_LIMIT = 128
+FIRMWARE_VERSION = 2
+FREQ_LIMIT_LOWER = 0
+FREQ_LIMIT_UPPER = 14350000
+SSB_USB = 1
+SSB_LSB = 0
+
+# EEPROM layout from EEPROM_Helper.ino
+CALLSIGN_LOCATION = 0
+CALLSIGN_LENGTH = 6
+FREQ_LOCATION = 6
+FREQ_OFF_LOCATION = 10
+EEPROM_WRITE_TIME = 0.0033
+
+# Time the Leonardo spends in its bootloader after a reset, before the sketch starts (s).
+bootloader_time = 8.0
+
+def strtoul(string):
+    # Mimics input.toCharArray(tempBuffer,10) followed by strtoul(). Returns (value, ok),
+    # where ok is False if there were characters left over after the number.
+    string = string[:9].lstrip()
+    digits = string
+    if digits[:1] in ('+','-'):
+        digits = digits[1:]
+    n = 0
+    while n < len(digits) and digits[n].isdigit():
+        n += 1
+    if n == 0:
+        # No conversion. endptr points at the start of the string.
+        return 0, len(string) == 0
+    value = int(digits[:n]) & 0xFFFFFFFF
+    if string[0] == '-':
+        value = (-value) & 0xFFFFFFFF
+    return value, n == len(digits)
+
+
+class FirmwareReset(Exception):
+    # Raised out of whatever the firmware was doing when it's reset.
+    pass
+
+
+class QITXSimulator(object):
+
+    def __init__(self,speed=1.0,link=None,version=FIRMWARE_VERSION):
+        self.speed = float(speed)
+        # Firmware version to behave as. Version 1 has neither VERSION nor PSKFLOW, so takes
+        # PSKFLOW,<baud> as PSK,<baud>.
+        self.version = version
+        self.link = link
+        self.master = self.slave = None
+        self.port = None
+        self.plug()
+        # Pending unplug (duration), and when to come back after one (wall clock).
+        self.unplug_request = None
+        self.replug_time = None
+        self.hung = False
+        self.resets = 0
+
+        # EEPROM contents, and how many bytes have been written to it.
+        self.eeprom = bytearray(b'\xff'*1024)
+        self.eeprom_writes = 0
+        self.store_callsign(bytearray(b'VK5QI\x00'))
+        self.store_long(FREQ_LOCATION,7045000)
+        self.store_long(FREQ_OFF_LOCATION,1000)
+        self.eeprom_writes = 0
+
+        # A record of everything 'transmitted', as dicts with mode, start, end (wall clock) and data.
+        self.transmissions = []
+        # Characters lost to a full ring buffer.
+        self.dropped = 0
+
+        self.t0 = time.time()
+        self.running = False
+        self.thread = None
+        self.reset()
+
+    # Time and delays, in firmware (simulated) seconds.
+    def clock(self):
+        return (time.time() - self.t0)*self.speed
+
+    def delay(self,seconds):
+        if seconds > 0:
+            time.sleep(seconds/self.speed)
+
+    # EEPROM_Helper.ino
+    def eeprom_write(self,address,value):
+        self.eeprom[address] = value
+        self.eeprom_writes += 1
+        self.delay(EEPROM_WRITE_TIME)
+
+    def store_callsign(self,call):
+        for i in range(CALLSIGN_LOCATION,CALLSIGN_LENGTH):
+            c = call[i]
+            if chr(c).isalnum():
+                self.eeprom_write(i,c)
+            else:
+                self.eeprom_write(i,ord(' '))
+
+    def read_callsign(self):
+        call = bytearray(b' '*6 + b'\x00')
+        for i in range(CALLSIGN_LOCATION,CALLSIGN_LENGTH):
+            if chr(self.eeprom[i]).isalnum():
+                call[i] = self.eeprom[i]
+        return call
+
+    def store_long(self,location,value):
+        for i in range(4):
+            self.eeprom_write(location + i,(value >> (8*i)) & 0xFF)
+
+    def read_long(self,location):
+        return sum(self.eeprom[location + i] << (8*i) for i in range(4))
+
+    def reset(self):
+        # Power on / reset: setup() in QITX_Remote.ino.
+        self.tx_freq = self.read_long(FREQ_LOCATION)
+        self.tx_offset = self.read_long(FREQ_OFF_LOCATION)
+        self.tx_sideband = SSB_LSB
+        self.tx_power_low = False
+        self.callsign = self.read_callsign()
+        self.txmessage = "DE %s TEST BEACON" % self.get_callsign()
+        self.button_state = 0
+        self.rf_on = False
+        self.tx_timer = 0.0
+        self.input_buffer = ""
+        self.rx = bytearray()
+        self.buffer = deque()
+        self.isr = None
+        self.current = None
+
+    def get_callsign(self):
+        end = self.callsign.find(b'\x00')
+        if end == -1:
+            end = len(self.callsign)
+        return self.callsign[:end].decode('ascii')
+
+    def press_button(self):
+        # The TX inhibit button.
+        self.button_state = 1
+
+    # USB connection
+    def plug(self):
+        self.master,self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        if self.link is not None:
+            # Swap the link over in one go.
+            os.symlink(self.port,self.link + ".tmp")
+            os.rename(self.link + ".tmp",self.link)
+
+    def disconnect(self):
+        if self.master is None:
+            return
+        if self.link is not None and os.path.islink(self.link):
+            os.remove(self.link)
+        os.close(self.master)
+        os.close(self.slave)
+        self.master = self.slave = None
+
+    def unplug(self,duration=1.0):
+        # Called from outside. The firmware thread drops the connection the next time it looks at it.
+        self.unplug_request = duration
+
+    def hang(self):
+        self.hung = True
+
+    def timeout(self):
+        # Key up and fire the TX_TIMEOUT check, as if the transmitter had been left on.
+        if not self.rf_on:
+            self.tx_on('CARRIER')
+        self.tx_timer = self.clock() - varicode.TX_TIMEOUT - 1
+
+    def check_usb(self):
+        # Handle unplugging and replugging, and the 1200 baud touch. Runs on the firmware thread.
+        if self.unplug_request is not None:
+            self.disconnect()
+            self.replug_time = time.time() + self.unplug_request
+            self.unplug_request = None
+        if self.master is None:
+            if self.replug_time is not None and time.time() >= self.replug_time:
+                self.replug_time = None
+                self.plug()
+            return
+        # A pty's speed is shared by both ends, so the host setting 1200 baud shows up here.
+        if termios.tcgetattr(self.master)[5] == termios.B1200:
+            self.disconnect()
+            self.replug_time = time.time() + bootloader_time/self.speed
+            raise FirmwareReset()
+
+    # Serial port
+    def println(self,line):
+        if self.master is None:
+            return
+        try:
+            os.write(self.master,(line+"\r\n").encode('ascii'))
+        except OSError:
+            pass
+
+    def serial_read(self,timeout):
+        # Returns the next received byte, or None after 'timeout' simulated seconds.
+        self.check_usb()
+        if len(self.rx) == 0:
+            wall_timeout = None if timeout is None else max(0,timeout/self.speed)
+            if wall_timeout is None or wall_timeout > 0.1:
+                wall_timeout = 0.1
+            if self.master is None:
+                time.sleep(wall_timeout)
+                return None
+            r,w,x = select.select([self.master],[],[],wall_timeout)
+            if r:
+                try:
+                    self.rx.extend(os.read(self.master,1024))
+                except OSError:
+                    pass
+        if len(self.rx) == 0:
+            return None
+        c = self.rx[0]
+        del self.rx[0]
+        return c
+
+    # Transmitter on/off, and the log of transmissions
+    def tx_on(self,mode):
+        self.rf_on = True
+        self.tx_timer = self.clock()
+        if self.current is not None:
+            self.current['end'] = time.time()
+        self.current = {'mode': mode, 'start': time.time(), 'end': None, 'data': ''}
+        self.transmissions.append(self.current)
+
+    def tx_off(self):
+        self.rf_on = False
+        if self.current is not None:
+            self.current['end'] = time.time()
+            self.current = None
+
+    # Ring buffer, drained by a model of the Timer1 interrupt.
+    def isr_start(self,mode,period):
+        self.isr = mode
+        self.isr_period = period
+        self.isr_tick = self.clock() + period
+        self.isr_busy_until = self.isr_tick
+
+    def isr_stop(self):
+        self.run_isr(self.clock())
+        self.isr = None
+
+    def isr_char_ticks(self,c):
+        if self.isr == 'bpsk':
+            return varicode.char_symbols(chr(c & 0x7F))
+        else:
+            # Start bit, 8 data bits and a stop bit.
+            return 10
+
+    def run_isr(self,now):
+        # Run every interrupt up to 'now'. Only ticks where a character is read from the
+        # buffer matter, so skip straight between them.
+        if self.isr is None:
+            return
+        while self.isr_tick <= now:
+            if self.isr_tick < self.isr_busy_until:
+                self.isr_tick = self.isr_busy_until
+            elif self.buffer:
+                c = self.buffer.popleft()
+                self.isr_busy_until = self.isr_tick + self.isr_char_ticks(c)*self.isr_period
+                if self.current is not None and c != 0:
+                    self.current['data'] += chr(c)
+                self.isr_tick = self.isr_busy_until
+            else:
+                # Idle. Move on to the first tick after 'now'.
+                self.isr_tick += (int((now - self.isr_tick)/self.isr_period) + 1)*self.isr_period
+                self.isr_busy_until = self.isr_tick
+
+    def store_char(self,c):
+        self.run_isr(self.clock())
+        if len(self.buffer) < varicode.TX_BUFFER_SIZE - 1:
+            self.buffer.append(c)
+        else:
+            self.dropped += 1
+
+    def store_string(self,string):
+        for c in bytearray(string.encode('ascii','replace')):
+            self.store_char(c)
+
+    def wait_buffer_empty(self):
+        # while(data_waiting(&data_tx_buffer)>0);
+        while True:
+            now = self.clock()
+            self.run_isr(now)
+            if len(self.buffer) == 0 or self.isr is None:
+                return
+            self.delay(max(self.isr_tick - now,0.0005))
+
+    # Main loop
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(2)
+        self.disconnect()
+
+    def loop(self):
+        while self.running:
+            try:
+                self.loop_once()
+            except FirmwareReset:
+                self.tx_off()
+                self.reset()
+                self.hung = False
+                self.resets += 1
+
+    def loop_once(self):
+        c = self.serial_read(1.0)
+        if self.hung:
+            return
+        if c is not None:
+            if c == ord('\n') or len(self.input_buffer) > INPUTBUFLEN:
+                if self.parse_command(self.input_buffer) == 0:
+                    self.println("OK")
+                else:
+                    self.println("ERROR")
+                self.input_buffer = ""
+            elif 32 <= c <= 126 or c == 9:
+                self.input_buffer += chr(c)
+
+        if self.rf_on and (self.clock() - self.tx_timer) > varicode.TX_TIMEOUT:
+            self.tx_off()
+            self.println("TIMEOUT")
+
+    def parse_command(self,command):
+        if len(command) < 3:
+            return 1
+        params = command.split(',')[:6]
+        nparams = len(params) - 1
+
+        if nparams == 0:
+            for name in ['FREQSSB','FREQOFF','FREQ','POWER','MSG','CALL','INHIBIT']:
+                if command.startswith(name):
+                    self.println(name + "," + self.get_value(name))
+                    return 0
+            if command.startswith('VERSION') and self.version >= 2:
+                self.println("VERSION," + str(self.version))
+                return 0
+            if command.startswith('IDENT'):
+                self.ident()
+            elif command.startswith('PSK'):
+                self.transmit_psk()
+            elif command.startswith('RTTY'):
+                self.transmit_rtty()
+            else:
+                return 1
+            return 0
+        elif nparams == 1:
+            param1 = command[command.index(',')+1:]
+            for name,handler in [('FREQSSB',self.parse_ssb),('FREQOFF',self.parse_freq_offset),
+                    ('FREQ',self.parse_freq),('POWER',self.parse_power),('MSG',self.parse_message),
+                    ('CALL',self.parse_callsign),('CARRIER',self.parse_carrier),
+                    ('PSKTERM',self.psk_terminal),('PSKFLOW',self.psk_flow_terminal),('PSK',self.parse_psk),('INHIBIT',self.write_inhibit)]:
+                if command.startswith(name):
+                    if name == 'PSKFLOW' and self.version < 2:
+                        continue
+                    return handler(param1)
+            return 1
+        elif nparams == 2:
+            if command.startswith('RTTY'):
+                return self.parse_rtty(params[1],params[2])
+            elif command.startswith('SELCALL'):
+                return self.parse_selcall(params[1],params[2],False)
+            elif command.startswith('SELTEST'):
+                return self.parse_selcall(params[1],params[2],True)
+        return 1
+
+    def get_value(self,name):
+        if name == 'FREQSSB':
+            return 'USB' if self.tx_sideband else 'LSB'
+        elif name == 'FREQOFF':
+            return str(self.tx_offset)
+        elif name == 'FREQ':
+            return str(self.tx_freq)
+        elif name == 'POWER':
+            return 'LOW' if self.tx_power_low else 'HIGH'
+        elif name == 'MSG':
+            return self.txmessage
+        elif name == 'CALL':
+            return self.get_callsign()
+        elif name == 'INHIBIT':
+            return 'ON' if self.button_state else 'OFF'
+
+    def combined_freq(self,freq,offset):
+        if self.tx_sideband:
+            return (freq + offset) & 0xFFFFFFFF
+        return (freq - offset) & 0xFFFFFFFF
+
+    def freq_valid(self,freq):
+        return FREQ_LIMIT_LOWER < freq < FREQ_LIMIT_UPPER
+
+    def parse_freq(self,param):
+        result,ok = strtoul(param)
+        if not ok or not self.freq_valid(self.combined_freq(result,self.tx_offset)):
+            return -1
+        self.tx_freq = result
+        self.store_long(FREQ_LOCATION,result)
+        self.println("FREQ," + str(result))
+        return 0
+
+    def parse_freq_offset(self,param):
+        result,ok = strtoul(param)
+        if not ok or not self.freq_valid(self.combined_freq(self.tx_freq,result)):
+            return -1
+        self.tx_offset = result
+        self.store_long(FREQ_OFF_LOCATION,result)
+        self.println("FREQOFF," + str(result))
+        return 0
+
+    def parse_ssb(self,param):
+        if param.startswith('USB'):
+            self.tx_sideband = SSB_USB
+        elif param.startswith('LSB'):
+            self.tx_sideband = SSB_LSB
+        else:
+            return -1
+        self.println("FREQSSB," + self.get_value('FREQSSB'))
+        return 0
+
+    def parse_power(self,param):
+        if param.startswith('HIGH'):
+            self.tx_power_low = False
+        elif param.startswith('LOW'):
+            self.tx_power_low = True
+        else:
+            return -1
+        self.println("POWER," + self.get_value('POWER'))
+        return 0
+
+    def parse_carrier(self,param):
+        if param.startswith('ON'):
+            self.tx_on('CARRIER')
+            self.println("CARRIER,ON")
+        elif param.startswith('OFF'):
+            self.tx_off()
+            self.println("CARRIER,OFF")
+        else:
+            return -1
+        return 0
+
+    def parse_message(self,param):
+        self.txmessage = param[:MSG_LEN_LIMIT-1]
+        self.println("MSG," + self.txmessage)
+        return 0
+
+    def parse_callsign(self,param):
+        # toCharArray() only overwrites as much of the array as it needs, and store_callsign()
+        # writes all 6 bytes, so remnants of a longer old callsign end up in the EEPROM.
+        new = bytearray(param[:6].encode('ascii','replace')) + bytearray(b'\x00')
+        self.callsign[:len(new)] = new
+        self.store_callsign(self.callsign)
+        self.println("CALL," + self.get_callsign())
+        return 0
+
+    def write_inhibit(self,param):
+        if param.startswith('ON'):
+            self.button_state = 1
+        elif param.startswith('OFF'):
+            self.button_state = 0
+        else:
+            return -1
+        self.println("INHIBIT," + self.get_value('INHIBIT'))
+        return 0
+
+    def ident(self):
+        # 20 WPM: morse_delay = 1200/20 = 60ms
+        self.tx_on('IDENT')
+        self.current['data'] = "DE " + self.get_callsign()
+        self.delay((varicode.morse_units("DE ") + varicode.morse_units(self.get_callsign()))*0.060)
+        self.tx_off()
+
+    # PSK.ino
+    def bpsk_start(self,baudrate):
+        self.tx_on('BPSK' + str(baudrate))
+        self.isr_start('bpsk',varicode.symbol_period(baudrate))
+
+    def bpsk_stop(self):
+        self.isr_stop()
+        self.tx_off()
+
+    def transmit_psk(self):
+        self.bpsk_start(31)
+        self.delay(3)
+        self.store_string(self.txmessage)
+        self.wait_buffer_empty()
+        self.delay(3)
+        self.store_string(self.txmessage)
+        self.wait_buffer_empty()
+        self.delay(3)
+        self.bpsk_stop()
+
+    def parse_psk(self,param):
+        baudrate,ok = strtoul(param)
+        if not ok or baudrate > 500:
+            return -1
+        self.bpsk_start(baudrate)
+        self.delay(2)
+        self.store_string(self.txmessage)
+        self.wait_buffer_empty()
+        self.delay(2)
+        self.bpsk_stop()
+        return 0
+
+    def psk_terminal(self,param):
+        baudrate,ok = strtoul(param)
+        if not ok or baudrate > 500:
+            return -1
+        self.bpsk_start(baudrate)
+        while self.running:
+            c = self.serial_read(None)
+            if c is None:
+                continue
+            if c == 4:
+                break
+            self.store_char(c)
+        self.bpsk_stop()
+        return 0
+
+    def psk_flow_terminal(self,param):
+        baudrate,ok = strtoul(param)
+        if not ok or baudrate > 500:
+            return -1
+        self.bpsk_start(baudrate)
+        promised = 0
+        while self.running:
+            # Poll about once a symbol, so credit goes out as the buffer drains.
+            c = self.serial_read(self.isr_period)
+            if c is not None:
+                if c == 4:
+                    break
+                if promised > 0:
+                    promised -= 1
+                self.store_char(c)
+            self.run_isr(self.clock())
+            free_slots = varicode.TX_BUFFER_SIZE - 1 - len(self.buffer)
+            if free_slots > promised:
+                if free_slots - promised >= varicode.CREDIT_BATCH or len(self.buffer) == 0:
+                    self.println("CREDIT," + str(free_slots - promised))
+                    promised = free_slots
+        self.wait_buffer_empty()
+        self.bpsk_stop()
+        return 0
+
+    # RTTY.ino. The RTTY commands never call rtty_stop(), so the transmitter stays keyed
+    # until something else turns it off, or TX_TIMEOUT does.
+    def rtty_start(self,baudrate):
+        self.tx_on('RTTY' + str(baudrate))
+        self.isr_start('rtty',varicode.rtty_timer_period.get(baudrate,20000)/1e6)
+
+    def transmit_rtty(self):
+        self.rtty_start(50)
+        self.delay(3)
+        self.store_string(self.txmessage)
+        self.wait_buffer_empty()
+        self.delay(3)
+
+    def parse_rtty(self,baud,shift):
+        baudrate,ok = strtoul(baud)
+        if not ok or baudrate > 600:
+            return -1
+        shift_freq,ok = strtoul(shift)
+        if not ok or shift_freq > 3000:
+            return -1
+        self.rtty_start(baudrate)
+        self.store_string(self.txmessage)
+        return 0
+
+    # SELCALL.ino
+    def parse_selcall(self,source,dest,chantest):
+        sourcecall,ok = strtoul(source)
+        if not ok or sourcecall > 9999:
+            return -1
+        destcall,ok = strtoul(dest)
+        if not ok or destcall > 9999:
+            return -1
+        self.tx_on('SELTEST' if chantest else 'SELCALL')
+        self.current['data'] = "%04d,%04d" % (sourcecall,destcall)
+        # 700 dot pairs of preamble, 12 phasing words and 18 message words of 10 bits each.
+        self.delay((700*2 + (12 + 18)*10)*varicode.SELCALL_DELAY)
+        self.tx_off()
+        return 0
+
+
+class TCPBridge(object):
+    # Passes bytes between TCP clients and a pty, one client at a time, as ser2net does.
+
+    def __init__(self,device,port=0,host='127.0.0.1'):
+        self.device = device
+        self.listener = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+        self.listener.bind((host,port))
+        self.listener.listen(1)
+        self.listener.settimeout(0.1)
+        self.host = host
+        self.port = self.listener.getsockname()[1]
+        self.url = "tcp://%s:%d" % (host,self.port)
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(2)
+        self.listener.close()
+
+    def loop(self):
+        while self.running:
+            try:
+                conn,address = self.listener.accept()
+            except socket.timeout:
+                continue
+            except (socket.error,OSError):
+                break
+            conn.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+            fd = os.open(self.device,os.O_RDWR|os.O_NOCTTY)
+            tty.setraw(fd)
+            try:
+                self.pump(conn,fd)
+            finally:
+                conn.close()
+                os.close(fd)
+
+    def pump(self,conn,fd):
+        while self.running:
+            r,w,x = select.select([conn,fd],[],[],0.1)
+            try:
+                if conn in r:
+                    data = conn.recv(4096)
+                    if not data:
+                        return
+                    os.write(fd,data)
+                if fd in r:
+                    conn.sendall(os.read(fd,4096))
+            except (socket.error,OSError):
+                return
+
+
+def main():
+    speed = 1.0
+    if len(sys.argv) >= 2:
+        speed = float(sys.argv[1])
+
+    sim = QITXSimulator(speed)
+    sim.start()
+    print("QITX simulator running on " + sim.port)
+    bridge = None
+    if len(sys.argv) >= 3:
+        bridge = TCPBridge(sim.port,int(sys.argv[2]),'')
+        bridge.start()
+        print("Serving it on TCP port %d" % bridge.port)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    if bridge is not None:
+        bridge.stop()
+    sim.stop()
+    for tx in sim.transmissions:
+        print("%s %.3f %s" % (tx['mode'],tx['start'],tx['data']))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# schedule_compiler.py - Beacon schedule airtime model and checker
+#
+# Works out how long each entry of a beacon schedule will be on air, from the same encodings
+# and timing the firmware uses:
+#  - BPSK<baud>: the varicode bits of the payload string at that baud (varicode.py), plus the
+#    preamble and postamble of phase reversals beacon_json.psk() sends around it.
+#  - IDENT: "DE <callsign>" in Morse, at the firmware's 20 WPM (a 1200/WPM ms dit, as
+#    morse_set_wpm() works it out), or a given WPM or dit length.
+#  - SELCALL/SELTEST: the 100 baud CCIR 493-4 dot preamble, phasing and call words.
+# RTTY can't be scheduled: the RTTY command sends the stored MSG (not the payload), replies OK
+# straight away and never calls rtty_stop(), so the transmitter stays keyed until TX_TIMEOUT.
+#
+# compile_schedule() checks a schedule with these, reporting entries which overlap (including a
+# guard time for retuning between them), which would run past the firmware's 10 minute
+# TX_TIMEOUT, or which beacon_json.run_schedule() doesn't know how to send. It can also repack the start times, moving
+# every entry as early as it can go after the one before, to get the most on-air time out of
+# each cycle.
+#
+# By default the payload is taken to be the slowest possible one (every random character the
+# one with the longest varicode), so a schedule which passes is good for every minute.
+#
+# Usage: python schedule_compiler.py [--callsign VK5QI] [--guard 1] [--repack] [-o packed.json] schedule.json
+#
+# Copyright 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse,json,math,sys
+import payload,varicode
+
+# Phase reversals sent before and after the data by beacon_json.psk(), in seconds.
+psk_preamble = 3
+psk_postamble = 1
+
+# ident() sets 20 WPM.
+ident_wpm = 20
+
+# CCIR 493-4 SELCALL, from SELCALL.ino: 700 dot pairs, then 12 phasing words and the 18 word
+# call, each word 10 bits.
+selcall_preamble_bits = 2*700
+selcall_words = 12 + 18
+
+# Time allowed between one transmission ending and the next starting, for setting the
+# frequency and sending the next command.
+default_guard = 1.0
+
+default_callsign = "VK5QI"
+
+
+def worst_txstring():
+    # The payload string which takes longest to send in BPSK.
+    slowest = max(payload.alphabet,key=lambda c: varicode.char_symbols(c))
+    return payload.txstring(slowest*payload.payload_length)
+
+def dit_length(wpm=ident_wpm,dit=None):
+    # Morse dit length in seconds. morse_set_wpm() uses integer milliseconds.
+    if dit is not None:
+        return dit/1000.0
+    return (1200//int(wpm))/1000.0
+
+def ident_airtime(callsign=default_callsign,wpm=ident_wpm,dit=None):
+    return (varicode.morse_units("DE ") + varicode.morse_units(callsign))*dit_length(wpm,dit)
+
+def psk_airtime(data,baudrate=31,preamble=psk_preamble,postamble=psk_postamble):
+    # bpsk_isr() first runs one symbol period after bpsk_start() keys up.
+    return varicode.symbol_period(baudrate) + preamble + varicode.airtime(data,baudrate) + postamble
+
+def selcall_airtime():
+    return (selcall_preamble_bits + 10*selcall_words)*varicode.SELCALL_DELAY
+
+def mode_baud(mode,prefix):
+    # The baud rate from a mode name like BPSK125, or None if it isn't one of these.
+    if mode.startswith(prefix) and mode[len(prefix):].isdigit():
+        return int(mode[len(prefix):])
+    return None
+
+def schedulable(mode):
+    # Whether beacon_json.run_schedule() transmits this mode. It skips anything else.
+    return mode == "IDENT" or mode_baud(mode,"BPSK") is not None
+
+def entry_airtime(entry,txstring=None,callsign=default_callsign):
+    # Seconds on air for one schedule entry. Entries can set "preamble" and "postamble" for
+    # BPSK, and "wpm" or "dit" (ms) for IDENT. Raises ValueError for modes it doesn't know.
+    if txstring is None:
+        txstring = worst_txstring()
+    mode = entry["mode"]
+    if mode == "IDENT":
+        return ident_airtime(callsign,entry.get("wpm",ident_wpm),entry.get("dit"))
+    if mode in ("SELCALL","SELTEST"):
+        return selcall_airtime()
+    baud = mode_baud(mode,"BPSK")
+    if baud is not None:
+        if baud not in varicode.bpsk_timer_period:
+            raise ValueError("BPSK%d isn't a baud rate the firmware supports" % baud)
+        return psk_airtime(txstring,baud,entry.get("preamble",psk_preamble),entry.get("postamble",psk_postamble))
+    if mode == "RTTY" or mode_baud(mode,"RTTY") is not None:
+        raise ValueError("RTTY sends the stored MSG and stays keyed until TX_TIMEOUT, so can't be scheduled")
+    raise ValueError("Unknown mode " + mode)
+
+def compile_schedule(schedule,txstring=None,callsign=default_callsign,guard=default_guard,cycle=None):
+    # Check a schedule. Returns (entries, errors): every entry with its start, airtime and end
+    # (in start time order), and a list of problems, empty if the schedule is good. If cycle
+    # (seconds) is given, the last entry must also finish inside it.
+    entries = []
+    errors = []
+    for tx_setting in sorted(schedule,key=lambda s: float(s["starttime"])):
+        entry = {'mode': tx_setting["mode"], 'start': float(tx_setting["starttime"]), 'setting': tx_setting}
+        try:
+            entry['airtime'] = entry_airtime(tx_setting,txstring,callsign)
+            if not schedulable(entry['mode']):
+                errors.append("%s at %g: beacon_json.run_schedule() doesn't send this mode" % (entry['mode'],entry['start']))
+        except ValueError as e:
+            errors.append("%s at %g: %s" % (entry['mode'],entry['start'],e))
+            entry['airtime'] = 0.0
+        entry['end'] = entry['start'] + entry['airtime']
+        if entry['start'] < 0:
+            errors.append("%s starts before the cycle (at %g)" % (entry['mode'],entry['start']))
+        if entry['airtime'] > varicode.TX_TIMEOUT:
+            errors.append("%s at %g takes %.1f s, past the firmware's %d s TX_TIMEOUT" % (entry['mode'],entry['start'],
+                entry['airtime'],varicode.TX_TIMEOUT))
+        entries.append(entry)
+    for i in range(1,len(entries)):
+        previous = entries[i-1]
+        if entries[i]['start'] < previous['end'] + guard:
+            errors.append("%s at %g starts before %s at %g has finished (at %.1f, plus %g s guard)" % (entries[i]['mode'],
+                entries[i]['start'],previous['mode'],previous['start'],previous['end'],guard))
+    if cycle is not None and len(entries) > 0 and entries[-1]['end'] + guard > cycle:
+        errors.append("%s at %g finishes at %.1f, past the end of the %d s cycle" % (entries[-1]['mode'],entries[-1]['start'],
+            entries[-1]['end'],cycle))
+    return entries,errors
+
+def cycle_length(entries,guard=default_guard):
+    # Whole minutes needed for the compiled entries, as beacon_daemon.py picks its cycle period.
+    end = max([e['end'] + guard for e in entries] + [0])
+    return max(1,int(math.ceil(end/60.0)))*60
+
+def duty_cycle(entries,cycle):
+    return sum(e['airtime'] for e in entries)/float(cycle)
+
+def repack(entries,guard=default_guard):
+    # New schedule with every entry moved as early as it can go: the first where it was, each
+    # one after that a whole number of seconds (run_schedule() uses whole seconds) after the
+    # end of the one before, plus the guard time.
+    schedule = []
+    next_start = None
+    for e in entries:
+        start = e['start'] if next_start is None else int(math.ceil(next_start))
+        tx_setting = dict(e['setting'])
+        tx_setting["starttime"] = int(start)
+        schedule.append(tx_setting)
+        next_start = start + e['airtime'] + guard
+    return schedule
+
+def print_entries(entries):
+    print("Start     End  Airtime  Mode")
+    for e in entries:
+        print("%5g  %6.1f  %7.1f  %s" % (e['start'],e['end'],e['airtime'],e['mode']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the timing of a beacon schedule")
+    parser.add_argument("schedule")
+    parser.add_argument("--callsign",default=default_callsign)
+    parser.add_argument("--guard",type=float,default=default_guard,help="Seconds between transmissions.")
+    parser.add_argument("--cycle",type=int,default=None,help="Cycle period (s). Defaults to the schedule's length in whole minutes.")
+    parser.add_argument("--start",default=None,help="Check against the payload for this minute (dd-mm-YYYY HH:MM), not the slowest payload.")
+    parser.add_argument("--repack",action="store_true",help="Move every entry as early as it can go.")
+    parser.add_argument("-o","--output",default=None,help="Write the repacked schedule here.")
+    args = parser.parse_args()
+
+    f = open(args.schedule)
+    schedule = json.loads(f.read())
+    f.close()
+    txstring = None
+    if args.start is not None:
+        txstring = payload.txdata(payload.parse_timeseed(args.start))["txstring"]
+
+    entries,errors = compile_schedule(schedule,txstring,args.callsign,args.guard,args.cycle)
+    cycle = args.cycle or cycle_length(entries,args.guard)
+    print_entries(entries)
+    print("Cycle: %d s, on air %.1f%% of it." % (cycle,100*duty_cycle(entries,cycle)))
+    for error in errors:
+        print("ERROR: " + error)
+
+    if args.repack:
+        packed = repack(entries,args.guard)
+        entries,errors = compile_schedule(packed,txstring,args.callsign,args.guard)
+        cycle = args.cycle or cycle_length(entries,args.guard)
+        print("\nRepacked:")
+        print_entries(entries)
+        print("Cycle: %d s, on air %.1f%% of it." % (cycle,100*duty_cycle(entries,cycle)))
+        for error in errors:
+            print("ERROR: " + error)
+        if args.output is not None:
+            f = open(args.output,'w')
+            f.write("[\n" + ",\n".join(json.dumps(s,sort_keys=True) for s in packed) + "\n]\n")
+            f.close()
+            print("Written to " + args.output)
+    if len(errors) > 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
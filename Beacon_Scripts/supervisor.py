@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# supervisor.py - Self-healing QITX connection
+#
+# Keeps a transmitter going through the faults which used to need reset_tx.py and a restart:
+#  - TIMEOUT    The firmware hit TX_TIMEOUT and turned the transmitter off.
+#  - hang       No reply to a command within QITX.command_timeout between transmissions, or a
+#               transmission still going hang_margin seconds after it should have finished
+#               (going by schedule_compiler.py's airtime).
+#  - lost port  The serial port (or TCP connection) went away, i.e. a USB glitch.
+#
+# Recovery from any of them is the same:
+#  1. Switch the PA off, straight away.
+#  2. Wait for the port to be there, and hard reset the transmitter with the 1200 baud touch,
+#     as reset_tx.py does. Whatever the firmware was stuck in, it starts again from scratch.
+#     (This can't be done over a raw TCP connection, which is just reconnected.)
+#  3. Wait for the port to go away and come back as the Leonardo re-enumerates, reconnect, and
+#     check it answers.
+#  4. Set the parameters from the config again.
+# The time from the fault being noticed to the transmitter being ready again is printed, and
+# kept in recoveries.
+#
+# run_schedule() runs a schedule through beacon_json.py one entry at a time, checking for faults
+# between entries and recovering from them. Entries whose slots have passed by the time the
+# transmitter is back are skipped, so the schedule picks up again at the next slot.
+#
+# Usage: python supervisor.py [--speed 1]
+# Runs a schedule against the simulator (qitx_sim.py), with a fault injected into each cycle.
+#
+# Copyright 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse,os,shutil,tempfile,threading,time
+import QITX,beacon_json,scheduler,schedule_compiler,transport
+
+# Seconds past its expected end before a transmission is taken to have hung.
+hang_margin = 10.0
+
+# How long to wait for the port to go away after the 1200 baud touch, and for the transmitter
+# to come back after that (the Leonardo bootloader alone takes 8 seconds).
+reset_settle_time = 2.0
+reenumerate_timeout = 30.0
+poll_interval = 0.25
+
+# Seconds before each slot the transmitter is checked.
+check_lead = 2.0
+
+# Entries more than this late (s) when their turn comes are skipped, not sent late.
+late_limit = schedule_compiler.default_guard
+
+# Number of recoveries kept.
+recovery_log_length = 20
+
+
+def hard_reset(device):
+    # The 1200 baud touch: opening the Leonardo's port at 1200 baud and closing it again sends it
+    # into its bootloader. Returns False if it couldn't be done.
+    path = transport.local_device(device)
+    if path is None:
+        print "Can't hard reset a transmitter over TCP, reconnecting only."
+        return False
+    if not transport.serial_enabled:
+        print "pyserial is needed to hard reset the transmitter."
+        return False
+    try:
+        port = transport.serial.Serial(path,1200)
+        port.close()
+    except (transport.serial.SerialException,EnvironmentError,ValueError) as e:
+        print "Could not hard reset transmitter:",e
+        return False
+    return True
+
+
+class Supervisor(object):
+
+    def __init__(self,conf,tx=None):
+        # conf is a config dictionary from beacon_json.read_config().
+        self.conf = conf
+        self.tx = tx
+        if tx is not None:
+            tx.timeout_callbacks.append(self.on_timeout)
+        # The fault being recovered from, and when it was noticed.
+        self.fault = None
+        self.fault_time = None
+        self.recoveries = []
+        self.hang_margin = hang_margin
+        self.reenumerate_timeout = reenumerate_timeout
+
+    def set_fault(self,reason):
+        # Only the first fault counts. Anything after it is probably a result of it.
+        if self.fault is None:
+            print "Transmitter fault: " + reason
+            self.fault = reason
+            self.fault_time = time.time()
+
+    def on_timeout(self):
+        # Called from the QITX reader thread.
+        self.tx.power_on(False)
+        self.set_fault("TIMEOUT")
+
+    def on_hang(self,mode):
+        # Called from the watchdog timer thread.
+        self.set_fault("hang")
+        print mode + " should have finished by now."
+        self.tx.power_on(False)
+        # Closing the port wakes up whatever is waiting for the transmitter.
+        self.tx.close()
+
+    def ping(self):
+        # True if the transmitter answers a command.
+        return self.tx.send_command('INHIBIT').wait(QITX.command_timeout) == 'OK'
+
+    def check(self):
+        # The current fault, if any, after checking the transmitter still answers.
+        if self.fault is None:
+            if self.tx is None or not self.tx.running:
+                self.set_fault("lost port")
+            elif not self.ping():
+                self.set_fault("hang" if self.tx.running else "lost port")
+        return self.fault
+
+    def configure(self):
+        conf = self.conf
+        results = self.tx.configure(FREQ=conf['freq'],FREQOFF=conf['freqoff'],FREQSSB=conf['freqssb'],POWER=conf['power'],CALL=conf['mycall'])
+        for name in results:
+            if not results[name]:
+                print "Failed to set " + name
+        return self.tx.running
+
+    def connect(self):
+        # Open the transmitter if it isn't already, recovering it if it has a fault, and set it
+        # up from the config. Returns True if it's ready.
+        if self.tx is None:
+            self.tx = QITX.QITX(self.conf['serial_device'],int(self.conf['power_pin']))
+            self.tx.timeout_callbacks.append(self.on_timeout)
+        if self.check() is not None:
+            return self.recover()
+        return self.configure()
+
+    def wait_for_port(self,path,present,timeout):
+        # Wait for a device file to appear (or go away). True if it did within the timeout.
+        deadline = time.time() + timeout
+        while os.path.exists(path) != present:
+            if time.time() > deadline:
+                return False
+            time.sleep(poll_interval)
+        return True
+
+    def reconnect(self,timeout):
+        # Keep trying to connect until the transmitter answers. Returns True if it did.
+        deadline = time.time() + timeout
+        path = transport.local_device(self.conf['serial_device'])
+        while time.time() < deadline:
+            if path is None or os.path.exists(path):
+                if self.tx.connect() and self.ping():
+                    return True
+                self.tx.close()
+            time.sleep(poll_interval)
+        return False
+
+    def recover(self):
+        # Hard reset the transmitter and get it going again. Returns True if it's back.
+        reason = self.fault
+        detected = self.fault_time
+        print "Recovering from " + reason + "..."
+        self.tx.power_on(False)
+        self.tx.close()
+
+        path = transport.local_device(self.conf['serial_device'])
+        reset = False
+        if path is None or self.wait_for_port(path,True,self.reenumerate_timeout):
+            reset = hard_reset(self.conf['serial_device'])
+        if reset:
+            self.wait_for_port(path,False,reset_settle_time)
+
+        # Anything from here on is a new fault.
+        self.fault = None
+        ok = self.reconnect(self.reenumerate_timeout) and self.configure()
+        finished = time.time()
+        if not ok:
+            # Still the same fault, for the next attempt.
+            self.set_fault(reason)
+            self.fault_time = detected
+
+        record = {'reason': reason, 'detected': detected, 'finished': finished, 'elapsed': finished - detected,
+            'reset': reset, 'ok': ok}
+        self.recoveries.append(record)
+        del self.recoveries[:-recovery_log_length]
+        if ok:
+            print "Recovered from %s in %.1f seconds%s." % (reason,record['elapsed']," (hard reset)" if reset else "")
+        else:
+            print "Could not recover from %s after %.1f seconds." % (reason,record['elapsed'])
+        return ok
+
+    def transmit(self,tx_setting,txdata,start_time,on_start,slots):
+        # Send one entry through beacon_json.run_schedule(), with a watchdog on how long it takes.
+        scheduled_time = start_time + int(tx_setting["starttime"])
+        try:
+            airtime = schedule_compiler.entry_airtime(tx_setting,txdata["txstring"],self.conf['mycall'])
+        except ValueError:
+            airtime = QITX.transmit_timeout
+        limit = max(0,scheduled_time - time.time()) + airtime + self.hang_margin
+        watchdog = threading.Timer(limit,self.on_hang,[tx_setting["mode"]])
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            result = beacon_json.run_schedule(self.tx,[tx_setting],txdata,start_time,on_start,slots)[0]
+        except transport.TransportError as e:
+            print "ERROR:",e
+            self.set_fault("lost port")
+            result = {'mode': tx_setting["mode"], 'scheduled': scheduled_time, 'ok': False}
+        finally:
+            watchdog.cancel()
+        # Find out why it failed, now, rather than before the next entry.
+        if not result['ok']:
+            self.check()
+        if self.fault is not None:
+            result['fault'] = self.fault
+        return result
+
+    def run_schedule(self,schedule,txdata,start_time,on_start=None,slots=None):
+        # beacon_json.run_schedule(), recovering from faults between entries. The PA is switched
+        # on for the schedule, and off again at the end. Returns the result of each entry, with
+        # 'skipped' set on those which were missed.
+        if slots is None:
+            slots = scheduler.SlotScheduler()
+        results = []
+        self.tx.power_on(True)
+        try:
+            for tx_setting in schedule:
+                scheduled_time = start_time + int(tx_setting["starttime"])
+                # Recover straight away from a fault we already know about. Otherwise check
+                # the transmitter just before the slot. Only transmissions belong in the slot log.
+                if self.fault is None:
+                    slots.wait_until(scheduled_time - check_lead,"check")
+                    slots.log.pop()
+                if self.check() is not None:
+                    if not self.recover():
+                        print "Giving up on the rest of this cycle."
+                        break
+                    self.tx.power_on(True)
+
+                if time.time() > scheduled_time + late_limit:
+                    print "Skipping " + tx_setting["mode"] + ", its slot has passed."
+                    results.append({'mode': tx_setting["mode"], 'scheduled': scheduled_time, 'ok': False, 'skipped': True})
+                    continue
+                results.append(self.transmit(tx_setting,txdata,start_time,on_start,slots))
+        finally:
+            self.tx.power_on(False)
+
+        # Don't leave a fault from the last entry for the next cycle.
+        if self.fault is not None:
+            self.recover()
+        return results
+
+    def close(self):
+        if self.tx is not None:
+            self.tx.power_on(False)
+            self.tx.close()
+
+
+# Schedule used for the simulator run, and the fault injected into each cycle (seconds after
+# the cycle start): TIMEOUT between transmissions, the USB port dropping out mid-transmission,
+# and the firmware hanging.
+demo_schedule = [{"mode": "IDENT", "starttime": 0},{"mode": "BPSK250", "starttime": 7},
+    {"mode": "IDENT", "starttime": 20},{"mode": "BPSK250", "starttime": 27}]
+demo_faults = [("TIMEOUT",16.0),("unplug",10.0),("hang",6.0)]
+
+def demo(speed):
+    import qitx_sim
+    folder = tempfile.mkdtemp()
+    sim = qitx_sim.QITXSimulator(speed,os.path.join(folder,"qitx"))
+    sim.start()
+    print "Using simulator on " + sim.link
+    conf = {'serial_device': sim.link, 'power_pin': 25, 'mycall': 'VK5QI', 'freq': '7040000',
+        'freqoff': '1000', 'freqssb': 'LSB', 'power': 'HIGH'}
+    supervisor = Supervisor(conf)
+    faults = {'TIMEOUT': sim.timeout, 'unplug': lambda: sim.unplug(2.0), 'hang': sim.hang}
+    try:
+        for (fault,at) in demo_faults:
+            supervisor.connect()
+            start_time = int(time.time()) + 2
+            txdata = beacon_json.generate_txstring(start_time)
+            print "\nCycle with %s at %.1f seconds:" % (fault,at)
+            injector = threading.Timer(start_time + at - time.time(),faults[fault])
+            injector.start()
+            results = supervisor.run_schedule(demo_schedule,txdata,start_time)
+            injector.cancel()
+            for r in results:
+                print "  %5.1f %-8s %s" % (r['scheduled'] - start_time,r['mode'],
+                    "skipped" if r.get('skipped') else ("OK" if r['ok'] else "failed (%s)" % r.get('fault')))
+    finally:
+        supervisor.close()
+        sim.stop()
+        shutil.rmtree(folder)
+
+    print "\nRecoveries:"
+    for r in supervisor.recoveries:
+        print "  %-10s %5.1f s  %s" % (r['reason'],r['elapsed'],"hard reset" if r['reset'] else "no reset")
+    print "Firmware resets: %d" % sim.resets
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a schedule against the simulator, recovering from injected faults")
+    parser.add_argument("--speed",type=float,default=1.0,help="Simulator clock speed.")
+    args = parser.parse_args()
+    demo(args.speed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# synth.py - QITX Baseband Synthesizer
+#
+# Renders what the transmitter puts on air, as heard by an SSB receiver tuned to the
+# transmit frequency (FREQ) on the right sideband, so it can be fed to fldigi and other
+# decoders, or measured, without a radio.
+#
+# Each mode follows the firmware:
+#  - BPSK: the symbol stream produced by bpsk_isr() (two phase reversals between characters,
+#    then the varicode word LSB first, with a reversal for every 0 bit, and reversals while
+#    idle). Each reversal is the phase-step sequence written by bpsk_phase_switch() in
+#    PSK_STEPS.ino, one step per AD9834_SendWord(), on the AD9834's 12-bit phase register.
+#  - RTTY: 8N1 from rtty_isr(), switching between the two frequency registers, which keeps
+#    the DDS phase continuous. RTTY,<baud>,<shift> sends the stored MSG, not the payload, and
+#    never calls rtty_stop(), so after the message the transmitter idles on mark until the
+#    firmware's TX_TIMEOUT turns it off. That's what's rendered, so an RTTY entry runs over
+#    the rest of its cycle.
+#  - Morse: the 20 WPM ident from ident(), keying the DAC on and off.
+#  - SELCALL: the CCIR 493-4 dot preamble, phasing and call words from SELCALL.ino, on the
+#    1700Hz/1870Hz tones.
+# Everything is generated with whole-array NumPy operations, so long runs render quickly.
+#
+# Signals are returned as complex (analytic) baseband; the real part is the receiver audio.
+#
+# Usage: python synth.py [--fs 8000] [--iq] [--cycles N] [--start "dd-mm-YYYY HH:MM"] schedule.json out.wav
+# Renders N cycles of a beacon schedule, with the payload for each cycle's start minute.
+#
+# Copyright 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse,json,math,os,re,time,wave
+import numpy as np
+import varicode,payload
+
+# The AD9834 phase registers are 12 bits wide, covering 0 to 2pi.
+PHASE_BITS = 12
+
+# Time taken by one AD9834_SendWord(): two SPI transfers at SPI_CLOCK_DIV2 (8MHz) plus the
+# FSYNC port writes and call overhead. This is an estimate - bpsk_phase_switch() toggles
+# PORTC bit 7 so the real figure can be measured on a scope.
+SENDWORD_TIME = 3.5e-6
+
+default_steps_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),"..","QITX_Remote","PSK_STEPS.ino")
+
+# SELCALL.ino
+SELCALL_TONES = (1700.0,1870.0)
+SEL_SEL = 120
+SEL_ID = 123
+SEL_RTN = 100
+SEL_ARQ = 117
+SEL_PDX = 125
+selcall_phasing = [SEL_PDX,109,SEL_PDX,108,SEL_PDX,107,SEL_PDX,106,SEL_PDX,105,SEL_PDX,104]
+SELCALL_PREAMBLE = 700
+
+# Morse ident speed, from ident().
+IDENT_WPM = 20
+
+
+def linear_profile(steps=181):
+    # The profile phase_generator_ad9834(0:180) produces, which is what PSK_STEPS.ino holds today.
+    degrees = np.linspace(0,180,steps)
+    return np.round(2047*degrees/180).astype(np.int64)
+
+def load_profile(filename=default_steps_file):
+    # Phase register values written by the first (0 -> 180 degree) branch of bpsk_phase_switch().
+    f = open(filename)
+    source = f.read()
+    f.close()
+    first_branch = source.split("}else{")[0]
+    return np.array([int(x,16) & 0x0FFF for x in re.findall(r"AD9834_SendWord\(0x(C[0-9A-Fa-f]{3})\)",first_branch)],dtype=np.int64)
+
+def default_profile():
+    try:
+        return load_profile()
+    except (IOError,OSError):
+        return linear_profile()
+
+def text_codes(data):
+    codes = np.frombuffer(data.encode('ascii','replace'),dtype=np.uint8).astype(np.int64)
+    return codes
+
+
+# BPSK
+def _bpsk_tables():
+    # For each character, the ticks bpsk_isr() spends on it, as 1 for a phase reversal and 0
+    # for none. A NUL is read from the buffer but never sent, costing a single reversal.
+    maxlen = varicode.BPSK_CHAR_GAP + max(w.bit_length() for w in varicode.bpsk_varicode)
+    table = np.zeros((128,maxlen),dtype=np.int8)
+    lengths = np.zeros(128,dtype=np.int64)
+    for code in range(128):
+        word = varicode.bpsk_varicode[code]
+        if code == 0:
+            table[code,0] = 1
+            lengths[code] = 1
+            continue
+        table[code,:varicode.BPSK_CHAR_GAP] = 1
+        for i in range(word.bit_length()):
+            table[code,varicode.BPSK_CHAR_GAP+i] = 1 - ((word >> i) & 1)
+        lengths[code] = varicode.BPSK_CHAR_GAP + word.bit_length()
+    return table,lengths
+
+bpsk_table,bpsk_lengths = _bpsk_tables()
+
+def bpsk_reversals(data,baudrate=31,preamble=0,postamble=0):
+    # Per-tick phase reversal flags for a string, with idle reversals before and after.
+    codes = text_codes(data)
+    if np.any(codes > 127):
+        raise ValueError("No varicode for some characters in %r" % data)
+    period = varicode.symbol_period(baudrate)
+    rows = bpsk_table[codes]
+    mask = np.arange(bpsk_table.shape[1])[np.newaxis,:] < bpsk_lengths[codes][:,np.newaxis]
+    idle_pre = np.ones(int(round(preamble/period)),dtype=np.int8)
+    idle_post = np.ones(int(round(postamble/period)),dtype=np.int8)
+    return np.concatenate([idle_pre,rows[mask],idle_post])
+
+
+# RTTY and SELCALL bit streams
+def rtty_bits(data,preamble=0,baudrate=50):
+    # 8N1 from rtty_isr(): start bit, 8 data bits LSB first, stop bit, with mark while idle.
+    codes = text_codes(data)
+    bits = np.empty((len(codes),10),dtype=np.int8)
+    bits[:,0] = 0
+    bits[:,1:9] = (codes[:,np.newaxis] >> np.arange(8)[np.newaxis,:]) & 1
+    bits[:,9] = 1
+    period = varicode.rtty_timer_period.get(baudrate,20000)/1e6
+    return np.concatenate([np.ones(int(round(preamble/period)),dtype=np.int8),bits.ravel()])
+
+def selcall_word(value):
+    # selcall_get_word(): the 7-bit value LSB first, then a 3-bit count of its zeros, MSB first.
+    lookup = [0x0000,0x0200,0x0100,0x0300,0x0080,0x0280,0x0180,0x0380]
+    zeros = sum(1 for i in range(7) if not (value >> i) & 1)
+    return (value & 0x7F) | lookup[zeros]
+
+def selcall_symbols(source=1881,dest=1882,chantest=True):
+    # The message built by selcall_call()/selcall_chan_test().
+    a1,a2 = (source//100)%100,source%100
+    b1,b2 = (dest//100)%100,dest%100
+    first = SEL_ID if chantest else SEL_SEL
+    return [first,first,b1,first,b2,first,SEL_RTN,b1,a1,b2,a2,SEL_RTN,SEL_ARQ,a1,SEL_ARQ,a2,SEL_ARQ,SEL_ARQ]
+
+def selcall_bits(source=1881,dest=1882,chantest=True):
+    words = np.array([selcall_word(x) for x in selcall_phasing + selcall_symbols(source,dest,chantest)],dtype=np.int64)
+    bits = ((words[:,np.newaxis] >> np.arange(10)[np.newaxis,:]) & 1).astype(np.int8)
+    preamble = np.tile(np.array([0,1],dtype=np.int8),SELCALL_PREAMBLE)
+    return np.concatenate([preamble,bits.ravel()])
+
+
+# Morse
+def morse_keying(text):
+    # On/off state for each dit period of morse_tx_string(text).
+    units = []
+    for letter in text:
+        for element in varicode.morse_code[varicode.morse_index(letter)]:
+            units += {'0': [1], '1': [1,1,1], '2': [0]*6}[element] + [0]
+        units += [0,0,0]
+    return np.array(units,dtype=np.int8)
+
+
+class Synthesizer(object):
+
+    def __init__(self,fs=8000,offset=1000,profile=None,sendword_time=SENDWORD_TIME):
+        # fs: sample rate. offset: the FREQOFF setting, i.e. the audio frequency of PSK, RTTY
+        # mark/space base and Morse. profile: 12-bit phase register values for one reversal.
+        self.fs = float(fs)
+        self.offset = float(offset)
+        if profile is None:
+            profile = default_profile()
+        self.profile = np.asarray(profile,dtype=np.int64)
+        self.sendword_time = sendword_time
+
+    def times(self,duration):
+        return np.arange(int(round(duration*self.fs)))/self.fs
+
+    def phase_register(self,reversal_times,t):
+        # Value of the phase register at each time t, given the times of each bpsk_phase_switch().
+        # Odd-numbered switches step up through the profile, even-numbered ones back down.
+        last = np.searchsorted(reversal_times,t,side='right') - 1
+        steps = np.floor((t - reversal_times[np.maximum(last,0)])/self.sendword_time).astype(np.int64)
+        steps = np.clip(steps,0,len(self.profile)-1)
+        rising = (last % 2) == 0
+        reg = np.where(rising,self.profile[steps],self.profile[::-1][steps])
+        return np.where(last < 0,0,reg)
+
+    def bpsk(self,data,baudrate=31,preamble=3,postamble=1):
+        # A PSKTERM/PSKFLOW transmission: preamble seconds of idle, the data, then postamble seconds of idle.
+        period = varicode.symbol_period(baudrate)
+        flags = bpsk_reversals(data,baudrate,preamble,postamble)
+        # bpsk_isr() first runs one period after bpsk_start() keys up.
+        ticks = (np.arange(len(flags)) + 1)*period
+        reversal_times = ticks[flags == 1]
+        t = self.times((len(flags) + 1)*period)
+        phase = 2*np.pi*self.phase_register(reversal_times,t)/(1 << PHASE_BITS)
+        return np.exp(1j*(2*np.pi*self.offset*t + phase)).astype(np.complex64)
+
+    def fsk(self,bits,period,f0,f1):
+        # Continuous phase FSK, as from switching between the AD9834 frequency registers.
+        n = int(round(len(bits)*period*self.fs))
+        symbol = np.minimum((np.arange(n)/self.fs/period).astype(np.int64),len(bits)-1)
+        freq = np.where(bits[symbol] == 1,f1,f0)
+        phase = 2*np.pi*np.cumsum(freq)/self.fs
+        return np.exp(1j*phase).astype(np.complex64)
+
+    def rtty(self,data,baudrate=50,shift=170,preamble=0,duration=None):
+        # RTTY,<baud>,<shift>: mark is offset+shift, space is offset, as heard on the right sideband.
+        # If given a duration (s), idles on mark after the data until then.
+        period = varicode.rtty_timer_period.get(baudrate,20000)/1e6
+        bits = rtty_bits(data,preamble,baudrate)
+        if duration is not None:
+            idle = int(round(duration/period)) - len(bits)
+            bits = np.concatenate([bits,np.ones(max(0,idle),dtype=np.int8)])
+        return self.fsk(bits,period,self.offset,self.offset+shift)
+
+    def selcall(self,source=1881,dest=1882,chantest=True):
+        return self.fsk(selcall_bits(source,dest,chantest),varicode.SELCALL_DELAY,SELCALL_TONES[0],SELCALL_TONES[1])
+
+    def ident(self,callsign):
+        # ident(): "DE " then the callsign.
+        dit = 1.2/IDENT_WPM
+        keying = np.concatenate([morse_keying("DE "),morse_keying(callsign)])
+        t = self.times(len(keying)*dit)
+        on = keying[np.minimum((t/dit).astype(np.int64),len(keying)-1)]
+        return (on*np.exp(1j*2*np.pi*self.offset*t)).astype(np.complex64)
+
+    def silence(self,duration):
+        return np.zeros(int(round(duration*self.fs)),dtype=np.complex64)
+
+    def render(self,mode,txdata,callsign="VK5QI",msg=None):
+        # One schedule entry, as the firmware would transmit it. msg is the stored MSG, which
+        # the firmware sets to "DE <callsign> TEST BEACON" when it starts.
+        if mode == "IDENT":
+            return self.ident(callsign)
+        elif mode.startswith("BPSK"):
+            return self.bpsk(txdata["txstring"],int(mode[4:]),3,1)
+        elif mode.startswith("RTTY"):
+            if msg is None:
+                msg = default_msg(callsign)
+            return self.rtty(msg,int(mode[4:] or 50),duration=varicode.TX_TIMEOUT)
+        elif mode in ("SELCALL","SELTEST"):
+            return self.selcall(chantest=(mode == "SELTEST"))
+        raise ValueError("Unknown mode " + mode)
+
+    def cycle(self,schedule,txdata,length,callsign="VK5QI",msg=None):
+        # A whole schedule cycle of 'length' seconds. Transmissions which overrun the next
+        # one are cut short by it.
+        out = self.silence(length)
+        for tx_setting in schedule:
+            start = int(round(int(tx_setting["starttime"])*self.fs))
+            if start >= len(out):
+                continue
+            signal = self.render(tx_setting["mode"],txdata,callsign,msg)[:len(out)-start]
+            out[start:start+len(signal)] = signal
+        return out
+
+
+def default_msg(callsign):
+    # The MSG setting the firmware starts with.
+    return "DE %s TEST BEACON" % callsign
+
+def cycle_length(synth,schedule,txdata,callsign="VK5QI",msg=None):
+    # Length of a schedule, rounded up to whole minutes.
+    end = max(int(s["starttime"]) + len(synth.render(s["mode"],txdata,callsign,msg))/synth.fs for s in schedule)
+    return max(1,int(math.ceil(end/60.0)))*60
+
+def open_wav(filename,fs,iq=False):
+    w = wave.open(filename,'wb')
+    w.setnchannels(2 if iq else 1)
+    w.setsampwidth(2)
+    w.setframerate(int(fs))
+    return w
+
+def write_wav(w,signal,iq=False,level=0.7):
+    # 16-bit PCM: the audio, or I and Q as left and right.
+    if iq:
+        samples = np.empty(2*len(signal),dtype=np.float32)
+        samples[0::2] = signal.real
+        samples[1::2] = signal.imag
+    else:
+        samples = signal.real
+    w.writeframes((np.clip(samples*level,-1,1)*32767).astype('<i2').tobytes())
+
+def main():
+    parser = argparse.ArgumentParser(description="Render beacon transmissions to a WAV file")
+    parser.add_argument("schedule")
+    parser.add_argument("output")
+    parser.add_argument("--fs",type=float,default=8000)
+    parser.add_argument("--offset",type=float,default=1000,help="FREQOFF setting (Hz)")
+    parser.add_argument("--callsign",default="VK5QI")
+    parser.add_argument("--msg",default=None,help="The transmitter's MSG setting, which RTTY sends. Defaults to the firmware's.")
+    parser.add_argument("--iq",action="store_true",help="Write I/Q as a stereo file, instead of audio.")
+    parser.add_argument("--cycles",type=int,default=1)
+    parser.add_argument("--start",default=None,help="Start minute (dd-mm-YYYY HH:MM, UTC) for the payloads.")
+    args = parser.parse_args()
+
+    f = open(args.schedule)
+    schedule = json.loads(f.read())
+    f.close()
+
+    synth = Synthesizer(args.fs,args.offset)
+    if args.start is not None:
+        start = payload.parse_timeseed(args.start)
+    else:
+        start = payload.minute(time.time()) + 60
+    length = cycle_length(synth,schedule,payload.txdata(start),args.callsign,args.msg)
+
+    began = time.time()
+    w = open_wav(args.output,args.fs,args.iq)
+    for i in range(args.cycles):
+        txdata = payload.txdata(start + i*length)
+        write_wav(w,synth.cycle(schedule,txdata,length,args.callsign,args.msg),args.iq)
+    w.close()
+    print("Rendered %d x %d second cycles in %.1f seconds." % (args.cycles,length,time.time()-began))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# test_aioqitx.py - Tests for aioqitx.py against the simulator (qitx_sim.py)
+#
+# Usage: python3 -m pytest test_aioqitx.py  (or python3 -m unittest test_aioqitx)
+#
+# Copyright 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio,unittest
+import aioqitx,qitx_sim
+
+# Fast enough to keep the tests short, slow enough that an IDENT outlasts a short timeout.
+sim_speed = 2.0
+
+
+class AsyncQITXTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sim = qitx_sim.QITXSimulator(sim_speed)
+        self.sim.start()
+
+    def tearDown(self):
+        self.sim.stop()
+
+    def run_client(self,test):
+        async def run():
+            async with aioqitx.AsyncQITX(self.sim.port) as tx:
+                self.assertTrue(tx.running)
+                await test(tx)
+        asyncio.run(run())
+
+    def test_parameters(self):
+        async def test(tx):
+            self.assertEqual(await tx.get_parameter('FREQ'),'7045000')
+            results = await tx.configure(FREQ='7038000',POWER='LOW')
+            self.assertEqual(results,{'FREQ': True, 'POWER': True})
+            tx.invalidate()
+            self.assertEqual(await tx.get_parameter('POWER'),'LOW')
+        self.run_client(test)
+
+    def test_timeout_resyncs(self):
+        # The IDENT's reply arrives long after its timeout. It must not be taken as the reply
+        # to the next command.
+        async def test(tx):
+            self.assertIsNone(await tx.send_command('IDENT').wait(0.2))
+            self.assertEqual(tx.resyncs,1)
+            r = tx.send_command('FREQ')
+            self.assertEqual(await r.wait(30),'OK')
+            self.assertEqual(r.value,'7045000')
+            self.assertIn('OK',tx.unsolicited)
+            self.assertEqual(await tx.get_parameter('CALL'),'VK5QI ')
+            self.assertEqual(len(tx.pending),0)
+        self.run_client(test)
+
+    def test_timeout_abandons_pending(self):
+        # Everything queued behind the command that timed out is given up on too.
+        async def test(tx):
+            ident = tx.send_command('IDENT')
+            freq = tx.send_command('FREQ')
+            self.assertIsNone(await ident.wait(0.2))
+            self.assertTrue(freq.future.done())
+            self.assertIsNone(freq.status)
+            # The sync is answered once the IDENT is over, and then replies line up again.
+            self.assertEqual(await tx.sync.wait(30),'OK')
+            self.assertIsNone(tx.sync)
+            self.assertEqual(await tx.get_parameter('FREQ'),'7045000')
+        self.run_client(test)
+
+    def test_cancel_keeps_command_queued(self):
+        # A cancelled command is still matched to its late reply, without a resync.
+        async def test(tx):
+            ident = tx.send_command('IDENT')
+            task = asyncio.ensure_future(ident.wait(30))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            r = tx.send_command('FREQ')
+            self.assertEqual(await r.wait(30),'OK')
+            self.assertEqual(ident.status,'OK')
+            self.assertEqual(r.value,'7045000')
+            self.assertEqual(tx.resyncs,0)
+        self.run_client(test)
+
+    def test_failing_timeout_callback(self):
+        async def test(tx):
+            called = []
+            def broken():
+                called.append(True)
+                raise RuntimeError("broken callback")
+            tx.timeout_callbacks.append(broken)
+            tx.timeout_callbacks.append(lambda: called.append(True))
+            self.sim.timeout()
+            for i in range(50):
+                if tx.timeout_count > 0:
+                    break
+                await asyncio.sleep(0.1)
+            self.assertEqual(tx.timeout_count,1)
+            self.assertEqual(called,[True,True])
+            self.assertTrue(tx.running)
+            self.assertEqual(await tx.get_parameter('FREQ'),'7045000')
+        self.run_client(test)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# transport.py - Byte transports for talking to a QITX
+#
+# QITX.py talks to the transmitter through one of these, picked by the device name:
+#  - /dev/ttyACM0                 A local serial port, opened with pyserial (SerialTransport), but
+#                                 read straight from its file descriptor where there is one.
+#  - tcp://host:port              A raw TCP connection, e.g. to ser2net on a remote site's
+#    (or socket://host:port)      computer (TCPTransport). Nagle's algorithm is turned off,
+#                                 so each PSKTERM character goes out as soon as it's written.
+#  - pty:/dev/pts/3               A local pseudo-terminal, such as the simulator's (qitx_sim.py),
+#                                 read and written directly without pyserial (PtyTransport).
+#
+# Every transport has the same few methods: read_into() fills a buffer with whatever has
+# arrived (returning 0 if nothing did within the read timeout, so the caller can check its own
+# deadlines), write(), which doesn't return until all of the data is written, fileno() and close(). Any failure, including the other end going away,
+# is raised as a TransportError.
+#
+# LineBuffer frames the incoming bytes into lines in one preallocated bytearray. Data is read
+# straight into the free space at its end, only the new bytes are searched for line endings,
+# and the unfinished line left over is moved back to the start only when the end is reached.
+#
+# Copyright 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+import io,os,select,socket
+
+try:
+    import serial
+    serial_enabled = True
+except ImportError:
+    serial_enabled = False
+
+default_baudrate = 38400
+
+# How long a read waits for data before returning 0 (s).
+default_read_timeout = 0.1
+
+# How long a write to a network connection may take before giving up (s). Much longer than a
+# read, as a slow link can hold up writes for a while without anything being wrong.
+default_write_timeout = 10.0
+
+# How long to wait for a TCP connection to be made (s).
+connect_timeout = 5.0
+
+# Size of the receive buffer. Much longer than any line the firmware sends.
+default_buffer_size = 4096
+
+
+class TransportError(IOError):
+    pass
+
+
+# Lines as native strings: bytes on Python 2, text on Python 3.
+if bytes is str:
+    def line_string(data):
+        return str(data)
+else:
+    def line_string(data):
+        return data.decode('ascii','replace')
+
+def to_bytes(data):
+    if isinstance(data,(bytes,bytearray,memoryview)):
+        return data
+    return data.encode('ascii')
+
+
+class LineBuffer(object):
+
+    def __init__(self,size=default_buffer_size):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        # buf[start:end] has been received but not yet handed out as a line.
+        self.start = 0
+        self.end = 0
+        # Lines too long for the buffer, which were thrown away.
+        self.overflows = 0
+
+    def space(self):
+        # Writable view of the free space to read into.
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.end == len(self.buf):
+            if self.start == 0:
+                # One line has filled the whole buffer. Throw it away.
+                self.overflows += 1
+                self.end = 0
+            else:
+                length = self.end - self.start
+                self.buf[0:length] = self.buf[self.start:self.end]
+                self.start = 0
+                self.end = length
+        return self.view[self.end:]
+
+    def feed(self,n):
+        # Take n bytes just read into space(). Returns the lines they completed, without
+        # their line endings.
+        lines = []
+        scan = self.end
+        self.end += n
+        while True:
+            i = self.buf.find(b'\n',scan,self.end)
+            if i == -1:
+                return lines
+            end = i
+            if end > self.start and self.buf[end-1] == 13:
+                end -= 1
+            lines.append(line_string(self.buf[self.start:end]))
+            self.start = scan = i + 1
+
+
+def write_all(f,data):
+    # Write all of data to a raw (unbuffered) file. Its write() returns how much it wrote, which
+    # may be less than all of it, or None if a non-blocking file would have blocked.
+    view = memoryview(to_bytes(data))
+    while len(view) > 0:
+        n = f.write(view)
+        if n is None:
+            select.select([],[f],[],default_write_timeout)
+            continue
+        view = view[n:]
+
+
+class SerialTransport(object):
+
+    def __init__(self,device,baudrate=default_baudrate,read_timeout=default_read_timeout):
+        if not serial_enabled:
+            raise TransportError("pyserial is needed for serial port " + device)
+        self.name = device
+        self.read_timeout = read_timeout
+        try:
+            self.port = serial.Serial(device,baudrate,timeout=read_timeout)
+        except (serial.SerialException,EnvironmentError,ValueError) as e:
+            raise TransportError(str(e))
+        # pyserial's readinto() reads into a new bytes object and copies it. Where the port has
+        # a file descriptor (POSIX), read it directly into the caller's buffer instead.
+        try:
+            self.raw = io.FileIO(self.port.fileno(),'r',closefd=False)
+        except (AttributeError,EnvironmentError,ValueError):
+            self.raw = None
+
+    def read_into(self,view):
+        if self.raw is not None:
+            try:
+                r,w,x = select.select([self.raw],[],[],self.read_timeout)
+                if not r:
+                    return 0
+                n = self.raw.readinto(view)
+            except (select.error,EnvironmentError,ValueError) as e:
+                raise TransportError(str(e))
+            if n is None:
+                # The port is non-blocking, and someone else got there first.
+                return 0
+            if n == 0:
+                # Readable with nothing to read means the device has gone, as pyserial reports it.
+                raise TransportError(self.name + " reports readiness to read but returned no data (device disconnected?)")
+            return n
+        # Read what's already waiting, or block for one byte up to the timeout. Asking for any
+        # more would wait for all of it to arrive.
+        try:
+            n = min(self.port.inWaiting() or 1,len(view))
+            return self.port.readinto(view[:n])
+        except (serial.SerialException,EnvironmentError,TypeError,ValueError) as e:
+            raise TransportError(str(e))
+
+    def write(self,data):
+        try:
+            self.port.write(to_bytes(data))
+        except (serial.SerialException,EnvironmentError,TypeError,ValueError) as e:
+            raise TransportError(str(e))
+
+    def fileno(self):
+        return self.port.fileno()
+
+    def close(self):
+        if self.raw is not None:
+            self.raw.close()
+        self.port.close()
+
+
+class TCPTransport(object):
+
+    def __init__(self,host,port,read_timeout=default_read_timeout,write_timeout=default_write_timeout):
+        self.name = "tcp://%s:%d" % (host,port)
+        self.read_timeout = read_timeout
+        try:
+            self.sock = socket.create_connection((host,port),connect_timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+            # The socket timeout applies to sendall() as well as recv_into(), so it's the write
+            # timeout. Reads wait for data with select() and their own, much shorter, timeout.
+            self.sock.settimeout(write_timeout)
+        except (socket.error,EnvironmentError) as e:
+            raise TransportError("Could not connect to %s: %s" % (self.name,e))
+
+    def read_into(self,view):
+        try:
+            r,w,x = select.select([self.sock],[],[],self.read_timeout)
+            if not r:
+                return 0
+            n = self.sock.recv_into(view)
+        except socket.timeout:
+            return 0
+        except (select.error,socket.error,EnvironmentError,ValueError) as e:
+            raise TransportError(str(e))
+        if n == 0:
+            raise TransportError(self.name + " closed the connection")
+        return n
+
+    def write(self,data):
+        try:
+            self.sock.sendall(to_bytes(data))
+        except (socket.error,EnvironmentError,ValueError) as e:
+            raise TransportError(str(e))
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        # Shut down first, to wake up a reader blocked in recv_into().
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except (socket.error,EnvironmentError):
+            pass
+        self.sock.close()
+
+
+class PtyTransport(object):
+
+    def __init__(self,device,read_timeout=default_read_timeout):
+        self.name = "pty:" + device
+        self.read_timeout = read_timeout
+        try:
+            import tty
+            fd = os.open(device,os.O_RDWR|os.O_NOCTTY)
+            tty.setraw(fd)
+            self.port = io.FileIO(fd,'r+')
+        except (EnvironmentError,ImportError) as e:
+            raise TransportError(str(e))
+
+    def read_into(self,view):
+        try:
+            r,w,x = select.select([self.port],[],[],self.read_timeout)
+            if not r:
+                return 0
+            n = self.port.readinto(view)
+        except (select.error,EnvironmentError,ValueError) as e:
+            raise TransportError(str(e))
+        if n == 0:
+            raise TransportError(self.name + " has closed")
+        return n
+
+    def write(self,data):
+        # FileIO.write() is a single write(2), which can take only part of the data.
+        try:
+            write_all(self.port,data)
+        except (select.error,EnvironmentError,ValueError) as e:
+            raise TransportError(str(e))
+
+    def fileno(self):
+        return self.port.fileno()
+
+    def close(self):
+        self.port.close()
+
+
+def local_device(device):
+    # The file a device name refers to, or None if it's a network connection.
+    if device.startswith(("tcp://","socket://")):
+        return None
+    if device.startswith("pty:"):
+        path = device[4:]
+        if path.startswith("//"):
+            path = path[2:]
+        return path
+    return device
+
+def open_transport(device,baudrate=default_baudrate,read_timeout=default_read_timeout):
+    # Open the transport for a device name (see the top of this file). Raises TransportError.
+    for scheme in ("tcp://","socket://"):
+        if device.startswith(scheme):
+            host,sep,port = device[len(scheme):].rstrip('/').rpartition(':')
+            if sep == '' or not port.isdigit():
+                raise TransportError("Expected " + scheme + "host:port, not " + device)
+            return TCPTransport(host,int(port),read_timeout)
+    if device.startswith("pty:"):
+        return PtyTransport(local_device(device),read_timeout)
+    return SerialTransport(device,baudrate,read_timeout)
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# varicode.py - BPSK Varicode tables and airtime calculations
+#
+# The varicode table is a copy of bpsk_varicode[] in QITX_Remote/PSK.ino, and the timing
+# constants mirror bpsk_start() and bpsk_isr(). Together they let the host work out how
+# long the firmware will take to clock out a string, without needing any feedback from it.
+# The RTTY, Morse and SELCALL timings and TX_TIMEOUT are here too, for the same reason.
+#
+# Python/, Beacon_Scripts/ and RX_Scripts/ each have a copy of this file. Keep them identical.
+#
+# Copyright 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+# 
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+# 
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading,time
+from collections import deque
+
+# Size of the firmware transmit ring buffer (TX_BUFFER_SIZE in QITX_Remote.ino).
+# store_char() always keeps one slot free, so only TX_BUFFER_SIZE-1 characters fit.
+TX_BUFFER_SIZE = 64
+
+# Timer1 periods (in microseconds) used by bpsk_start(). Any other baud rate falls
+# through to the BPSK31 setting.
+bpsk_timer_period = {31: 32000, 63: 15873, 125: 8000, 250: 4000}
+
+# Number of phase reversals bpsk_isr() sends between characters.
+BPSK_CHAR_GAP = 2
+
+# Minimum credit pskFlowTerminal() grants at once, unless the buffer has run dry (CREDIT_BATCH in PSK.ino).
+CREDIT_BATCH = 8
+
+# The firmware turns the transmitter off after this many seconds (TX_TIMEOUT in QITX_Remote.ino).
+TX_TIMEOUT = 600
+
+# SELCALL_DELAY in SELCALL.ino, in seconds per bit.
+SELCALL_DELAY = 0.0098
+
+# RTTY Timer1 periods from rtty_start(). Note that 600 baud falls through to the default.
+rtty_timer_period = {45: 22222, 50: 20000, 75: 13333, 100: 10000, 300: 3333}
+
+# Morse table from Morse.ino. 0 = dit, 1 = dash, 2 = word space.
+morse_code = ["2","01","1000","1010","100","0","0010","110","0000","00","0111","101","0100",
+    "11","10","111","0110","1101","010","000","1","001","0001","011","1001","1011","1100",
+    "11111","01111","00111","00011","00001","00000","10000","11000","11100","11110",
+    "010101","110011","001100","011110","101011","10010","10110","101101","01000","111000",
+    "101010","10001","01010","100001","001101","010010","0001001","011010"]
+morse_symbols = ".,?'!/()&:;=+-_\"$@"
+
+
+# Varicode words, sent LSB first.
+bpsk_varicode = [
+    0x0355, # 0x00  1010101011 (NUL)
+    0x036d, # 0x01  1011011011 (SOH)
+    0x02dd, # 0x02  1011101101 (STX)
+    0x03bb, # 0x03  1101110111 (ETX)
+    0x035d, # 0x04  1011101011 (EOT)
+    0x03eb, # 0x05  1101011111 (ENQ)
+    0x03dd, # 0x06  1011101111 (ACK)
+    0x02fd, # 0x07  1011111101 (BEL)
+    0x03fd, # 0x08  1011111111 (BS)
+    0x00f7, # 0x09  11101111 (HT)
+    0x0017, # 0x0a  11101 (LF)
+    0x03db, # 0x0b  1101101111 (VT)
+    0x02ed, # 0x0c  1011011101 (FF)
+    0x001f, # 0x0d  11111 (CR)
+    0x02bb, # 0x0e  1101110101 (SO)
+    0x0357, # 0x0f  1110101011 (SI)
+    0x03bd, # 0x10  1011110111 (DLE)
+    0x02bd, # 0x11  1011110101 (DC1)
+    0x02d7, # 0x12  1110101101 (DC2)
+    0x03d7, # 0x13  1110101111 (DC3)
+    0x036b, # 0x14  1101011011 (DC4)
+    0x035b, # 0x15  1101101011 (NAK)
+    0x02db, # 0x16  1101101101 (SYN)
+    0x03ab, # 0x17  1101010111 (ETB)
+    0x037b, # 0x18  1101111011 (CAN)
+    0x02fb, # 0x19  1101111101 (EM)
+    0x03b7, # 0x1a  1110110111 (SUB)
+    0x02ab, # 0x1b  1101010101 (ESC)
+    0x02eb, # 0x1c  1101011101 (FS)
+    0x0377, # 0x1d  1110111011 (GS)
+    0x037d, # 0x1e  1011111011 (RS)
+    0x03fb, # 0x1f  1101111111 (US)
+    0x0001, # 0x20  1 (SP)
+    0x01ff, # 0x21  111111111 (!)
+    0x01f5, # 0x22  101011111 (")
+    0x015f, # 0x23  111110101 (#)
+    0x01b7, # 0x24  111011011 ($)
+    0x02ad, # 0x25  1011010101 (%)
+    0x0375, # 0x26  1010111011 (&)
+    0x01fd, # 0x27  101111111 (')
+    0x00df, # 0x28  11111011 (()
+    0x00ef, # 0x29  11110111 ())
+    0x01ed, # 0x2a  101101111 (*)
+    0x01f7, # 0x2b  111011111 (+)
+    0x0057, # 0x2c  1110101 (,)
+    0x002b, # 0x2d  110101 (-)
+    0x0075, # 0x2e  1010111 (.)
+    0x01eb, # 0x2f  110101111 (/)
+    0x00ed, # 0x30  10110111 (0)
+    0x00bd, # 0x31  10111101 (1)
+    0x00b7, # 0x32  11101101 (2)
+    0x00ff, # 0x33  11111111 (3)
+    0x01dd, # 0x34  101110111 (4)
+    0x01b5, # 0x35  101011011 (5)
+    0x01ad, # 0x36  101101011 (6)
+    0x016b, # 0x37  110101101 (7)
+    0x01ab, # 0x38  110101011 (8)
+    0x01db, # 0x39  110110111 (9)
+    0x00af, # 0x3a  11110101 (:)
+    0x017b, # 0x3b  110111101 (;)
+    0x016f, # 0x3c  111101101 (<)
+    0x0055, # 0x3d  1010101 (=)
+    0x01d7, # 0x3e  111010111 (>)
+    0x03d5, # 0x3f  1010101111 (?)
+    0x02f5, # 0x40  1010111101 (@)
+    0x005f, # 0x41  1111101 (A)
+    0x00d7, # 0x42  11101011 (B)
+    0x00b5, # 0x43  10101101 (C)
+    0x00ad, # 0x44  10110101 (D)
+    0x0077, # 0x45  1110111 (E)
+    0x00db, # 0x46  11011011 (F)
+    0x00bf, # 0x47  11111101 (G)
+    0x0155, # 0x48  101010101 (H)
+    0x007f, # 0x49  1111111 (I)
+    0x017f, # 0x4a  111111101 (J)
+    0x017d, # 0x4b  101111101 (K)
+    0x00eb, # 0x4c  11010111 (L)
+    0x00dd, # 0x4d  10111011 (M)
+    0x00bb, # 0x4e  11011101 (N)
+    0x00d5, # 0x4f  10101011 (O)
+    0x00ab, # 0x50  11010101 (P)
+    0x0177, # 0x51  111011101 (Q)
+    0x00f5, # 0x52  10101111 (R)
+    0x007b, # 0x53  1101111 (S)
+    0x005b, # 0x54  1101101 (T)
+    0x01d5, # 0x55  101010111 (U)
+    0x015b, # 0x56  110110101 (V)
+    0x0175, # 0x57  101011101 (W)
+    0x015d, # 0x58  101110101 (X)
+    0x01bd, # 0x59  101111011 (Y)
+    0x02d5, # 0x5a  1010101101 (Z)
+    0x01df, # 0x5b  111110111 ([)
+    0x01ef, # 0x5c  111101111 (\)
+    0x01bf, # 0x5d  111111011 (])
+    0x03f5, # 0x5e  1010111111 (^)
+    0x016d, # 0x5f  101101101 (_)
+    0x03ed, # 0x60  1011011111 (`)
+    0x000d, # 0x61  1011 (a)
+    0x007d, # 0x62  1011111 (b)
+    0x003d, # 0x63  101111 (c)
+    0x002d, # 0x64  101101 (d)
+    0x0003, # 0x65  11 (e)
+    0x002f, # 0x66  111101 (f)
+    0x006d, # 0x67  1011011 (g)
+    0x0035, # 0x68  101011 (h)
+    0x000b, # 0x69  1101 (i)
+    0x01af, # 0x6a  111101011 (j)
+    0x00fd, # 0x6b  10111111 (k)
+    0x001b, # 0x6c  11011 (l)
+    0x0037, # 0x6d  111011 (m)
+    0x000f, # 0x6e  1111 (n)
+    0x0007, # 0x6f  111 (o)
+    0x003f, # 0x70  111111 (p)
+    0x01fb, # 0x71  110111111 (q)
+    0x0015, # 0x72  10101 (r)
+    0x001d, # 0x73  10111 (s)
+    0x0005, # 0x74  101 (t)
+    0x003b, # 0x75  110111 (u)
+    0x006f, # 0x76  1111011 (v)
+    0x006b, # 0x77  1101011 (w)
+    0x00fb, # 0x78  11011111 (x)
+    0x005d, # 0x79  1011101 (y)
+    0x0157, # 0x7a  111010101 (z)
+    0x03b5, # 0x7b  1010110111 ({)
+    0x01bb, # 0x7c  110111011 (|)
+    0x02b5, # 0x7d  1010110101 (})
+    0x03ad, # 0x7e  1011010111 (~)
+    0x02b7, # 0x7f  1110110101 (DEL)
+]
+
+
+def symbol_period(baudrate=31):
+    return bpsk_timer_period.get(int(baudrate), bpsk_timer_period[31]) / 1e6
+
+def char_symbols(c):
+    # Number of symbol periods bpsk_isr() spends on a character: the two inter-character
+    # reversals, then the varicode word. A NUL is taken out of the buffer but never sent,
+    # so it only costs the tick it was read on.
+    code = ord(c)
+    if code > 127:
+        raise ValueError("No varicode for character %r" % c)
+    if code == 0:
+        return 1
+    return BPSK_CHAR_GAP + bpsk_varicode[code].bit_length()
+
+def char_airtime(c, baudrate=31):
+    return char_symbols(c) * symbol_period(baudrate)
+
+def airtime(data, baudrate=31):
+    # Time taken to clock out a string, excluding any preamble.
+    return sum(char_symbols(c) for c in data) * symbol_period(baudrate)
+
+def char_rate(data, baudrate=31):
+    # Theoretical characters/second for this particular string.
+    if len(data) == 0:
+        return 0.0
+    return len(data) / airtime(data, baudrate)
+
+
+def morse_index(letter):
+    # Position of a character in morse_code, as worked out by morse_tx_string().
+    code = ord(letter)
+    if 48 <= code <= 57:
+        return code - 21
+    elif 65 <= code <= 90:
+        return code - 64
+    elif 97 <= code <= 122:
+        return code - 96
+    elif letter in morse_symbols:
+        return 37 + morse_symbols.index(letter)
+    return 0
+
+def morse_units(text):
+    # Length of morse_tx_string(text) in dit periods.
+    units = 0
+    for letter in text:
+        for element in morse_code[morse_index(letter)]:
+            units += {'0': 1, '1': 3, '2': 6}[element] + 1
+        units += 3
+    return units
+
+
+class PSKPacer(object):
+    # Host-side model of the firmware ring buffer during PSKTERM streaming.
+    #
+    # Each character pushed is assumed to leave the buffer when the modulator finishes the
+    # character before it. All the estimates are pessimistic (USB latency, one tick of
+    # jitter before the ISR picks up a character, a slightly slow firmware clock), so the
+    # real buffer is never fuller than the model. headroom keeps a few slots spare on top.
+
+    def __init__(self, baudrate=31, buffer_size=TX_BUFFER_SIZE, headroom=4, latency=0.05, tolerance=0.001):
+        self.baudrate = baudrate
+        self.period = symbol_period(baudrate) * (1.0 + tolerance)
+        self.capacity = buffer_size - 1 - headroom
+        self.latency = latency
+        self.reset(0.0)
+
+    def reset(self, now):
+        # Call when the modulator starts (or is idle and the buffer is known to be empty).
+        self.air_free = now
+        self.pending = deque()
+
+    def occupancy(self, now):
+        while self.pending and self.pending[0] <= now:
+            self.pending.popleft()
+        return len(self.pending)
+
+    def wait_time(self, now):
+        # Time until there is room in the buffer for another character.
+        if self.occupancy(now) < self.capacity:
+            return 0.0
+        return self.pending[0] - now
+
+    def push(self, c, now):
+        # Record a character written at time 'now'. Returns the time it will have been sent.
+        start = max(now + self.latency + self.period, self.air_free)
+        self.pending.append(start)
+        self.air_free = start + char_symbols(c) * self.period
+        return self.air_free
+
+
+class CreditWindow(object):
+    # Host side of PSKFLOW flow control. The firmware grants credit (CREDIT,<n> lines) for free
+    # slots in its ring buffer, and each character sent uses up one credit. As long as we never
+    # send without credit, nothing is dropped. Once all the credit has come back, the buffer
+    # is empty.
+    #
+    # grant() and close() are called from the serial reader thread, take() and wait_*() from
+    # the thread doing the sending.
+
+    def __init__(self, capacity=TX_BUFFER_SIZE-1):
+        self.capacity = capacity
+        self.available = 0
+        self.granted = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def grant(self, n):
+        with self.cond:
+            self.available += n
+            self.granted += n
+            self.cond.notify_all()
+
+    def close(self):
+        # Wake up anything waiting, i.e. when the stream or the connection has ended.
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def wait_for(self, condition, timeout):
+        deadline = time.time() + timeout
+        with self.cond:
+            while not condition() and not self.closed:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            return condition()
+
+    def wait_credit(self, timeout):
+        return self.wait_for(lambda: self.available > 0, timeout)
+
+    def wait_empty(self, timeout):
+        # True once every credit has been returned, i.e. the firmware buffer has drained.
+        return self.wait_for(lambda: self.available >= self.capacity, timeout)
+
+    def take(self, n, timeout):
+        # Use up to n credits, waiting for some if there are none. Returns how many were taken,
+        # which is 0 on a timeout or if the window was closed.
+        with self.cond:
+            if not self.wait_for(lambda: self.available > 0, timeout):
+                return 0
+            n = min(n, self.available)
+            self.available -= n
+            return n
@@ -16,7 +16,7 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this library.  If not, see <http://www.gnu.org/licenses/>.
 
-import serial,sys,time
+import serial,sys,time,varicode
 
 try:
     import RPi.GPIO as GPIO
@@ -106,6 +106,44 @@ class QITX(object):
             return False
             
             
+    def transmit_psk_stream(self,data,baudrate=31,preamble=3,postamble=1):
+        # Stream a string through the PSKTERM command at the channel's full character rate.
+        # Writes are paced against a model of the firmware ring buffer, which is kept
+        # nearly full without ever overflowing it (store_char() silently drops characters).
+        if '\x04' in data:
+            print "ERROR: EOT would terminate the PSKTERM stream."
+            return False
+        # Raises a ValueError now, before we key up, if a character has no varicode.
+        varicode.airtime(data,baudrate)
+        pacer = varicode.PSKPacer(baudrate)
+        
+        self.s.write('PSKTERM,'+str(baudrate)+'\n')
+        
+        # Phase reversals only, to allow the receiver to lock on
+        time.sleep(preamble)
+        pacer.reset(time.time())
+        
+        for c in data:
+            wait = pacer.wait_time(time.time())
+            if wait > 0:
+                time.sleep(wait)
+            self.s.write(c)
+            pacer.push(c,time.time())
+        
+        # Wait for the buffer to drain, then idle for a bit before ending the transmission.
+        time.sleep(max(0,pacer.air_free - time.time()) + postamble)
+        self.s.write('\x04')
+        
+        # Wait until we have either an OK or an ERROR in our serial RX buffer
+        while self.s.inWaiting()<4 :
+            time.sleep(0.5)
+        
+        data = self.s.readline()
+        if data.startswith('OK'):
+            return True
+        else:
+            return False
+            
     def transmit_rtty(self,baudrate=50,shift=170):
         self.s.write('RTTY,'+str(baudrate)+','+str(shift)+'\n')
         
@@ -23,8 +23,7 @@
 # 
 # You should have received a copy of the GNU Lesser General Public License
 # along with this library.  If not, see <http://www.gnu.org/licenses/>.
-import time,sys,random,string,ConfigParser,QITX,binascii
-from datetime import datetime,timedelta
+import time,sys,ConfigParser,QITX,scheduler,payload
 
 configfile = "./example.cfg"
 
@@ -49,15 +48,11 @@ except:
     sys.exit(1)
     
 
-#Generate our random string, using the current date and time as a seed.
-next_minute = datetime.utcnow() + timedelta(0,0,0,0,1,0)
-timeseed = next_minute.strftime("%d-%m-%Y %H:%M")
-print "Seed: " + timeseed
+#Generate our random string, using the next minute as a seed.
+txdata = payload.txdata(time.time() + 60)
+print "Seed: " + txdata["timeseed"]
 
-new_random = random.WichmannHill()
-new_random.seed(binascii.crc32(timeseed))
-txstring = ''.join(new_random.choice(string.ascii_uppercase + string.ascii_lowercase + string.digits) for x in range(32))
-txstring = "DE VK5QI $$$$$" + txstring     
+txstring = txdata["txstring"]
 
 print "TX Sequence: " + txstring
 
@@ -102,8 +97,8 @@ print "Ready to Transmit... waiting"
 tx.power_on(True)
 
 # Wait until 0 seconds (start of next minute)
-while(time.gmtime().tm_sec != 0):
-    pass
+slots = scheduler.SlotScheduler()
+start_time = slots.wait_for_next(60,"Ident")
 
 print "Transmitting: Ident"
 tx.transmit_ident()  # Approx 15 seconds
@@ -115,27 +110,12 @@ time.sleep(10);
 tx.set_parameter("CARRIER","OFF")
 
 # Wait until 30 seconds 
-while(time.gmtime().tm_sec != 30):
-    pass
+slots.wait_until(start_time + 30,"PSK")
     
 # Switch into PSK Terminal mode, and transmit our string.
 # This may take anywhere up to 1 minute to transmit.
 print "Transmitting: PSK"
-tx.s.write("PSKTERM,31\n")
-time.sleep(3)
-# Transmit our string character by character
-for x in txstring:
-        tx.s.write(x)
-        time.sleep(0.4)
-        
-time.sleep(3)
-
-tx.s.write("\x04")
-while tx.s.inWaiting()<4 :
-    time.sleep(0.5)
-        
-data = tx.s.readline()
-if data.startswith('OK'):
+if tx.transmit_psk_stream(txstring,31,3,3):
     print "... OK"
 else:
     print "... something broke?"
@@ -143,14 +123,15 @@ else:
 
 # Wait until 30 seconds, this will be in the next minute.
 print "Waiting for +1:30"
-while(time.gmtime().tm_sec != 30):
-    pass
+slots.wait_until(start_time + 90,"DominoEX8")
 
 print "Transmitting: DominoEX8"
 tx.transmit_domino()
 
 tx.power_on(False)
 print "Done."
+for label,utc,error in slots.log:
+    print "%s start error: %.1f ms" % (label,error*1000)
 
 # Close our connection to the transmitter
 tx.close()
\ No newline at end of file
@@ -76,17 +76,9 @@ tx.set_parameter("FREQSSB",conf['freqssb'])
 tx.set_parameter("POWER",conf['power'])
 
 # Switch into PSK Terminal mode, and transmit our string.
-tx.s.write("PSKTERM,31\n")
 tx.power_on(True)
-time.sleep(3)
-# Transmit our string character by character
-for x in txstring:
-        tx.s.write(x)
-        print x
-        time.sleep(0.4)
-time.sleep(3)
+tx.transmit_psk_stream(txstring,31,3,3)
 tx.power_on(False)
-tx.s.write("\x04")
 
 # Close our connection to the transmitter
 tx.close()
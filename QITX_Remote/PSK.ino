@@ -386,6 +386,51 @@ int pskTerminal(String baud){
 	return 0;
 }
 
+// PSKFLOW Command, with baud rate
+// As PSKTERM, but with credit-based flow control, so the host never overflows the ring buffer.
+// Free slots in the buffer are granted to the host as CREDIT,<n> lines, and the host sends one
+// character per credit. Credit is sent in batches, or straight away if the buffer has run dry.
+// An EOT ends the stream, after the buffer has been transmitted.
+#define CREDIT_BATCH	8
+
+int pskFlowTerminal(String baud){
+	unsigned int baudrate = 0;
+	char* endptr;
+	
+	// Slots granted to the host which it hasn't filled yet.
+	unsigned int promised = 0;
+	unsigned int free_slots = 0;
+	
+	baud.toCharArray(tempBuffer,10);
+	baudrate = (unsigned int)strtoul(tempBuffer,&endptr,10);
+	if(*endptr != 0) return -1;
+	if(baudrate>500) return -1;
+	
+	bpsk_start(baudrate);
+	digitalWrite(LED_PIN, HIGH);
+	
+	while(1){
+	    if(Serial.available()>0){
+		    char c = Serial.read();
+		    if(c==4) break;
+		    if(promised>0) promised--;
+            store_char(c,&data_tx_buffer);
+        }
+        
+        free_slots = TX_BUFFER_SIZE - 1 - data_waiting(&data_tx_buffer);
+        if(free_slots > promised){
+            if((free_slots - promised) >= CREDIT_BATCH || data_waiting(&data_tx_buffer) == 0){
+                Serial.print("CREDIT,"); Serial.println(free_slots - promised);
+                promised = free_slots;
+            }
+        }
+	}
+	while(data_waiting(&data_tx_buffer)>0);
+	bpsk_stop();
+	digitalWrite(LED_PIN, LOW);
+	return 0;
+}
+
 
 
 
@@ -46,6 +46,8 @@
     					  Note: This will only work if a relay to switch power is hooked up to pin <UNKNOWN>.
     INHIBIT,<ON/OFF>    - Reads or sets the state of the INHIBIT variable.
                         - This variable can be set by pressing a button wired between pin 0 and GND.
+    VERSION             - Reads the firmware version (FIRMWARE_VERSION). Firmware from before this command
+                          answers ERROR, so hosts can check for newer commands without side effects.
     					
     Message Control:
     
@@ -59,6 +61,10 @@
     CARRIER,<ON/OFF>	- Transmit a carrier.
     PSK					- Send using BPSK31. Will use phase shaping code.
     PSK,<31/63/125/250>	- Send using Phase Shift Keying, with the specified symbol rate.
+    PSKTERM,<31/63/125/250> - PSK terminal. Characters received are transmitted until an EOT (0x04) is received.
+    PSKFLOW,<31/63/125/250> - As PSKTERM, with flow control. Free transmit buffer slots are granted to the host
+    						  as CREDIT,<n> lines, and the host must only send one character per credit.
+    						  After an EOT the buffer is emptied before the transmitter is switched off.
     RTTY,<baudrate>,<shift> - Send using RTTY, with a specified symbol rate, 8 bits/char, and shift (Hz)
     
     SELCALL,<source>,<dest> - Send a CCIR 493-4 call request, from <source> to <dest> ID. Both IDs must be 4 digit
@@ -127,6 +133,10 @@ ring_buffer data_tx_buffer = { { 0 }, 0, 0};
 
 
 #define TX_TIMEOUT	600000 // Timeout in milliseconds (set to 10 minutes)
+
+// Reported by the VERSION command.
+// 2: PSKFLOW and VERSION added. (Earlier firmware has neither, and answers ERROR to VERSION.)
+#define FIRMWARE_VERSION	2
 int rf_on = 0;
 unsigned long tx_timer = 0;
 
@@ -287,6 +297,9 @@ int parseCommand(String input){
 		}else if(input.startsWith("INHIBIT")){
 		    read_inhibit();
 		    return 0;
+		}else if(input.startsWith("VERSION")){
+			Serial.print("VERSION,"); Serial.println(FIRMWARE_VERSION);
+			return 0;
 		}else{
 			// No other commands are valid without parameters. Error
 			return 1;
@@ -313,6 +326,8 @@ int parseCommand(String input){
 			return parseCarrier(param1);
 		}else if(input.startsWith("PSKTERM")){
 			return pskTerminal(param1);
+		}else if(input.startsWith("PSKFLOW")){
+			return pskFlowTerminal(param1);
 		}else if(input.startsWith("PSK")){
 			return parsePSK(param1);
 		}else if(input.startsWith("INHIBIT")){
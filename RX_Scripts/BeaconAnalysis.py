@@ -2,10 +2,13 @@
 #
 #    FLDIGI Beacon receiver - Data Analysis
 #
-#   Needs python-Levenshtein from https://github.com/miohtama/python-Levenshtein
-#
 #   This program assumes it has been started on the minute the beacon starts transmitting.
 #   Is listens for PSK31 at +30 seconds, then DominoEX8 at +90 seconds.
+#
+#   Signal quality statistics (time to lock, percentiles, fades) are worked out with numpy,
+#   for a whole rx_archive.py archive at once if given an archive folder:
+#   Usage: python BeaconAnalysis.py result.json
+#          python BeaconAnalysis.py archive_folder [start YYYY-MM-DD] [end YYYY-MM-DD]
 #    
 #    Copyright (C) 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
 # 
@@ -24,14 +27,129 @@
 #
 #
 
-import socket,sys,time,random,string,binascii,json,Levenshtein
+import socket,sys,time,random,string,binascii,json,calendar,os
+import scoring
 from datetime import datetime,timedelta
 
+try:
+    import numpy as np
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
+# Quality above which the modem counts as locked on. The same as beacon_rx.py's squelch threshold.
+squelch_threshold = 4.0
+
+# Percentiles given by quality_stats().
+quality_percentiles = [10,50,90]
+
+
+def quality_stats(records, times, values, squelch=squelch_threshold):
+    # Signal quality statistics for many quality traces at once. The traces are given as flat
+    # arrays with one element per sample, as read from an rx_archive.py archive: a record id
+    # (e.g. the minute), sample time and quality. Samples of a record must be together and in time
+    # order. Returns a dictionary of arrays, one element per record:
+    #   record          The record id.
+    #   samples         Number of quality samples.
+    #   max, p10...     Maximum and percentiles of the quality.
+    #   first_lock      Seconds from the first sample until the quality first went above the
+    #                   squelch level (NaN if it never did).
+    #   locked_fraction Fraction of samples above the squelch level.
+    #   mean_locked     Mean quality of the samples above the squelch level.
+    #   fade_count      Number of times the quality dropped to or below the squelch level, after
+    #                   first locking on.
+    #   fade_time       Total time spent faded, and longest_fade the longest single fade (s).
+    if not numpy_enabled:
+        raise ImportError("NumPy is needed for signal quality statistics")
+    records = np.asarray(records)
+    times = np.asarray(times,dtype=np.float64)
+    values = np.asarray(values,dtype=np.float64)
+    n = len(values)
+    stats = {}
+    if n == 0:
+        for key in ['record','samples','max','first_lock','locked_fraction','mean_locked','fade_count','fade_time','longest_fade'] + ['p%d' % p for p in quality_percentiles]:
+            stats[key] = np.zeros(0)
+        return stats
+
+    # Where each record's samples start, and how many it has.
+    starts = np.concatenate([[0],np.flatnonzero(records[1:] != records[:-1]) + 1])
+    counts = np.diff(np.concatenate([starts,[n]]))
+    group = np.repeat(np.arange(len(starts)),counts)
+    stats['record'] = records[starts]
+    stats['samples'] = counts
+    stats['max'] = np.maximum.reduceat(values,starts)
+
+    # Percentiles, with linear interpolation as numpy.percentile(). Each record's values go in a row
+    # of a matrix (padded out with inf) which is sorted along the rows, as sorting many short rows is
+    # far quicker than sorting the lot by record and value.
+    ordered = np.full((len(starts),counts.max()),np.inf)
+    ordered[group,np.arange(n) - starts[group]] = values
+    ordered.sort(axis=1)
+    rows = np.arange(len(starts))
+    for p in quality_percentiles:
+        position = (counts - 1)*p/100.0
+        below = np.floor(position).astype(np.int64)
+        above = np.minimum(below + 1,counts - 1)
+        fraction = position - below
+        stats['p%d' % p] = ordered[rows,below]*(1 - fraction) + ordered[rows,above]*fraction
+
+    locked = values > squelch
+    locked_count = np.add.reduceat(locked.astype(np.int64),starts)
+    stats['locked_fraction'] = locked_count/counts.astype(np.float64)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        stats['mean_locked'] = np.add.reduceat(np.where(locked,values,0),starts)/locked_count
+
+    # First locked sample of each record (n if none), and whether each sample comes after it.
+    first = np.minimum.reduceat(np.where(locked,np.arange(n),n),starts)
+    has_lock = first < n
+    stats['first_lock'] = np.where(has_lock,times[np.minimum(first,n-1)] - times[starts],np.nan)
+    after_lock = np.arange(n) >= first[group]
+
+    # A fade starts at an unlocked sample after a locked one, in the same record. Each faded sample
+    # lasts until the next sample of its record.
+    faded = after_lock & ~locked
+    fade_start = np.zeros(n,dtype=bool)
+    fade_start[1:] = faded[1:] & locked[:-1] & (group[1:] == group[:-1])
+    stats['fade_count'] = np.add.reduceat(fade_start.astype(np.int64),starts)
+    duration = np.zeros(n)
+    same = group[1:] == group[:-1]
+    duration[:-1] = np.where(same,times[1:] - times[:-1],0)
+    duration = np.where(faded,duration,0)
+    stats['fade_time'] = np.add.reduceat(duration,starts)
+
+    # Length of every fade, put at the sample it starts on, then the longest in each record.
+    fade_number = np.cumsum(fade_start) - 1
+    fade_lengths = np.bincount(fade_number[faded],weights=duration[faded],minlength=int(fade_start.sum()))
+    longest = np.zeros(n)
+    longest[fade_start] = fade_lengths
+    stats['longest_fade'] = np.maximum.reduceat(longest,starts)
+    return stats
+
+def archive_quality_stats(archive_path, start=0, end=2**62, mode="psk", squelch=squelch_threshold):
+    # quality_stats() for one trace ("psk", "domex"...) of every result in an rx_archive.py
+    # archive, from start up to end (seconds since the epoch). Records are the minutes.
+    import rx_archive
+    data = rx_archive.BeaconArchive(archive_path).columns(start,end,mode + "_qual")
+    # Results are normally appended in time order, but make sure.
+    minute, qtime, qvalue = data['minute'], data['qtime'], data['qvalue']
+    if np.any((minute[1:] < minute[:-1]) | ((minute[1:] == minute[:-1]) & (qtime[1:] < qtime[:-1]))):
+        order = np.lexsort((qtime,minute))
+        minute, qtime, qvalue = minute[order], qtime[order], qvalue[order]
+    return quality_stats(minute,qtime,qvalue,squelch)
+
+
 class BeaconAnalysis:
 
     threshold = 0.5
 
-    def __init__(self, jsonfile):
+    def __init__(self, jsonfile=None, data=None):
+        # Either a JSON file written by beacon_rx.py, or a result read from an rx_archive.py archive.
+        # Jaro distances are worked out the first time they're needed, then kept.
+        self.psk_jaro = None
+        self.domex_jaro = None
+        if data is not None:
+            self.data = data
+            return
         f = open(jsonfile)
         fd = f.read()
         self.data = json.loads(fd)
@@ -40,44 +158,46 @@ class BeaconAnalysis:
     def prettyprint(self):
         print "Timestamp:     " + self.data["timeseed"]
         print "Expected Data: " + self.data["expected_data"]
-        print "PSK31 Data:    " + self.data["psk_data"]
-        print "PSK31 Jaro Dist: " + str(Levenshtein.jaro(self.data["expected_data"],self.data["psk_data"]))
-        print "DOMEX8 Data:   " + self.data["domex_data"]
-        print "DOMEX Jaro Dist: " + str(Levenshtein.jaro(self.data["expected_data"],self.data["domex_data"]))
+        print "PSK31 Data:    " + self.data.get("psk_data","")
+        print "PSK31 Jaro Dist: " + str(self.get_psk_jaro())
+        print "DOMEX8 Data:   " + self.data.get("domex_data","")
+        print "DOMEX Jaro Dist: " + str(self.get_domex_jaro())
         
     def get_max_quality(self, quality_set):
-        quality_data = []
-        for x in range(0,len(quality_set)):
-            quality_data.append(quality_set[x][1])
-        
-        return max(quality_data)
+        return max(q[1] for q in quality_set)
+
+    def get_quality_stats(self, mode="psk", squelch=squelch_threshold):
+        # quality_stats() for one of this result's quality traces, as plain numbers.
+        if not numpy_enabled:
+            raise ImportError("NumPy is needed for signal quality statistics")
+        quality_set = np.array(self.data[mode + "_qual"],dtype=np.float64).reshape(-1,2)
+        stats = quality_stats(np.zeros(len(quality_set)),quality_set[:,0],quality_set[:,1],squelch)
+        return dict((key,float(stats[key][0]) if len(stats[key]) > 0 else None) for key in stats if key != 'record')
         
     def get_psk_jaro(self):
-        return Levenshtein.jaro(self.data["expected_data"],self.data["psk_data"])
+        if self.psk_jaro is None:
+            self.psk_jaro = scoring.jaro(self.data["expected_data"],self.data.get("psk_data",""))
+        return self.psk_jaro
     
     def get_domex_jaro(self):
-        return Levenshtein.jaro(self.data["expected_data"],self.data["domex_data"])
+        if self.domex_jaro is None:
+            self.domex_jaro = scoring.jaro(self.data["expected_data"],self.data.get("domex_data",""))
+        return self.domex_jaro
     
     def get_timestamp(self):
         return self.data["timeseed"]
     
     def psk_valid(self):
-        return Levenshtein.jaro(self.data["expected_data"],self.data["psk_data"]) > self.threshold
+        return self.get_psk_jaro() > self.threshold
         
     def domex_valid(self):
-        return Levenshtein.jaro(self.data["expected_data"],self.data["domex_data"]) > self.threshold
+        return self.get_domex_jaro() > self.threshold
     
     def plot_psk(self):
         from pylab import *
         
-        quality_set = self.data["psk_qual"]
-        
-        time_data = []
-        quality_data = []
-        for x in range(0,len(quality_set)):
-            quality_data.append(quality_set[x][1])
-            time_data.append(quality_set[x][0] - quality_set[0][0])
-        plot(time_data, quality_data)
+        quality_set = array(self.data["psk_qual"],dtype=float).reshape(-1,2)
+        plot(quality_set[:,0] - quality_set[0,0], quality_set[:,1])
         xlabel("Time (s)")
         ylabel("Signal Quality (0-100)")
         title("PSK Signal Quality for " + self.data["timeseed"])
@@ -86,14 +206,8 @@ class BeaconAnalysis:
     def plot_domex(self):
         from pylab import *
         
-        quality_set = self.data["domex_qual"]
-        
-        time_data = []
-        quality_data = []
-        for x in range(0,len(quality_set)):
-            quality_data.append(quality_set[x][1])
-            time_data.append(quality_set[x][0] - quality_set[0][0])
-        plot(time_data, quality_data)
+        quality_set = array(self.data["domex_qual"],dtype=float).reshape(-1,2)
+        plot(quality_set[:,0] - quality_set[0,0], quality_set[:,1])
         xlabel("Time (s)")
         ylabel("Signal Quality (0-100)")
         title("DOMEX8 Signal Quality for " + self.data["timeseed"])
@@ -101,8 +215,37 @@ class BeaconAnalysis:
         
         
 
+def parse_date(date):
+    # YYYY-MM-DD (UTC) to seconds since the epoch.
+    return calendar.timegm(time.strptime(date,"%Y-%m-%d"))
+
+def print_archive_stats(archive_path, start, end):
+    # Quality statistics over every result in an archive, for each mode.
+    for mode in ["psk","domex"]:
+        stats = archive_quality_stats(archive_path,start,end,mode)
+        results = len(stats['record'])
+        print "%s: %d results" % (mode.upper(),results)
+        if results == 0:
+            continue
+        locked = ~np.isnan(stats['first_lock'])
+        print "  Locked on:        %d (%.1f%%)" % (locked.sum(),100.0*locked.sum()/results)
+        if locked.any():
+            print "  Time to lock:     median %.1fs, 90th percentile %.1fs" % (np.median(stats['first_lock'][locked]),np.percentile(stats['first_lock'][locked],90))
+            print "  Locked quality:   mean %.1f" % np.mean(stats['mean_locked'][locked])
+            print "  Fades per result: mean %.2f, max %d" % (np.mean(stats['fade_count'][locked]),np.max(stats['fade_count'][locked]))
+            print "  Fade time:        mean %.1fs, longest fade %.1fs" % (np.mean(stats['fade_time'][locked]),np.max(stats['longest_fade'][locked]))
+        print "  Quality:          median of p10 %.1f, p50 %.1f, p90 %.1f, max %.1f" % tuple(np.median(stats[k]) for k in ['p10','p50','p90','max'])
+
 def main():
-    if len(sys.argv) >= 2:
+    if len(sys.argv) >= 2 and os.path.isdir(sys.argv[1]):
+        # An rx_archive.py archive, optionally with a start and end date.
+        if not numpy_enabled:
+            print "Archive statistics need numpy."
+            return
+        start = parse_date(sys.argv[2]) if len(sys.argv) >= 3 else 0
+        end = parse_date(sys.argv[3]) + 86400 if len(sys.argv) >= 4 else 2**62
+        print_archive_stats(sys.argv[1],start,end)
+    elif len(sys.argv) >= 2:
         a = BeaconAnalysis(sys.argv[1])
         a.prettyprint()
         if(a.psk_valid()):
@@ -3,7 +3,9 @@
 #    FLDIGI Beacon receiver
 #
 #   This program assumes it has been started on the minute the beacon starts transmitting.
-#   Is listens for PSK31 at +30 seconds, then DominoEX8 at +90 seconds.
+#   It follows the beacon's schedule file (see rx_schedule.py), receiving each entry in turn.
+#
+#   Usage: python beacon_rx.py [schedule.json]
 #    
 #    Copyright (C) 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
 # 
@@ -22,159 +24,99 @@
 #
 #
 
-from xmlrpclib import ServerProxy, Error
-import socket,sys,time,random,string,binascii,json,os
-from datetime import datetime,timedelta
+import sys,time,string,json,os,payload,rx_engine,rx_archive,rx_schedule,scheduler
 
 # Assume fldigi is running on the local machine.
 xmlrpc_addr = "http://localhost:7362"
 flarq_host = "localhost"
 flarq_port = 7322
 
-# Centre frequencies for the various modem tones. These may vary with transmitter temperature,
-# but should be a good enough start point for fldigi to find it.
-psk_center = 1007
-domino_center = 1140
-squelch_threshold = 4.0
+# The schedule the beacon is transmitting, the same file given to beacon_json.py. Can be
+# given as the first argument instead. Modem centre frequencies, squelch levels and capture
+# window timing are set in rx_schedule.py.
+schedule_file = "../Beacon_Scripts/schedules/standard.json"
+squelch_threshold = rx_schedule.squelch_threshold
 
-# Can set this to False for debugging purposes.
+# Can set this to False for debugging purposes (the schedule starts now, rather than on the minute).
 delay = True
 
-#Generate our expected random string
-next_minute = datetime.utcnow()
-timeseed = next_minute.strftime("%d-%m-%Y %H:%M")
-print(timeseed)
-
-new_random = random.WichmannHill()
-new_random.seed(binascii.crc32(timeseed))
-txstring = ''.join(new_random.choice(string.ascii_uppercase + string.ascii_lowercase + string.digits) for x in range(32))
-txstring = "DE VK5QI $$$$$" + txstring  
-print "Expecting: " + txstring
-
-# Open a connection to the fldigi XMLRPC server (or die trying)
-fldigi = ServerProxy(xmlrpc_addr)
-
-# Set Squelch level very high, so we limit the data getting through
-fldigi.main.set_squelch_level(90.0)
-
-# Open a connetion to the FLARQ socket
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-s.settimeout(1.0)
-s.connect((flarq_host,flarq_port))
-
+# Table of precomputed payloads (built with payload.py). If None, or if the table doesn't
+# cover this minute, the expected payload is generated instead.
+payload_table = None
 
-# PSK Setup
-fldigi.modem.set_by_name("BPSK31")
+# Results are added to this archive (see rx_archive.py). Set write_json to True to also write
+# one JSON file per minute into per-day folders, as older versions did.
+archive_path = "./archive"
+write_json = False
 
-print "Setup, waiting for +30"
+if len(sys.argv) >= 2:
+    schedule_file = sys.argv[1]
+schedule = rx_schedule.load_schedule(schedule_file)
+if schedule is None:
+    sys.exit(1)
 
-# Wait until +30 seconds 
+# The schedule's times are relative to the start of the minute the beacon starts transmitting on,
+# which is this minute.
 if delay:
-    while(time.gmtime().tm_sec != 30):
-        time.sleep(0.1)
-
-# Set Squelch level to the normal level
-fldigi.main.set_squelch_level(squelch_threshold)
-# Finish modem setup, this should lock onto the PSK signal within the 3 second preamble.
-fldigi.modem.set_carrier(psk_center)
-
-lock = False
-pskdata = ""
-
-psk_qual = []
-
-print "Attempting to receive BPSK31..."
-# Try and receive until +60 seconds
-while(time.gmtime().tm_sec != 0):
-    time.sleep(0.1)
-    current_quality = fldigi.modem.get_quality()
-    psk_qual.append([time.time(), current_quality])
-    if(current_quality>squelch_threshold or lock):
-        lock = True
-        temp = ""
-        try:
-            temp = s.recv(8)
-        except:
-            pass
-#        sys.stdout.write(temp)
-#        sys.stdout.flush()
-        pskdata = pskdata + temp
-
-print ""
-
-if(len(pskdata) == 0):
-    print "No PSK data received."
+    cycle_start = payload.minute(time.time())
 else:
-    print "Got: " + pskdata
-
-pskdata = ''.join(filter(lambda x:x in string.printable, pskdata))
-
-# Attempt to receive DominoEX8
-fldigi.modem.set_by_name("DOMEX8")
+    cycle_start = time.time()
+
+#Work out our expected random string, for the current minute
+table = None
+if payload_table is not None:
+    table = payload.PayloadTable(payload_table)
+txdata = payload.txdata(cycle_start,table)
+timeseed = txdata["timeseed"]
+print(timeseed)
 
-# Set Squelch level very high, so we limit the data getting through
-fldigi.main.set_squelch_level(90.0)
+txstring = txdata["txstring"]
+print "Expecting: " + txstring
 
-# Wait for +90 (which will be 30 seconds into the minute)
-if delay:
-    while(time.gmtime().tm_sec != 28):
-        time.sleep(0.1)
-
-# Set Squelch level to the normal level
-fldigi.main.set_squelch_level(squelch_threshold)
-# Finish modem setup, this should lock onto the DOMEX8 signal within the 3 second preamble.
-fldigi.modem.set_carrier(domino_center)
-
-domex_data = ""
-domex_qual = []
-
-print "Attempting to receive DOMEX8..."
-# Try and receive until +60 seconds
-while(time.gmtime().tm_sec != 0):
-    time.sleep(0.1)
-    current_quality = fldigi.modem.get_quality()
-    domex_qual.append([time.time(), current_quality])
-    if(current_quality>squelch_threshold):
-        temp = ""
-        try:
-            temp = s.recv(8)
-        except:
-            pass
-#        sys.stdout.write(temp)
-#        sys.stdout.flush()
-        domex_data = domex_data + temp
-
-print ""
-
-domex_data = ''.join(filter(lambda x:x in string.printable, domex_data))
-
-if(len(domex_data) == 0):
-    print "No DOMEX8 data received."
-else:
-    print "Got: " + domex_data
-    
-s.close()
+# Work out when to switch modem, open the squelch and capture, for every entry in the schedule.
+windows = rx_schedule.build_timeline(schedule,txstring)
+rx_schedule.print_timeline(windows)
 
+# Connect to fldigi's XMLRPC server and the FLARQ socket (or die trying). From here on, the
+# modem quality is sampled and the decoded text read in the background.
+engine = rx_engine.ReceiveEngine(xmlrpc_addr,flarq_host,flarq_port)
+engine.start()
 
-# Write received data out to a file.
-dirname = "./" + timeseed[:-6]
+# Follow the timeline. Each step waits for its deadline, so back-to-back entries are each set up
+# as soon as the one before has finished.
+slots = scheduler.SlotScheduler()
+received = rx_schedule.run_timeline(engine,windows,cycle_start,slots,squelch_threshold)
 
-if not os.path.exists(dirname):
-    os.makedirs(dirname)
+engine.stop()
+print "Receive stats: " + json.dumps(engine.stats())
+print "Timing errors: " + ", ".join("%s %.1f ms" % (label,error*1000) for (label,utc,error) in slots.log)
 
-filename = dirname + "/" + timeseed + ".json"
 
 output = {}
 output["timeseed"] = timeseed
 output["expected_data"] = txstring
-output["psk_data"] = pskdata
-output["domex_data"] = domex_data
-output["psk_qual"] = psk_qual
-output["domex_qual"] = domex_qual
+output["schedule"] = []
+for window in windows:
+    result = received.get(window['name'],{'text': "", 'quality': [], 'lock_time': None})
+    output[window['name'] + "_data"] = result['text']
+    output[window['name'] + "_qual"] = result['quality']
+    output["schedule"].append({'name': window['name'], 'mode': window['mode'], 'start': window['start'],
+        'close': window['close'], 'lock_time': result['lock_time']})
+
+# Add the received data to the archive.
+archive = rx_archive.BeaconArchive(archive_path)
+archive.append(output)
+archive.close()
 
-target = open(filename,'w')
-target.write(json.dumps(output))
-target.close()
+# Write received data out to a file.
+if write_json:
+    dirname = "./" + timeseed[:-6]
 
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
 
+    filename = dirname + "/" + timeseed + ".json"
 
+    target = open(filename,'w')
+    target.write(json.dumps(output))
+    target.close()
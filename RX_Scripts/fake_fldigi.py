@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+#
+#    FLDIGI Beacon receiver - fldigi stand-in
+#
+#   Serves the parts of fldigi that beacon_rx.py uses, so the receive code can be run and
+#   benchmarked without fldigi or a radio:
+#    - An XML-RPC server with main.set_squelch_level, modem.set_by_name, modem.set_carrier,
+#      modem.get_quality and system.multicall, which keeps connections alive (HTTP/1.1).
+#      get_quality() can be given a random delay, as fldigi's can be slow to answer, and every
+#      request a fixed one, for the time fldigi takes to get around to it.
+#    - A text socket (as FLARQ's) which sends the expected beacon string a character at a time,
+#      at a set rate, while the signal is 'on'. The time each character was sent is kept, so
+#      receive latency can be measured.
+#
+#   Usage: python fake_fldigi.py [--rate 30] [--quality-delay 0.05] [--request-delay 0.01]
+#   Listens on the same ports as fldigi (7362 and 7322) by default.
+#
+#    Copyright (C) 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+#      GNU General Public License for more details.
+#
+#      For a full copy of the GNU General Public License,
+#      see <http://www.gnu.org/licenses/>.
+#
+#
+
+import argparse,random,socket,threading,time
+import payload
+
+try:
+    from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+    from socketserver import ThreadingMixIn
+
+xmlrpc_port = 7362
+text_port = 7322
+
+# get_quality() while there is / isn't a signal.
+signal_quality = 60.0
+noise_quality = 1.0
+
+
+class RequestHandler(SimpleXMLRPCRequestHandler):
+    # Keep connections open between requests, and count them.
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        SimpleXMLRPCRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_POST(self):
+        if self.server.request_delay > 0:
+            time.sleep(self.server.request_delay)
+        SimpleXMLRPCRequestHandler.do_POST(self)
+
+
+class ThreadingXMLRPCServer(ThreadingMixIn,SimpleXMLRPCServer):
+    daemon_threads = True
+    connections = 0
+    request_delay = 0.0
+
+
+class FakeFldigi(object):
+
+    def __init__(self,host="localhost",xmlrpc_port=xmlrpc_port,text_port=text_port,rate=30.0,quality_delay=0.0,request_delay=0.0):
+        # rate: characters/second sent on the text socket.
+        # quality_delay: get_quality() takes a random time up to this long to answer.
+        # request_delay: every request waits this long before being handled.
+        self.rate = rate
+        self.quality_delay = quality_delay
+        self.squelch = 0.0
+        self.mode = "BPSK31"
+        self.carrier = 1000
+        self.signal = False
+        self.calls = 0
+        # (time, character) for every character sent.
+        self.sent = []
+        self.running = True
+        self.client = None
+
+        self.server = ThreadingXMLRPCServer((host,xmlrpc_port),requestHandler=RequestHandler,logRequests=False,allow_none=True)
+        self.server.request_delay = request_delay
+        self.server.register_multicall_functions()
+        self.server.register_function(self.set_squelch_level,'main.set_squelch_level')
+        self.server.register_function(self.set_by_name,'modem.set_by_name')
+        self.server.register_function(self.set_carrier,'modem.set_carrier')
+        self.server.register_function(self.get_quality,'modem.get_quality')
+        self.listener = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+        self.listener.bind((host,text_port))
+        self.listener.listen(1)
+
+        self.threads = [threading.Thread(target=self.server.serve_forever),threading.Thread(target=self.text_loop)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def set_squelch_level(self,level):
+        self.squelch = level
+        return None
+
+    def set_by_name(self,mode):
+        self.mode = mode
+        return self.mode
+
+    def set_carrier(self,carrier):
+        self.carrier = carrier
+        return self.carrier
+
+    def get_quality(self):
+        self.calls += 1
+        if self.quality_delay > 0:
+            time.sleep(random.uniform(0,self.quality_delay))
+        if self.signal:
+            return signal_quality + random.uniform(-5,5)
+        return noise_quality
+
+    def text_loop(self):
+        # Send the beacon string, over and over, whenever the signal is on and the squelch open.
+        self.client = self.listener.accept()[0]
+        message = payload.txdata(time.time())['txstring']
+        position = 0
+        next_time = time.time()
+        while self.running:
+            now = time.time()
+            if not self.signal or signal_quality < self.squelch:
+                next_time = now + 0.01
+                time.sleep(0.01)
+                continue
+            if now < next_time:
+                time.sleep(next_time - now)
+                continue
+            c = message[position % len(message)]
+            self.sent.append((time.time(),c))
+            try:
+                self.client.sendall(c.encode('latin-1'))
+            except socket.error:
+                break
+            position += 1
+            next_time += 1.0/self.rate
+
+    def close(self):
+        self.running = False
+        self.server.shutdown()
+        self.server.server_close()
+        if self.client is not None:
+            self.client.close()
+        self.listener.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in for fldigi's XML-RPC and text interfaces")
+    parser.add_argument("--rate",type=float,default=30.0,help="Characters/second of decoded text.")
+    parser.add_argument("--quality-delay",type=float,default=0.05,help="Maximum get_quality() delay (s).")
+    parser.add_argument("--request-delay",type=float,default=0.0,help="Delay before handling each request (s).")
+    args = parser.parse_args()
+
+    fldigi = FakeFldigi(rate=args.rate,quality_delay=args.quality_delay,request_delay=args.request_delay)
+    fldigi.signal = True
+    print("fldigi stand-in running on ports %d and %d." % (xmlrpc_port,text_port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        fldigi.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+#
+#    FLDIGI Beacon receiver - fldigi XML-RPC client
+#
+#   A wrapper around fldigi's XML-RPC interface for the receive scripts, which:
+#    - Holds one HTTP connection open across calls (reconnecting if fldigi closes it), with
+#      Nagle's algorithm off, as xmlrpclib writes the headers and body of a request separately
+#      and would otherwise wait on a delayed ACK for every call.
+#    - Sends retune sequences (mode, carrier, squelch) as a single system.multicall request,
+#      falling back to separate calls if the server doesn't support it.
+#    - Times every call, so slow responses from fldigi show up.
+#
+#   A client (like a ServerProxy) must only be used from one thread at a time. Give each
+#   thread its own.
+#
+#    Copyright (C) 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+#      GNU General Public License for more details.
+#
+#      For a full copy of the GNU General Public License,
+#      see <http://www.gnu.org/licenses/>.
+#
+#
+
+import collections,math,socket,time
+
+try:
+    from xmlrpclib import ServerProxy, Transport, MultiCall, Fault, Error
+    from httplib import HTTPConnection
+except ImportError:
+    from xmlrpc.client import ServerProxy, Transport, MultiCall, Fault, Error
+    from http.client import HTTPConnection
+
+default_xmlrpc_addr = "http://localhost:7362"
+
+# Call times kept per method.
+latency_log_length = 1000
+
+
+class NoDelayHTTPConnection(HTTPConnection):
+
+    def __init__(self,host,transport=None,**kwargs):
+        HTTPConnection.__init__(self,host,**kwargs)
+        self.transport = transport
+
+    def connect(self):
+        HTTPConnection.connect(self)
+        self.sock.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+        if self.transport is not None:
+            self.transport.connections += 1
+
+
+class KeepAliveTransport(Transport):
+    # Keeps a single connection for all calls. If the server closes it after a response, the
+    # connection opens itself again on the next request.
+
+    def __init__(self):
+        Transport.__init__(self)
+        self._connection = (None,None)
+        self.connections = 0
+
+    def make_connection(self,host):
+        if self._connection[1] is not None and host == self._connection[0]:
+            return self._connection[1]
+        chost, self._extra_headers, x509 = self.get_host_info(host)
+        self._connection = host, NoDelayHTTPConnection(chost,transport=self)
+        return self._connection[1]
+
+
+def method_not_found(fault,method):
+    # Whether a Fault says the method doesn't exist. xmlrpc-c (which fldigi uses) has code -506,
+    # the XML-RPC interop spec -32601, and Python's SimpleXMLRPCServer just says so in the message.
+    return fault.faultCode in (-506,-32601) or (method in fault.faultString and
+        ('not defined' in fault.faultString or 'not supported' in fault.faultString))
+
+
+def summarise(samples):
+    # Distribution summary of a list of times, in milliseconds.
+    if len(samples) == 0:
+        return None
+    samples = sorted(x*1000.0 for x in samples)
+    def percentile(p):
+        return samples[min(len(samples)-1,int(math.ceil(p/100.0*len(samples)))-1)]
+    return {'count': len(samples), 'min': samples[0], 'mean': sum(samples)/len(samples),
+        'p50': percentile(50), 'p90': percentile(90), 'p99': percentile(99), 'max': samples[-1]}
+
+
+class FldigiClient(object):
+
+    def __init__(self,xmlrpc_addr=default_xmlrpc_addr):
+        self.xmlrpc_addr = xmlrpc_addr
+        self.transport = KeepAliveTransport()
+        self.proxy = ServerProxy(xmlrpc_addr,transport=self.transport,allow_none=True)
+        self.multicall_supported = True
+        # method name -> recent call times, in seconds.
+        self.latency = {}
+
+    def record(self,method,started):
+        if method not in self.latency:
+            self.latency[method] = collections.deque(maxlen=latency_log_length)
+        self.latency[method].append(time.time() - started)
+
+    def call(self,method,*args):
+        # Call an XML-RPC method by its full name, e.g. call("modem.set_carrier",1000).
+        started = time.time()
+        result = getattr(self.proxy,method)(*args)
+        self.record(method,started)
+        return result
+
+    def multicall(self,calls):
+        # Run a list of (method, args) in one request. Returns their results, in order.
+        if len(calls) == 0:
+            return []
+        if self.multicall_supported:
+            batch = MultiCall(self.proxy)
+            for (method,args) in calls:
+                getattr(batch,method)(*args)
+            started = time.time()
+            try:
+                results = batch()
+            except Fault as e:
+                if not method_not_found(e,"system.multicall"):
+                    raise
+                # No system.multicall on this server. Don't try again.
+                print("fldigi doesn't support system.multicall, sending calls separately.")
+                self.multicall_supported = False
+            else:
+                self.record("system.multicall",started)
+                # A Fault from one of the calls is raised here. fldigi has already carried out
+                # the calls, so it goes to the caller rather than them being sent again.
+                return list(results)
+        return [self.call(method,*args) for (method,args) in calls]
+
+    def get_quality(self):
+        return float(self.call("modem.get_quality"))
+
+    def set_squelch_level(self,level):
+        return self.call("main.set_squelch_level",float(level))
+
+    def set_mode(self,mode):
+        return self.call("modem.set_by_name",mode)
+
+    def set_carrier(self,carrier):
+        return self.call("modem.set_carrier",int(carrier))
+
+    def retune(self,mode=None,carrier=None,squelch=None):
+        # Change any of the modem, carrier frequency and squelch level, in a single request.
+        # The mode is set first, as changing modem can reset the carrier.
+        calls = []
+        if mode is not None:
+            calls.append(("modem.set_by_name",(mode,)))
+        if carrier is not None:
+            calls.append(("modem.set_carrier",(int(carrier),)))
+        if squelch is not None:
+            calls.append(("main.set_squelch_level",(float(squelch),)))
+        started = time.time()
+        results = self.multicall(calls)
+        self.record("retune",started)
+        return results
+
+    def stats(self):
+        stats = {'connections': self.transport.connections, 'multicall': self.multicall_supported}
+        for method in self.latency:
+            stats[method] = summarise(list(self.latency[method]))
+        return stats
+
+    def close(self):
+        self.transport.close()
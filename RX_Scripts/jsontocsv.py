@@ -2,42 +2,126 @@
 #
 #    FLDIGI Beacon receiver - Data Analysis
 #
-#    Parses a folder of json files using the BeaconAnalysis code
-#    
+#    Parses a folder of json files using the BeaconAnalysis code, or every result in an
+#    rx_archive.py archive if given an archive folder.
+#
+#    Results are analysed in parallel by a pool of worker processes, and the CSV rows written
+#    out in time order as they come back. Each row is also kept in a cache file, keyed on the
+#    file name and modification time (or for an archive, the result's place in the archive),
+#    so running this again over a growing folder only analyses the new or changed results.
+#
+#    Usage: python jsontocsv.py [-j processes] [--cache file] [--no-cache] folder > results.csv
+#
 #    Copyright (C) 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
-# 
+#
 #      This program is free software: you can redistribute it and/or modify
 #      it under the terms of the GNU General Public License as published by
 #      the Free Software Foundation, either version 3 of the License, or
 #      (at your option) any later version.
-# 
+#
 #      This program is distributed in the hope that it will be useful,
 #      but WITHOUT ANY WARRANTY; without even the implied warranty of
 #      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
 #      GNU General Public License for more details.
-# 
-#      For a full copy of the GNU General Public License, 
+#
+#      For a full copy of the GNU General Public License,
 #      see <http://www.gnu.org/licenses/>.
 #
 #
 
-import os,glob,Levenshtein,json,sys
-import BeaconAnalysis
+import os,glob,json,sys,argparse,multiprocessing
+import BeaconAnalysis,rx_archive
+
+header = "time,psk_jaro,domex_jaro"
+
+# Name of the cache file, kept in the folder being analysed unless another is given.
+cache_filename = ".jsontocsv_cache.json"
+
+# Files handed to a worker at a time.
+chunk_size = 16
+
+
+def csv_row(b):
+    return b.get_timestamp() + "," + str(b.get_psk_jaro()) + "," + str(b.get_domex_jaro())
+
+def analyse(job):
+    # Run in the worker processes. job is (key, version, source), where source is a JSON file
+    # name, or an (archive folder, partition, index row) tuple.
+    key, version, source = job
+    if isinstance(source,tuple):
+        b = BeaconAnalysis.BeaconAnalysis(data=rx_archive.BeaconArchive(source[0]).read_row(source[1],source[2]))
+    else:
+        b = BeaconAnalysis.BeaconAnalysis(source)
+    return csv_row(b)
+
+def folder_jobs(folder):
+    # (key, version, source) for every result in a folder of JSON files, or an archive.
+    if os.path.exists(os.path.join(folder,rx_archive.traces_file)):
+        archive = rx_archive.BeaconArchive(folder)
+        for (name,row) in archive.rows(0,2**62):
+            # Results are never changed in place, so a result's position in the archive identifies it.
+            yield ("%s/%d/%d" % (name,row[0],row[1]), 0, (folder,name,row))
+    else:
+        for filename in sorted(glob.glob(os.path.join(folder,"*.json"))):
+            yield (filename, os.path.getmtime(filename), filename)
+
+def load_cache(filename):
+    if filename is None or not os.path.exists(filename):
+        return {}
+    try:
+        f = open(filename)
+        cache = json.loads(f.read())
+        f.close()
+        return cache
+    except (IOError,ValueError):
+        sys.stderr.write("Could not read cache file, starting with an empty cache.\n")
+        return {}
+
+def save_cache(filename,cache):
+    if filename is None:
+        return
+    f = open(filename + ".tmp",'w')
+    f.write(json.dumps(cache))
+    f.close()
+    os.rename(filename + ".tmp",filename)
 
-if len(sys.argv) < 2:
-    print "Need folder as argument"
-    sys.exit(1)
-else:
-    pass
+def rows(jobs,cache,processes=None):
+    # CSV rows for every job, in order. Jobs with an up to date cache entry aren't analysed again.
+    # New results are added to the cache.
+    todo = [job[0] not in cache or cache[job[0]][0] != job[1] for job in jobs]
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.imap(analyse,[jobs[i] for i in range(len(jobs)) if todo[i]],chunk_size)
+        for i in range(len(jobs)):
+            if todo[i]:
+                cache[jobs[i][0]] = [jobs[i][1],next(results)]
+            yield cache[jobs[i][0]][1]
+    finally:
+        pool.close()
+        pool.join()
 
-filemask = "./" + sys.argv[1] + "/*.json"
+def main():
+    parser = argparse.ArgumentParser(description="Analyse beacon_rx.py results into CSV")
+    parser.add_argument("folder")
+    parser.add_argument("-j","--processes",type=int,default=None,help="Worker processes. Defaults to the number of CPUs.")
+    parser.add_argument("--cache",default=None,help="Cache file. Defaults to " + cache_filename + " in the folder.")
+    parser.add_argument("--no-cache",action="store_true")
+    args = parser.parse_args()
 
-filenames = sorted(glob.glob(filemask))
-data = []
+    cache_file = None
+    if not args.no_cache:
+        cache_file = args.cache or os.path.join(args.folder,cache_filename)
+    cache = load_cache(cache_file)
 
-print "time,psk_jaro,domex_jaro"
+    jobs = list(folder_jobs(args.folder))
+    print header
+    try:
+        for row in rows(jobs,cache,args.processes):
+            print row
+    finally:
+        # Drop entries for results which have gone.
+        keys = set(job[0] for job in jobs)
+        save_cache(cache_file,dict((k,cache[k]) for k in cache if k in keys))
 
-for filename in filenames:
-    b = BeaconAnalysis.BeaconAnalysis(filename)
-    
-    print b.get_timestamp() + "," + str(b.get_psk_jaro()) + "," + str(b.get_domex_jaro())
\ No newline at end of file
+if __name__ == "__main__":
+    main()
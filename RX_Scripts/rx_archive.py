@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+#
+#    FLDIGI Beacon receiver - Receive Archive
+#
+#   An append-only store for beacon_rx.py results, in place of one JSON file per minute.
+#   The archive is a folder with one partition folder per UTC day (YYYY-MM-DD), holding:
+#     index.dat     One fixed-length row per received minute: the minute (seconds since the epoch),
+#                   where its other fields are in meta.dat, and where its quality samples are.
+#     meta.dat      The rest of each result (timeseed, expected and received text...) as JSON.
+#     qtime.f64     Quality sample times, as float64.
+#     qvalue.f32    Quality sample values, as float32.
+#     qtrace.u8     Which trace (psk_qual, domex_qual...) each sample belongs to, as an index
+#                   into traces.json in the archive folder.
+#   Every result field ending in "_qual" is treated as a quality trace, stored in the columns.
+#
+#   The data files are written before the index row, and anything past the end of what the index
+#   refers to is cut off before appending, so a result is either all there or not at all.
+#   Quality samples for a range of days can be read straight into NumPy arrays without touching
+#   the text at all.
+#
+#   Writing and reading results only needs the standard library. Reading columns needs NumPy.
+#
+#   Usage:
+#       python rx_archive.py import <archive> <json folder> [<json folder> ...]
+#       python rx_archive.py get <archive> "<dd-mm-YYYY HH:MM>"
+#       python rx_archive.py scan <archive> <start YYYY-MM-DD> <end YYYY-MM-DD>
+#
+#    Copyright (C) 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+#      GNU General Public License for more details.
+#
+#      For a full copy of the GNU General Public License,
+#      see <http://www.gnu.org/licenses/>.
+#
+#
+
+import array,calendar,glob,json,os,struct,sys,time
+import payload
+
+try:
+    import numpy as np
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
+# minute, meta offset, meta length, first quality sample, quality sample count.
+index_row = struct.Struct("<qqIqI")
+partition_format = "%Y-%m-%d"
+traces_file = "traces.json"
+
+# Column files, with their array typecodes and NumPy dtypes.
+columns = {'qtime': ('d','<f8','qtime.f64'), 'qvalue': ('f','<f4','qvalue.f32'), 'qtrace': ('B','u1','qtrace.u8')}
+
+if numpy_enabled:
+    index_dtype = np.dtype([('minute','<i8'),('meta_offset','<i8'),('meta_length','<u4'),('qual_offset','<i8'),('qual_count','<u4')])
+
+
+def partition_name(minute):
+    return time.strftime(partition_format,time.gmtime(minute))
+
+def partition_start(name):
+    return calendar.timegm(time.strptime(name,partition_format))
+
+def is_trace(key):
+    return key.endswith("_qual")
+
+def write_column(f,typecode,values):
+    a = array.array(typecode,values)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    a.tofile(f)
+
+def read_column(f,typecode,count):
+    a = array.array(typecode)
+    a.fromfile(f,count)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a
+
+
+class Partition(object):
+    # One day of results.
+
+    def __init__(self,path):
+        self.path = path
+        self.files = None
+
+    def filename(self,name):
+        return os.path.join(self.path,name)
+
+    def read_index(self,first=0):
+        # Index rows, as tuples, in the order they were written. Optionally only those from the
+        # first'th row on, without reading the ones before it.
+        try:
+            f = open(self.filename("index.dat"),'rb')
+        except IOError:
+            return []
+        f.seek(first*index_row.size)
+        data = f.read()
+        f.close()
+        count = len(data)//index_row.size
+        return [index_row.unpack_from(data,i*index_row.size) for i in range(count)]
+
+    def index_length(self):
+        # Number of index rows, from the file size.
+        try:
+            return os.path.getsize(self.filename("index.dat"))//index_row.size
+        except OSError:
+            return 0
+
+    def index_array(self):
+        try:
+            return np.fromfile(self.filename("index.dat"),dtype=index_dtype)
+        except IOError:
+            return np.zeros(0,dtype=index_dtype)
+
+    def open_for_append(self):
+        # Open every file for appending, first cutting off anything not covered by the index,
+        # as left by a write which was interrupted.
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        rows = self.read_index()
+        meta_end = 0
+        qual_end = 0
+        if len(rows) > 0:
+            meta_end = max(r[1] + r[2] for r in rows)
+            qual_end = max(r[3] + r[4] for r in rows)
+        sizes = {'index.dat': len(rows)*index_row.size, 'meta.dat': meta_end}
+        for name in columns:
+            sizes[columns[name][2]] = qual_end*struct.calcsize(columns[name][0])
+
+        self.files = {}
+        for filename in sizes:
+            f = open(self.filename(filename),'ab')
+            if f.tell() != sizes[filename]:
+                f.truncate(sizes[filename])
+                f.seek(0,os.SEEK_END)
+            self.files[filename] = f
+        self.meta_end = meta_end
+        self.qual_end = qual_end
+
+    def append(self,minute,meta,traces):
+        # traces: list of (trace id, [[time, quality], ...]).
+        if self.files is None:
+            self.open_for_append()
+        times = []
+        values = []
+        ids = []
+        for (trace_id,samples) in traces:
+            times += [float(s[0]) for s in samples]
+            values += [float(s[1]) for s in samples]
+            ids += [trace_id]*len(samples)
+        write_column(self.files['qtime.f64'],'d',times)
+        write_column(self.files['qvalue.f32'],'f',values)
+        write_column(self.files['qtrace.u8'],'B',ids)
+        meta = json.dumps(meta,sort_keys=True).encode('utf-8')
+        self.files['meta.dat'].write(meta)
+        for name in ('meta.dat','qtime.f64','qvalue.f32','qtrace.u8'):
+            self.files[name].flush()
+        # The index row goes last. Once it's written, the result is in the archive.
+        self.files['index.dat'].write(index_row.pack(minute,self.meta_end,len(meta),self.qual_end,len(times)))
+        self.files['index.dat'].flush()
+        self.meta_end += len(meta)
+        self.qual_end += len(times)
+
+    def read(self,rows,trace_names,traces=True):
+        # Full results for some of this partition's index rows. With traces False, only the text
+        # fields are read, leaving out the quality traces.
+        f = open(self.filename("meta.dat"),'rb')
+        columns_files = {}
+        if traces:
+            columns_files = dict((name,open(self.filename(columns[name][2]),'rb')) for name in columns)
+        results = []
+        for row in rows:
+            f.seek(row[1])
+            result = json.loads(f.read(row[2]).decode('utf-8'))
+            if not traces:
+                del result["_traces"]
+                results.append(result)
+                continue
+            samples = {}
+            for name in columns:
+                columns_files[name].seek(row[3]*struct.calcsize(columns[name][0]))
+                samples[name] = read_column(columns_files[name],columns[name][0],row[4])
+            for name in result.pop("_traces",[]):
+                result[name] = []
+            for i in range(row[4]):
+                result[trace_names[samples['qtrace'][i]]].append([samples['qtime'][i],samples['qvalue'][i]])
+            results.append(result)
+        f.close()
+        for name in columns_files:
+            columns_files[name].close()
+        return results
+
+    def close(self):
+        if self.files is not None:
+            for name in self.files:
+                self.files[name].close()
+            self.files = None
+
+
+class BeaconArchive(object):
+
+    def __init__(self,path):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.trace_names = []
+        if os.path.exists(os.path.join(path,traces_file)):
+            f = open(os.path.join(path,traces_file))
+            self.trace_names = json.loads(f.read())
+            f.close()
+        self.writing = None
+
+    def partitions(self):
+        # Names of all day partitions, in date order.
+        return sorted(name for name in os.listdir(self.path) if os.path.isdir(os.path.join(self.path,name)))
+
+    def partition(self,name):
+        return Partition(os.path.join(self.path,name))
+
+    def trace_id(self,name):
+        if name not in self.trace_names:
+            if len(self.trace_names) >= 255:
+                raise ValueError("Too many trace names in archive")
+            self.trace_names.append(name)
+            f = open(os.path.join(self.path,traces_file + ".tmp"),'w')
+            f.write(json.dumps(self.trace_names))
+            f.close()
+            os.rename(os.path.join(self.path,traces_file + ".tmp"),os.path.join(self.path,traces_file))
+        return self.trace_names.index(name)
+
+    def append(self,result):
+        # Add a beacon_rx.py result dictionary.
+        minute = payload.parse_timeseed(result["timeseed"])
+        name = partition_name(minute)
+        if self.writing is None or os.path.basename(self.writing.path) != name:
+            self.close()
+            self.writing = self.partition(name)
+
+        meta = {}
+        traces = []
+        for key in result:
+            if is_trace(key):
+                traces.append((self.trace_id(key),result[key]))
+            else:
+                meta[key] = result[key]
+        meta["_traces"] = sorted(key for key in result if is_trace(key))
+        self.writing.append(minute,meta,traces)
+
+    def minutes(self,name):
+        return set(row[0] for row in self.partition(name).read_index())
+
+    def get(self,timeseed):
+        # The result for a "dd-mm-YYYY HH:MM" timeseed, or None. If a minute was written more than
+        # once, the last one is returned.
+        minute = payload.parse_timeseed(timeseed)
+        partition = self.partition(partition_name(minute))
+        rows = [row for row in partition.read_index() if row[0] == minute]
+        if len(rows) == 0:
+            return None
+        return partition.read(rows[-1:],self.trace_names)[0]
+
+    def rows(self,start,end):
+        # (partition name, index row) for minutes from start up to (not including) end, in time order.
+        for name in self.partitions():
+            day = partition_start(name)
+            if day + 86400 <= start or day >= end:
+                continue
+            for row in sorted((row for row in self.partition(name).read_index() if start <= row[0] < end),key=lambda r: r[0]):
+                yield name,row
+
+    def read_row(self,name,row):
+        return self.partition(name).read([row],self.trace_names)[0]
+
+    def query(self,start,end,traces=True):
+        # Results for minutes from start up to (not including) end, in time order. Optionally
+        # without their quality traces.
+        for name in self.partitions():
+            day = partition_start(name)
+            if day + 86400 <= start or day >= end:
+                continue
+            partition = self.partition(name)
+            rows = sorted((row for row in partition.read_index() if start <= row[0] < end),key=lambda r: r[0])
+            for result in partition.read(rows,self.trace_names,traces):
+                yield result
+
+    def columns(self,start,end,trace=None):
+        # Every quality sample for minutes from start up to end, as NumPy arrays:
+        # minute, qtime, qvalue and qtrace, one element per sample. Optionally only one trace.
+        if not numpy_enabled:
+            raise ImportError("NumPy is needed to read archive columns")
+        parts = {'minute': [], 'qtime': [], 'qvalue': [], 'qtrace': []}
+        for name in self.partitions():
+            day = partition_start(name)
+            if day + 86400 <= start or day >= end:
+                continue
+            partition = self.partition(name)
+            index = partition.index_array()
+            if len(index) == 0:
+                continue
+            qual_end = int((index['qual_offset'] + index['qual_count']).max())
+            data = {}
+            for column in columns:
+                data[column] = np.fromfile(partition.filename(columns[column][2]),dtype=columns[column][1],count=qual_end)
+            # Mark out the samples of each wanted row, using the row's offset and count.
+            wanted = index[(index['minute'] >= start) & (index['minute'] < end)]
+            counts = wanted['qual_count'].astype(np.int64)
+            starts = np.repeat(wanted['qual_offset'] - np.cumsum(counts) + counts,counts)
+            positions = starts + np.arange(counts.sum())
+            minute = np.repeat(wanted['minute'],counts)
+            if trace is not None:
+                keep = data['qtrace'][positions] == self.trace_names.index(trace) if trace in self.trace_names else np.zeros(len(positions),dtype=bool)
+                positions = positions[keep]
+                minute = minute[keep]
+            parts['minute'].append(minute)
+            for column in columns:
+                parts[column].append(data[column][positions])
+        result = {}
+        for column in parts:
+            if len(parts[column]) > 0:
+                result[column] = np.concatenate(parts[column])
+            else:
+                result[column] = np.zeros(0,dtype=columns[column][1] if column in columns else '<i8')
+        return result
+
+    def import_folder(self,folder):
+        # Add every result JSON file in a folder (and its subfolders) not already in the archive.
+        # Returns the number of results added.
+        filenames = sorted(glob.glob(os.path.join(folder,"*.json")) + glob.glob(os.path.join(folder,"*","*.json")))
+        present = {}
+        added = 0
+        for filename in filenames:
+            # beacon_rx.py names files after their timeseed, so results already in the archive
+            # can usually be skipped without reading them.
+            try:
+                minute = payload.parse_timeseed(os.path.basename(filename)[:-5])
+                name = partition_name(minute)
+                if name not in present:
+                    present[name] = self.minutes(name)
+                if minute in present[name]:
+                    continue
+            except ValueError:
+                pass
+            try:
+                f = open(filename)
+                result = json.loads(f.read())
+                f.close()
+                minute = payload.parse_timeseed(result["timeseed"])
+            except (IOError,ValueError,KeyError) as e:
+                print("Skipping " + filename + ": " + str(e))
+                continue
+            name = partition_name(minute)
+            if name not in present:
+                present[name] = self.minutes(name)
+            if minute in present[name]:
+                continue
+            self.append(result)
+            present[name].add(minute)
+            added += 1
+        self.close()
+        return added
+
+    def close(self):
+        if self.writing is not None:
+            self.writing.close()
+            self.writing = None
+
+
+def main():
+    if len(sys.argv) >= 4 and sys.argv[1] == "import":
+        archive = BeaconArchive(sys.argv[2])
+        began = time.time()
+        for folder in sys.argv[3:]:
+            added = archive.import_folder(folder)
+            print("Imported %d results from %s" % (added,folder))
+        print("Took %.1f seconds." % (time.time()-began))
+    elif len(sys.argv) == 4 and sys.argv[1] == "get":
+        result = BeaconArchive(sys.argv[2]).get(sys.argv[3])
+        if result is None:
+            print("Not in archive.")
+        else:
+            print(json.dumps(result))
+    elif len(sys.argv) == 5 and sys.argv[1] == "scan":
+        archive = BeaconArchive(sys.argv[2])
+        start = calendar.timegm(time.strptime(sys.argv[3],"%Y-%m-%d"))
+        end = calendar.timegm(time.strptime(sys.argv[4],"%Y-%m-%d"))
+        began = time.time()
+        data = archive.columns(start,end)
+        minutes = len(np.unique(data['minute']))
+        print("%d minutes, %d quality samples, read in %.2f seconds." % (minutes,len(data['qvalue']),time.time()-began))
+        for i in range(len(archive.trace_names)):
+            values = data['qvalue'][data['qtrace'] == i]
+            if len(values) > 0:
+                print("%s: mean quality %.1f, max %.1f" % (archive.trace_names[i],values.mean(),values.max()))
+    else:
+        print("Usage: rx_archive.py import <archive> <json folder> [<json folder> ...]")
+        print("       rx_archive.py get <archive> \"<dd-mm-YYYY HH:MM>\"")
+        print("       rx_archive.py scan <archive> <start YYYY-MM-DD> <end YYYY-MM-DD>")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+#
+#    FLDIGI Beacon receiver - Receive Benchmarks
+#
+#   Runs the old beacon_rx.py receive loop (sleep, get_quality(), recv(8)) and the receive engine
+#   (rx_engine.py) against the fldigi stand-in (fake_fldigi.py), at several decoded text rates,
+#   and compares:
+#    - Quality sample intervals, against the intended 100ms.
+#    - Text received against text sent, and how long each character took to be read.
+#   It also times a retune (mode, carrier and squelch) made with separate ServerProxy calls,
+#   against one made with fldigi_client's batched request.
+#
+#   Results are written out as JSON, so runs can be compared against each other.
+#
+#   Usage: python rx_benchmark.py [-o results.json] [--duration 20] [--quality-delay 0.05] [--request-delay 0.01] [rate ...]
+#   Rates are characters/second. Defaults to PSK31, PSK250 and a burst rate.
+#
+#    Copyright (C) 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+#      GNU General Public License for more details.
+#
+#      For a full copy of the GNU General Public License,
+#      see <http://www.gnu.org/licenses/>.
+#
+#
+
+import argparse,json,platform,socket,time
+import fake_fldigi,fldigi_client,rx_engine
+
+try:
+    from xmlrpclib import ServerProxy
+except ImportError:
+    from xmlrpc.client import ServerProxy
+
+summarise = fldigi_client.summarise
+
+default_rates = [5.0,30.0,200.0]
+
+# Ports for the stand-in, away from a real fldigi's.
+base_port = 17300
+
+squelch_threshold = 4.0
+
+
+def legacy_receive(xmlrpc_addr,port,duration):
+    # The receive loop from beacon_rx.py. Returns quality samples and (time, text) reads.
+    fldigi = ServerProxy(xmlrpc_addr)
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.settimeout(1.0)
+    s.connect(("localhost",port))
+    quality = []
+    chunks = []
+    lock = False
+    end = time.time() + duration
+    while time.time() < end:
+        time.sleep(0.1)
+        current_quality = fldigi.modem.get_quality()
+        quality.append([time.time(), current_quality])
+        if(current_quality>squelch_threshold or lock):
+            lock = True
+            try:
+                temp = s.recv(8)
+                chunks.append((time.time(),rx_engine.text(temp)))
+            except:
+                pass
+    s.close()
+    return quality,chunks
+
+def engine_receive(xmlrpc_addr,port,duration):
+    engine = rx_engine.ReceiveEngine(xmlrpc_addr,"localhost",port)
+    engine.start()
+    time.sleep(duration)
+    engine.stop()
+    return list(engine.sampler.samples),list(engine.reader.chunks)
+
+def measure(quality,chunks,sent):
+    intervals = [quality[i][0] - quality[i-1][0] for i in range(1,len(quality))]
+    # Characters arrive in the order they were sent, so the n'th received is the n'th sent.
+    latencies = []
+    n = 0
+    for (t,data) in chunks:
+        for c in data:
+            if n < len(sent):
+                latencies.append(t - sent[n][0])
+            n += 1
+    return {'quality_samples': len(quality), 'quality_interval': summarise(intervals),
+        'sent': len(sent), 'received': n, 'backlog': len(sent) - n, 'latency': summarise(latencies)}
+
+def bench_retune(iterations,request_delay,port):
+    fldigi = fake_fldigi.FakeFldigi("localhost",port,port+1,request_delay=request_delay)
+    xmlrpc_addr = "http://localhost:%d" % port
+    results = {}
+    try:
+        proxy = ServerProxy(xmlrpc_addr)
+        times = []
+        for i in range(iterations):
+            start = time.time()
+            proxy.modem.set_by_name("BPSK31")
+            proxy.modem.set_carrier(1007)
+            proxy.main.set_squelch_level(squelch_threshold)
+            times.append(time.time() - start)
+        results['serverproxy'] = summarise(times)
+
+        client = fldigi_client.FldigiClient(xmlrpc_addr)
+        for i in range(iterations):
+            client.retune("BPSK31",1007,squelch_threshold)
+        results['fldigi_client'] = client.stats()['retune']
+        results['fldigi_client_connections'] = client.stats()['connections']
+        client.close()
+    finally:
+        fldigi.close()
+    return results
+
+def bench(receive,rate,duration,quality_delay,port):
+    fldigi = fake_fldigi.FakeFldigi("localhost",port,port+1,rate,quality_delay)
+    fldigi.signal = True
+    try:
+        quality,chunks = receive("http://localhost:%d" % port,port+1,duration)
+        sent = list(fldigi.sent)
+    finally:
+        fldigi.close()
+    return measure(quality,chunks,sent)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fldigi receive loops against a stand-in")
+    parser.add_argument("rates",nargs="*",type=float,default=default_rates)
+    parser.add_argument("-o","--output",default="rx_benchmark_results.json")
+    parser.add_argument("--duration",type=float,default=20.0)
+    parser.add_argument("--quality-delay",type=float,default=0.05,help="Maximum get_quality() delay (s).")
+    parser.add_argument("--request-delay",type=float,default=0.01,help="Delay before each XML-RPC request is handled (s).")
+    args = parser.parse_args()
+
+    results = {'platform': platform.platform(), 'python': platform.python_version(), 'time': time.time(),
+        'duration': args.duration, 'quality_delay': args.quality_delay, 'request_delay': args.request_delay, 'rates': {}}
+    port = base_port
+
+    results['retune'] = bench_retune(50,args.request_delay,port)
+    port += 2
+    print("Retune: separate calls p50 %.1f ms max %.1f ms, batched p50 %.1f ms max %.1f ms" % (results['retune']['serverproxy']['p50'],
+        results['retune']['serverproxy']['max'],results['retune']['fldigi_client']['p50'],results['retune']['fldigi_client']['max']))
+    for rate in args.rates:
+        results['rates'][str(rate)] = {}
+        for (name,receive) in (('legacy',legacy_receive),('engine',engine_receive)):
+            r = bench(receive,rate,args.duration,args.quality_delay,port)
+            port += 2
+            results['rates'][str(rate)][name] = r
+            print("%6.1f chars/s %s: %d samples, interval mean %.1f ms max %.1f ms, %d/%d chars read, latency p50 %.1f ms max %.1f ms" % (rate,
+                name.ljust(6),r['quality_samples'],r['quality_interval']['mean'],r['quality_interval']['max'],r['received'],r['sent'],
+                r['latency']['p50'] if r['latency'] else 0,r['latency']['max'] if r['latency'] else 0))
+
+    f = open(args.output,'w')
+    f.write(json.dumps(results,indent=2,sort_keys=True))
+    f.close()
+    print("Results written to " + args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+#
+#    FLDIGI Beacon receiver - Receive Engine
+#
+#   Collects fldigi's modem quality and decoded text on two background threads, so neither
+#   holds up the other:
+#    - QualitySampler polls modem.get_quality() over its own XML-RPC connection, on a fixed grid
+#      of monotonic deadlines, so a slow call delays one sample without shifting the rest.
+#    - TextReader drains the FLARQ text socket with non-blocking reads of whatever has arrived,
+#      as soon as select() says there is something there.
+#   Every quality sample and every chunk of text is stamped with the time it was taken, and kept
+#   in a bounded buffer. The receive windows of a beacon cycle are then cut out by time.
+#
+#   Usage:
+#       engine = ReceiveEngine(xmlrpc_addr,flarq_host,flarq_port)
+#       engine.start()
+#       ...
+#       result = engine.segment(start,end,squelch_threshold)
+#       engine.stop()
+#
+#    Copyright (C) 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+#      GNU General Public License for more details.
+#
+#      For a full copy of the GNU General Public License,
+#      see <http://www.gnu.org/licenses/>.
+#
+#
+
+import collections,errno,select,socket,threading,time
+import scheduler,fldigi_client
+
+# Quality samples per second.
+default_sample_rate = 10.0
+
+# Buffer bounds. An hour of quality samples at the default rate, and text chunks (a chunk is
+# whatever one read returned, usually a few characters).
+quality_buffer_length = 36000
+text_buffer_length = 65536
+
+# Largest single read from the text socket.
+read_size = 4096
+
+# How often the reader wakes up with nothing to read, to see if it has been stopped.
+poll_timeout = 0.2
+
+
+def text(data):
+    # Socket data as a str. fldigi sends whatever it decodes, so this mustn't fail on odd bytes.
+    if str is bytes:
+        return data
+    return data.decode('latin-1')
+
+
+class QualitySampler(threading.Thread):
+
+    def __init__(self,xmlrpc_addr,rate=default_sample_rate,maxlen=quality_buffer_length):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        # A client isn't safe to share between threads, so the sampler has its own.
+        self.fldigi = fldigi_client.FldigiClient(xmlrpc_addr)
+        self.period = 1.0/rate
+        # [time, quality] pairs, the time being the middle of the get_quality() call.
+        self.samples = collections.deque(maxlen=maxlen)
+        self.running = True
+        self.errors = 0
+        self.missed = 0
+
+    def run(self):
+        deadline = scheduler.monotonic()
+        while self.running:
+            before = time.time()
+            try:
+                quality = self.fldigi.get_quality()
+                after = time.time()
+                self.samples.append([(before+after)/2,quality])
+            except (socket.error,fldigi_client.Error,ValueError):
+                self.errors += 1
+
+            deadline += self.period
+            now = scheduler.monotonic()
+            if deadline < now:
+                # The call overran one or more sample times. Skip them, rather than bunching
+                # samples up to catch up.
+                skipped = int((now - deadline)/self.period) + 1
+                self.missed += skipped
+                deadline += skipped*self.period
+            time.sleep(deadline - now)
+        self.fldigi.close()
+
+    def stop(self):
+        self.running = False
+
+
+class TextReader(threading.Thread):
+
+    def __init__(self,host,port,maxlen=text_buffer_length):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.sock.connect((host,port))
+        self.sock.setblocking(0)
+        # (time, text) for every read.
+        self.chunks = collections.deque(maxlen=maxlen)
+        self.running = True
+        self.received = 0
+        self.dropped = 0
+
+    def run(self):
+        while self.running:
+            try:
+                readable = select.select([self.sock],[],[],poll_timeout)[0]
+            except (select.error,socket.error,ValueError):
+                break
+            if len(readable) == 0:
+                continue
+            now = time.time()
+            try:
+                data = self.sock.recv(read_size)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN,errno.EWOULDBLOCK,errno.EINTR):
+                    continue
+                print("Text socket error: " + str(e))
+                break
+            if len(data) == 0:
+                print("Text socket closed.")
+                break
+            if len(self.chunks) == self.chunks.maxlen:
+                self.dropped += len(self.chunks[0][1])
+            self.chunks.append((now,text(data)))
+            self.received += len(data)
+        self.running = False
+        self.sock.close()
+
+    def stop(self):
+        # The socket is closed once run() notices, within poll_timeout.
+        self.running = False
+
+
+class ReceiveEngine(object):
+
+    def __init__(self,xmlrpc_addr,flarq_host,flarq_port,rate=default_sample_rate):
+        # For the caller's own fldigi commands (mode, carrier, squelch).
+        self.fldigi = fldigi_client.FldigiClient(xmlrpc_addr)
+        self.sampler = QualitySampler(xmlrpc_addr,rate)
+        self.reader = TextReader(flarq_host,flarq_port)
+
+    def start(self):
+        self.sampler.start()
+        self.reader.start()
+
+    def stop(self):
+        self.sampler.stop()
+        self.reader.stop()
+        self.sampler.join()
+        self.reader.join()
+        self.fldigi.close()
+
+    def quality(self,start,end):
+        # Quality samples taken from start up to (not including) end.
+        return [s for s in list(self.sampler.samples) if start <= s[0] < end]
+
+    def text(self,start,end):
+        return "".join(c[1] for c in list(self.reader.chunks) if start <= c[0] < end)
+
+    def segment(self,start,end,threshold):
+        # Everything received in one receive window. As with the old receive loop, text only
+        # counts once the quality has gone over the squelch threshold (the modem has locked on),
+        # but then everything received in the window is kept.
+        quality = self.quality(start,end)
+        locked = [s[0] for s in quality if s[1] > threshold]
+        result = {'quality': quality, 'lock_time': None, 'text': ""}
+        if len(locked) > 0:
+            result['lock_time'] = locked[0]
+            result['text'] = self.text(start,end)
+        return result
+
+    def stats(self):
+        return {'quality_samples': len(self.sampler.samples), 'quality_errors': self.sampler.errors,
+            'quality_missed': self.sampler.missed, 'text_received': self.reader.received,
+            'text_dropped': self.reader.dropped, 'quality_latency': self.sampler.fldigi.stats(),
+            'control_latency': self.fldigi.stats()}
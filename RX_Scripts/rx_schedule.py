@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+#
+#    FLDIGI Beacon receiver - Schedule Timeline
+#
+#   Works out what the receiver has to do to follow a beacon schedule: the same schedule JSON
+#   file beacon_json.py transmits from (e.g. Beacon_Scripts/schedules/standard.json). For every
+#   entry (IDENT, BPSK31/63/125/250...), the timeline has:
+#    - setup     Switch fldigi to the entry's modem, with the squelch shut, so nothing from
+#                the previous mode or the noise in between gets through. This is as soon as
+#                the previous window has closed, up to setup_lead seconds before the start.
+#    - open      Set the carrier and open the squelch, open_lead seconds before the start, so
+#                the modem can lock on during the preamble.
+#    - close     End of the capture window: the entry's airtime (worked out from the expected
+#                text with varicode.py for BPSK), plus a margin, but never past the next entry's
+#                open.
+#   Times are seconds after the cycle start (the minute the transmitter started on).
+#
+#   The timeline is run by run_timeline(), waiting for each event with scheduler.py's deadline
+#   timers, and capturing each window from a ReceiveEngine (rx_engine.py).
+#
+#   Usage: python rx_schedule.py schedule.json     (prints the timeline for this minute)
+#
+#    Copyright (C) 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+#      GNU General Public License for more details.
+#
+#      For a full copy of the GNU General Public License,
+#      see <http://www.gnu.org/licenses/>.
+#
+#
+
+import json,string,sys,time
+import payload,scheduler,varicode
+
+squelch_threshold = 4.0
+# Squelch level used to shut the squelch between windows.
+closed_squelch = 90.0
+
+# Seconds before an entry's start to switch modem, and to open the squelch.
+setup_lead = 5.0
+open_lead = 1.0
+
+# Seconds kept open after an entry's expected end.
+end_margin = 2.0
+
+# PSK preamble and postamble sent by beacon_json.py's psk(), in seconds.
+psk_preamble = 3
+psk_postamble = 1
+
+# Capture windows for modes without an airtime model (seconds).
+default_window = 30.0
+mode_windows = {"IDENT": 15.0}
+
+# fldigi modem for each schedule mode, where the names differ.
+fldigi_modes = {"IDENT": "CW"}
+
+# Audio centre frequency of each mode's tones in fldigi. These may vary with transmitter
+# temperature, but should be a good enough start point for fldigi to find it.
+default_carrier = 1007
+carriers = {"DOMEX8": 1140}
+
+# Result field names (name_data, name_qual) for modes older results used.
+result_names = {"BPSK31": "psk", "DOMEX8": "domex"}
+
+
+def load_schedule(filename):
+    # The schedule entries, sorted by start time, or None if the file can't be read.
+    try:
+        f = open(filename)
+        schedule = json.loads(f.read())
+        f.close()
+    except (IOError,ValueError) as e:
+        print("Error reading schedule " + filename + ": " + str(e))
+        return None
+    for entry in schedule:
+        if "mode" not in entry or "starttime" not in entry:
+            print("Schedule entries need a mode and starttime: " + json.dumps(entry))
+            return None
+    return sorted(schedule,key=lambda e: float(e["starttime"]))
+
+def psk_baud(mode):
+    # Baud rate of a BPSK mode name, or None.
+    if mode.startswith("BPSK") and mode[4:].isdigit():
+        return int(mode[4:])
+    return None
+
+def airtime(mode,txstring):
+    # Expected transmit time of an entry, in seconds.
+    baud = psk_baud(mode)
+    if baud is not None:
+        return varicode.airtime(txstring,baud) + psk_preamble + psk_postamble
+    return mode_windows.get(mode,default_window)
+
+def entry_names(schedule):
+    # Result field name for each entry: the older names for modes which had them, otherwise the
+    # mode in lower case. A mode used more than once gets _2, _3... on the later ones.
+    names = []
+    for entry in schedule:
+        name = result_names.get(entry["mode"],entry["mode"].lower())
+        if name in names:
+            count = 2
+            while "%s_%d" % (name,count) in names:
+                count += 1
+            name = "%s_%d" % (name,count)
+        names.append(name)
+    return names
+
+def build_timeline(schedule,txstring):
+    # Windows for every entry: a list of dictionaries with name, mode, fldigi mode, carrier, and
+    # setup, open, start and close times (seconds after the cycle start).
+    windows = []
+    names = entry_names(schedule)
+    for i in range(len(schedule)):
+        mode = schedule[i]["mode"]
+        start = float(schedule[i]["starttime"])
+        window = {'name': names[i], 'mode': mode, 'fldigi_mode': fldigi_modes.get(mode,mode),
+            'carrier': carriers.get(mode,default_carrier), 'start': start,
+            'open': start - open_lead, 'close': start + airtime(mode,txstring) + end_margin}
+        if i + 1 < len(schedule):
+            window['close'] = min(window['close'],float(schedule[i+1]["starttime"]) - open_lead)
+        previous_close = windows[-1]['close'] if len(windows) > 0 else None
+        window['setup'] = start - setup_lead
+        if previous_close is not None:
+            window['setup'] = max(window['setup'],previous_close)
+        window['open'] = max(window['open'],window['setup'])
+        windows.append(window)
+    return windows
+
+def events(windows):
+    # The timeline as (time, action, window), in the order they happen. A window closes before
+    # the next is set up, if they're at the same time.
+    order = {'close': 0, 'setup': 1, 'open': 2}
+    timeline = []
+    for window in windows:
+        for action in ('setup','open','close'):
+            timeline.append((window[action],action,window))
+    return sorted(timeline,key=lambda e: (e[0],order[e[1]]))
+
+def print_timeline(windows):
+    print("Entry       fldigi    Setup   Open  Start  Close")
+    for w in windows:
+        print("%-10s  %-8s %6.1f %6.1f %6.1f %6.1f" % (w['name'],w['fldigi_mode'],w['setup'],w['open'],w['start'],w['close']))
+
+def run_timeline(engine,windows,cycle_start,slots=None,threshold=squelch_threshold):
+    # Follow the timeline, retuning fldigi through the engine's client and capturing each window.
+    # Windows which have already closed are skipped. Returns a dictionary of results per window
+    # name: text, quality and lock time, along with the start error of each event.
+    if slots is None:
+        slots = scheduler.SlotScheduler()
+    results = {}
+    for (t,action,window) in events(windows):
+        if cycle_start + window['close'] <= time.time():
+            if action == 'close':
+                print("Missed " + window['name'] + ", it has already finished.")
+            continue
+        error = slots.wait_until(cycle_start + t,window['name'] + " " + action)
+        if action == 'setup':
+            engine.fldigi.retune(mode=window['fldigi_mode'],squelch=closed_squelch)
+        elif action == 'open':
+            engine.fldigi.retune(carrier=window['carrier'],squelch=threshold)
+            print("Attempting to receive " + window['mode'] + "...")
+        else:
+            result = engine.segment(cycle_start + window['open'],cycle_start + window['close'],threshold)
+            result['text'] = ''.join(filter(lambda x:x in string.printable, result['text']))
+            if len(result['text']) == 0:
+                print("No " + window['mode'] + " data received.")
+            else:
+                print("Got: " + result['text'])
+            results[window['name']] = result
+        window[action + '_error'] = error
+    return results
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: rx_schedule.py schedule.json")
+        return
+    schedule = load_schedule(sys.argv[1])
+    if schedule is None:
+        return
+    txdata = payload.txdata(time.time())
+    print("Timeline for " + txdata["timeseed"] + ":")
+    print_timeline(build_timeline(schedule,txdata["txstring"]))
+
+if __name__ == "__main__":
+    main()
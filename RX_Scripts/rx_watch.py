@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+#
+#    FLDIGI Beacon receiver - Watch Folder Analysis
+#
+#   Keeps the analysis of a receiver's results up to date as beacon_rx.py adds to them, instead
+#   of running jsontocsv.py over the whole lot again. Watches either an rx_archive.py archive or
+#   a folder of result JSON files (one subfolder per day, as beacon_rx.py writes them), and:
+#    - Analyses only results it hasn't seen before, appending their rows to a CSV file (the same
+#      columns as jsontocsv.py's).
+#    - Keeps running totals (results, valid decodes, mean Jaro distance, time to lock...) overall
+#      and per day, written out to a summary JSON file after every scan.
+#    - Remembers what it has done in a manifest file, so it carries on where it left off when
+#      restarted.
+#
+#   Finding new results is cheap whatever the size of the archive:
+#    - In an archive, index rows are only ever appended, so the manifest holds how many rows of
+#      each day have been done. A scan only checks the size of each index file, and reads the
+#      new rows.
+#    - In a JSON folder, only the day folders whose modification time has changed are listed.
+#      File names are kept for the last few days. Older days are closed off, keeping only the
+#      time they were last looked at.
+#
+#   The CSV file's length is kept in the manifest too. If this is stopped between writing rows
+#   and saving the manifest, the CSV is cut back to the manifest's length on restart, and those
+#   results are done again.
+#
+#   Usage: python rx_watch.py [--interval 10] [--once] [-o results.csv] folder
+#
+#    Copyright (C) 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+#      GNU General Public License for more details.
+#
+#      For a full copy of the GNU General Public License,
+#      see <http://www.gnu.org/licenses/>.
+#
+#
+
+import argparse,glob,json,multiprocessing,os,time
+import BeaconAnalysis,jsontocsv,payload,rx_archive
+
+# Files kept in the watched folder, unless told otherwise.
+manifest_filename = ".rx_watch_manifest.json"
+csv_filename = "rx_watch_results.csv"
+summary_filename = "rx_watch_summary.json"
+
+# Day folders of JSON results are closed off this long (s) after they were last changed.
+close_after = 2*86400
+
+# Analyse this many new results or more with a pool of worker processes.
+pool_threshold = 64
+
+# Running totals, per mode.
+modes = ["psk","domex"]
+
+
+def new_totals():
+    totals = {'results': 0}
+    for mode in modes:
+        for key in ['valid','jaro_sum','locked','lock_time_sum','locked_quality_sum']:
+            totals[mode + "_" + key] = 0
+    return totals
+
+def add_totals(totals,record):
+    totals['results'] += 1
+    for mode in modes:
+        for key in ['valid','jaro_sum','locked','lock_time_sum','locked_quality_sum']:
+            totals[mode + "_" + key] += record[mode + "_" + key]
+
+def summarise_totals(totals):
+    # Means from the running totals.
+    summary = {'results': totals['results']}
+    for mode in modes:
+        summary[mode + "_valid"] = totals[mode + "_valid"]
+        summary[mode + "_locked"] = totals[mode + "_locked"]
+        summary[mode + "_mean_jaro"] = totals[mode + "_jaro_sum"]/totals['results'] if totals['results'] > 0 else None
+        locked = totals[mode + "_locked"]
+        summary[mode + "_mean_lock_time"] = totals[mode + "_lock_time_sum"]/locked if locked > 0 else None
+        summary[mode + "_mean_locked_quality"] = totals[mode + "_locked_quality_sum"]/locked if locked > 0 else None
+    return summary
+
+def source_name(source):
+    # For messages about a result.
+    if isinstance(source,tuple):
+        return "%s row for %s" % (source[1],time.strftime("%H:%M",time.gmtime(source[2][0])))
+    return source
+
+def analyse(source):
+    # Run in the worker processes. source is a JSON file name, or an (archive folder, partition,
+    # index row) tuple. Returns (day, CSV row, totals record), (None, reason) if the result is
+    # bad and should be skipped, or None if it should be tried again on the next scan.
+    try:
+        if isinstance(source,tuple):
+            b = BeaconAnalysis.BeaconAnalysis(data=rx_archive.BeaconArchive(source[0]).read_row(source[1],source[2]))
+        else:
+            b = BeaconAnalysis.BeaconAnalysis(source)
+    except (IOError,ValueError,KeyError) as e:
+        if isinstance(source,tuple):
+            # Archive rows are written whole, so this one is never going to read.
+            return None, "can't be read: " + str(e)
+        # Probably a JSON file still being written. It will be tried again on the next scan.
+        return None
+    try:
+        return analyse_result(b)
+    except (ValueError,KeyError,TypeError,IndexError) as e:
+        # Such as a bad timeseed. One bad result mustn't stop the rest.
+        return None, "can't be analysed: " + repr(e)
+
+def analyse_result(b):
+    record = {}
+    for mode in modes:
+        jaro = b.get_psk_jaro() if mode == "psk" else b.get_domex_jaro()
+        record[mode + "_valid"] = int(jaro > b.threshold)
+        record[mode + "_jaro_sum"] = jaro
+        record[mode + "_locked"] = 0
+        record[mode + "_lock_time_sum"] = 0.0
+        record[mode + "_locked_quality_sum"] = 0.0
+        if BeaconAnalysis.numpy_enabled and len(b.data.get(mode + "_qual",[])) > 0:
+            stats = b.get_quality_stats(mode)
+            if stats['first_lock'] == stats['first_lock']:
+                record[mode + "_locked"] = 1
+                record[mode + "_lock_time_sum"] = stats['first_lock']
+                record[mode + "_locked_quality_sum"] = stats['mean_locked']
+    day = rx_archive.partition_name(payload.parse_timeseed(b.get_timestamp()))
+    return day, jsontocsv.csv_row(b), record
+
+
+class Watcher(object):
+
+    def __init__(self,folder,csv_file=None,manifest_file=None,summary_file=None,processes=None):
+        self.folder = folder
+        self.csv_file = csv_file or os.path.join(folder,csv_filename)
+        self.manifest_file = manifest_file or os.path.join(folder,manifest_filename)
+        self.summary_file = summary_file or os.path.join(folder,summary_filename)
+        self.processes = processes
+        self.is_archive = os.path.exists(os.path.join(folder,rx_archive.traces_file))
+        self.manifest = self.load_manifest()
+        self.open_csv()
+
+    def load_manifest(self):
+        manifest = {'csv_size': 0, 'partitions': {}, 'directories': {}, 'totals': new_totals(), 'days': {}, 'skipped': 0}
+        if os.path.exists(self.manifest_file):
+            try:
+                f = open(self.manifest_file)
+                manifest.update(json.loads(f.read()))
+                f.close()
+            except (IOError,ValueError):
+                print("Could not read manifest file, starting again.")
+                manifest['csv_size'] = 0
+        return manifest
+
+    def save_manifest(self):
+        f = open(self.manifest_file + ".tmp",'w')
+        f.write(json.dumps(self.manifest))
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.rename(self.manifest_file + ".tmp",self.manifest_file)
+
+    def save_summary(self):
+        summary = summarise_totals(self.manifest['totals'])
+        summary['days'] = dict((day,summarise_totals(self.manifest['days'][day])) for day in self.manifest['days'])
+        summary['skipped'] = self.manifest['skipped']
+        summary['updated'] = time.time()
+        f = open(self.summary_file + ".tmp",'w')
+        f.write(json.dumps(summary,indent=2,sort_keys=True))
+        f.close()
+        os.rename(self.summary_file + ".tmp",self.summary_file)
+
+    def open_csv(self):
+        # Cut off any rows written after the manifest was last saved.
+        self.csv = open(self.csv_file,'a')
+        self.csv.seek(0,os.SEEK_END)
+        if self.csv.tell() != self.manifest['csv_size']:
+            self.csv.truncate(self.manifest['csv_size'])
+            self.csv.seek(0,os.SEEK_END)
+        if self.manifest['csv_size'] == 0:
+            self.csv.write(jsontocsv.header + "\n")
+
+    def archive_sources(self):
+        # (partition, rows done after this) and the new results, for every partition which has grown.
+        archive = rx_archive.BeaconArchive(self.folder)
+        for name in archive.partitions():
+            partition = archive.partition(name)
+            done = self.manifest['partitions'].get(name,0)
+            if partition.index_length() <= done:
+                continue
+            rows = partition.read_index(done)
+            yield (name,done + len(rows)), [(self.folder,name,row) for row in rows]
+
+    def json_sources(self):
+        # (directory, its new manifest entry) and the new files, for every day folder which has changed.
+        now = time.time()
+        directories = self.manifest['directories']
+        outputs = set(os.path.abspath(f) for f in (self.csv_file,self.manifest_file,self.summary_file))
+        for dirname in sorted(glob.glob(os.path.join(self.folder,"*"))) + [self.folder]:
+            if not os.path.isdir(dirname):
+                continue
+            key = os.path.relpath(dirname,self.folder)
+            mtime = os.path.getmtime(dirname)
+            entry = directories.get(key,{'mtime': None, 'files': []})
+            if entry['mtime'] == mtime:
+                if 'files' in entry and now - mtime > close_after:
+                    # Not changed for a while, so stop keeping its file names.
+                    directories[key] = {'mtime': mtime, 'closed': now}
+                continue
+            files = set(entry.get('files',[]))
+            new = []
+            for filename in sorted(glob.glob(os.path.join(dirname,"*.json"))):
+                name = os.path.basename(filename)
+                if name in files or os.path.abspath(filename) in outputs:
+                    continue
+                # In a closed directory, anything from before it was closed has been done.
+                if os.path.getmtime(filename) < entry.get('closed',0):
+                    continue
+                new.append(filename)
+            entry = {'mtime': mtime, 'files': sorted(files), 'closed': entry.get('closed',0)}
+            yield (key,entry), new
+
+    def scan(self):
+        # Analyse any new results. Returns how many were added.
+        sources = list(self.archive_sources() if self.is_archive else self.json_sources())
+        jobs = [source for (done,new) in sources for source in new]
+        if len(jobs) >= pool_threshold:
+            pool = multiprocessing.Pool(self.processes)
+            try:
+                results = pool.map(analyse,jobs,jsontocsv.chunk_size)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [analyse(job) for job in jobs]
+
+        added = 0
+        position = 0
+        for ((key,entry),new) in sources:
+            for source in new:
+                result = results[position]
+                position += 1
+                if result is None:
+                    # Leave the directory to be looked at again.
+                    entry['mtime'] = None
+                    continue
+                if result[0] is None:
+                    print("Skipping %s, which %s" % (source_name(source),result[1]))
+                    self.manifest['skipped'] += 1
+                    if not self.is_archive:
+                        entry['files'].append(os.path.basename(source))
+                    continue
+                day, row, record = result
+                self.csv.write(row + "\n")
+                add_totals(self.manifest['totals'],record)
+                if day not in self.manifest['days']:
+                    self.manifest['days'][day] = new_totals()
+                add_totals(self.manifest['days'][day],record)
+                if not self.is_archive:
+                    entry['files'].append(os.path.basename(source))
+                added += 1
+            if self.is_archive:
+                self.manifest['partitions'][key] = entry
+            else:
+                entry['files'].sort()
+                self.manifest['directories'][key] = entry
+
+        if len(sources) > 0:
+            self.csv.flush()
+            os.fsync(self.csv.fileno())
+            self.manifest['csv_size'] = self.csv.tell()
+            self.save_manifest()
+            self.save_summary()
+        return added
+
+    def close(self):
+        self.csv.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse beacon_rx.py results as they arrive")
+    parser.add_argument("folder",help="An rx_archive.py archive, or a folder of result JSON files.")
+    parser.add_argument("--interval",type=float,default=10.0,help="Seconds between scans.")
+    parser.add_argument("--once",action="store_true",help="Scan once and exit.")
+    parser.add_argument("-o","--output",default=None,help="CSV file. Defaults to " + csv_filename + " in the folder.")
+    parser.add_argument("--manifest",default=None,help="Manifest file. Defaults to " + manifest_filename + " in the folder.")
+    parser.add_argument("--summary",default=None,help="Summary file. Defaults to " + summary_filename + " in the folder.")
+    parser.add_argument("-j","--processes",type=int,default=None,help="Worker processes for large scans.")
+    args = parser.parse_args()
+
+    watcher = Watcher(args.folder,args.output,args.manifest,args.summary,args.processes)
+    try:
+        while True:
+            began = time.time()
+            added = watcher.scan()
+            if added > 0:
+                totals = summarise_totals(watcher.manifest['totals'])
+                print("%s: %d new results in %.2f seconds. %d total, %d PSK and %d DOMEX valid." % (time.strftime("%H:%M:%S"),
+                    added,time.time()-began,totals['results'],totals['psk_valid'],totals['domex_valid']))
+            if args.once:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+if __name__ == "__main__":
+    main()
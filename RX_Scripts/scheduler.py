@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# scheduler.py - Beacon slot timing
+#
+# Waits for UTC slot start times without busy-waiting. Each wait converts the UTC start
+# time into a deadline on the monotonic clock, so it isn't upset by the system clock being
+# stepped part way through. Most of the wait is a single long sleep, finishing with a few
+# short sleeps to land on the deadline. The measured start error of every slot is kept.
+#
+# Copyright 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+# This library is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this library.  If not, see <http://www.gnu.org/licenses/>.
+
+import math,time
+
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    # Python 2 doesn't have time.monotonic(), so go to clock_gettime() directly.
+    import ctypes,ctypes.util
+
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec',ctypes.c_long),('tv_nsec',ctypes.c_long)]
+
+    CLOCK_MONOTONIC = 1
+    try:
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'),use_errno=True)
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int,ctypes.POINTER(timespec)]
+
+        def monotonic():
+            t = timespec()
+            if clock_gettime(CLOCK_MONOTONIC,ctypes.pointer(t)) != 0:
+                raise OSError(ctypes.get_errno(),"clock_gettime failed")
+            return t.tv_sec + t.tv_nsec*1e-9
+    except (AttributeError,OSError,TypeError):
+        print("No monotonic clock available. Slot timing will follow the system clock.")
+        monotonic = time.time
+
+
+class SlotScheduler(object):
+
+    def __init__(self,margin=0.02,step=0.0005):
+        # margin: how far ahead of the deadline the long sleep ends.
+        # step: length of the short sleeps used to finish the wait.
+        self.margin = margin
+        self.step = step
+        # (label, scheduled UTC time, start error in seconds) for every slot waited for.
+        self.log = []
+
+    def next_boundary(self,period=60,now=None):
+        # UTC time of the next multiple of 'period' seconds, i.e. the start of the next minute.
+        if now is None:
+            now = time.time()
+        return math.floor(now/period)*period + period
+
+    def wait_until(self,utc,label=None):
+        # Sleep until the UTC time 'utc' (as from time.time()). Returns immediately if that
+        # time has already passed. Returns the start error in seconds (positive = late).
+        deadline = monotonic() + (utc - time.time())
+
+        remaining = deadline - monotonic()
+        while remaining > self.margin:
+            time.sleep(remaining - self.margin)
+            remaining = deadline - monotonic()
+        while remaining > 0:
+            time.sleep(min(remaining,self.step))
+            remaining = deadline - monotonic()
+
+        error = time.time() - utc
+        self.log.append((label,utc,error))
+        return error
+
+    def wait_for_next(self,period=60,label=None):
+        # Wait for the next period boundary. Returns the UTC time of that boundary.
+        utc = self.next_boundary(period)
+        self.wait_until(utc,label)
+        return utc
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+#
+#    FLDIGI Beacon receiver - Received Text Scoring
+#
+#   Scores received text against what was sent, without needing python-Levenshtein:
+#    - jaro() gives the same Jaro similarity as python-Levenshtein's Levenshtein.jaro(), so
+#      results line up with those worked out before. Characters are matched to the earliest
+#      unmatched character in range, as it does.
+#    - levenshtein() gives the edit distance, and cer() the character error rate (edit distance
+#      over the expected length).
+#    - The batch_ versions do the same for a whole list of (expected, received) pairs at once,
+#      with NumPy, working along every pair together a character at a time.
+#    - payload_errors() finds the random payload in the received text, between the $$$$$ framing
+#      that surrounds it in the txstring, lines it up with the expected payload, and counts
+#      substitutions, deletions and insertions at each payload position, over every pair.
+#
+#   Without NumPy the batch functions fall back to scoring one pair at a time.
+#
+#   Usage:
+#       python scoring.py errors <archive or json folder> [psk|domex]
+#       python scoring.py bench <archive or json folder>
+#
+#    Copyright (C) 2013 Mark Jessop <mark.jessop@adelaide.edu.au>
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU General Public License as published by
+#      the Free Software Foundation, either version 3 of the License, or
+#      (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+#      GNU General Public License for more details.
+#
+#      For a full copy of the GNU General Public License,
+#      see <http://www.gnu.org/licenses/>.
+#
+#
+
+import glob,json,os,sys,time
+
+try:
+    import numpy as np
+    numpy_enabled = True
+except ImportError:
+    numpy_enabled = False
+
+# A run of at least this many $ characters counts as payload framing, so one lost $ in the
+# five sent doesn't stop the payload being found.
+framing_length = 3
+
+# Pairs aligned at a time by payload_errors(), to bound memory use.
+chunk_size = 2048
+
+
+def jaro(s1,s2):
+    len1 = len(s1)
+    len2 = len(s2)
+    if len1 == 0 or len2 == 0:
+        if len1 == 0 and len2 == 0:
+            return 1.0
+        return 0.0
+    # s1 is the shorter string.
+    if len1 > len2:
+        s1, s2, len1, len2 = s2, s1, len2, len1
+    halflen = (len1 + 1)//2
+    # Order in which each character of s1 was matched, from 1, or 0 if it wasn't.
+    order = [0]*len1
+    match = 0
+    for i in range(min(len1 + halflen,len2)):
+        for j in range(max(0,i - halflen),min(i + halflen,len1 - 1) + 1):
+            if order[j] == 0 and s1[j] == s2[i]:
+                match += 1
+                order[j] = match
+                break
+    if match == 0:
+        return 0.0
+    trans = 0
+    matched = 0
+    for j in range(len1):
+        if order[j]:
+            matched += 1
+            if order[j] != matched:
+                trans += 1
+    m = float(match)
+    return (m/len1 + m/len2 + 1.0 - trans/m/2.0)/3.0
+
+def levenshtein(s1,s2):
+    previous = list(range(len(s2) + 1))
+    for i in range(len(s1)):
+        current = [i + 1]
+        for j in range(len(s2)):
+            current.append(min(previous[j + 1] + 1,current[j] + 1,previous[j] + (s1[i] != s2[j])))
+        previous = current
+    return previous[-1]
+
+def cer(expected,received):
+    if len(expected) == 0:
+        return float(len(received) > 0)
+    return levenshtein(expected,received)/float(len(expected))
+
+def find_payload(text):
+    # The part of text between the first two runs of $ framing, or from the first run to the
+    # end if there's no second. None if there's no framing at all.
+    start = text.find("$"*framing_length)
+    if start < 0:
+        return None
+    while start < len(text) and text[start] == "$":
+        start += 1
+    end = text.find("$"*framing_length,start)
+    if end < 0:
+        end = len(text)
+    return text[start:end]
+
+
+def codes(strings,pad):
+    # A list of strings as a matrix of character codes, one string per row, padded out with pad.
+    # Also returns the lengths.
+    lengths = np.array([len(s) for s in strings],dtype=np.int64)
+    matrix = np.full((len(strings),max(1,int(lengths.max()) if len(strings) else 1)),pad,dtype=np.int32)
+    for n in range(len(strings)):
+        try:
+            row = np.frombuffer(strings[n].encode('utf-32-le'),dtype='<u4')
+        except UnicodeError:
+            row = [ord(c) for c in strings[n]]
+        matrix[n,:lengths[n]] = row
+    return matrix,lengths
+
+def batch_jaro(expected,received):
+    # jaro() for every pair, as an array.
+    if not numpy_enabled:
+        return [jaro(a,b) for (a,b) in zip(expected,received)]
+    n = len(expected)
+    if n == 0:
+        return np.zeros(0)
+    # Put the shorter string of each pair first.
+    swap = [len(a) > len(b) for (a,b) in zip(expected,received)]
+    s1, len1 = codes([b if sw else a for (a,b,sw) in zip(expected,received,swap)],-1)
+    s2, len2 = codes([a if sw else b for (a,b,sw) in zip(expected,received,swap)],-2)
+    halflen = (len1 + 1)//2
+    to = np.minimum(len1 + halflen,len2)
+    rows = np.arange(n)
+    j = np.arange(s1.shape[1])
+    order = np.zeros(s1.shape,dtype=np.int64)
+    unmatched = np.ones(s1.shape,dtype=bool)
+    match = np.zeros(n,dtype=np.int64)
+    for i in range(int(to.max())):
+        # Match s2[i] to the first unmatched equal character of s1 within halflen of i, in every
+        # pair. Padding never matches, so s1's length doesn't need checking.
+        c = np.where(i < to,s2[:,i],-3)
+        candidates = (s1 == c[:,None]) & unmatched & (np.abs(j - i)[None,:] <= halflen[:,None])
+        first = candidates.argmax(axis=1)
+        found = candidates[rows,first]
+        match += found
+        order[rows[found],first[found]] = match[found]
+        unmatched[rows[found],first[found]] = False
+    matched = order > 0
+    trans = (matched & (order != np.cumsum(matched,axis=1))).sum(axis=1)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        m = match.astype(np.float64)
+        result = (m/len1 + m/len2 + 1.0 - trans/m/2.0)/3.0
+    result[match == 0] = 0.0
+    result[(len1 == 0) & (len2 == 0)] = 1.0
+    return result
+
+def _edit_rows(s1,s2):
+    # Rows of the edit distance table for every pair at once, as arrays of (received position,
+    # pair). s1 and s2 are character codes as (position, pair) matrices.
+    steps = np.arange(s2.shape[0] + 1,dtype=np.int32)[:,None]
+    previous = np.repeat(steps,s2.shape[1],axis=1)
+    yield previous
+    for i in range(s1.shape[0]):
+        # Substitutions and deletions from the row above, then insertions along the row, which
+        # is the running minimum of (cost - position), plus the position.
+        current = np.empty_like(previous)
+        current[0] = i + 1
+        np.minimum(previous[1:] + 1,previous[:-1] + (s1[i] != s2),out=current[1:])
+        current -= steps
+        np.minimum.accumulate(current,axis=0,out=current)
+        current += steps
+        yield current
+        previous = current
+
+def batch_levenshtein(expected,received):
+    # levenshtein() for every pair, as an array.
+    if not numpy_enabled:
+        return [levenshtein(a,b) for (a,b) in zip(expected,received)]
+    n = len(expected)
+    if n == 0:
+        return np.zeros(0,dtype=np.int64)
+    s1, len1 = codes(expected,-1)
+    s2, len2 = codes(received,-2)
+    rows = np.arange(n)
+    distance = np.zeros(n,dtype=np.int64)
+    for (i,row) in enumerate(_edit_rows(s1.T.copy(),s2.T.copy())):
+        done = len1 == i
+        distance[done] = row[len2[done],rows[done]]
+    return distance
+
+def batch_cer(expected,received):
+    # cer() for every pair, as an array.
+    if not numpy_enabled:
+        return [cer(a,b) for (a,b) in zip(expected,received)]
+    distance = batch_levenshtein(expected,received)
+    lengths = np.array([len(a) for a in expected],dtype=np.float64)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        result = distance/lengths
+    empty = lengths == 0
+    result[empty] = np.array([len(b) > 0 for b in received],dtype=np.float64)[empty]
+    return result
+
+
+def _align(expected,received):
+    # Edit the received payloads into the expected ones, all at once, and trace back the cheapest
+    # edits. Returns the (pair, expected position) of every substitution, deletion and insertion.
+    # Insertions are put against the expected character they come before (or the last one).
+    n = len(expected)
+    s1, len1 = codes(expected,-1)
+    s2, len2 = codes(received,-2)
+    rows = np.arange(n)
+    table = np.array(list(_edit_rows(s1.T.copy(),s2.T.copy())))
+
+    edits = {'substitution': ([],[]), 'deletion': ([],[]), 'insertion': ([],[])}
+    i = len1.copy()
+    j = len2.copy()
+    last = np.maximum(len1 - 1,0)
+    while True:
+        active = (i > 0) | (j > 0)
+        if not active.any():
+            break
+        here = table[i,j,rows]
+        ci = np.maximum(i - 1,0)
+        cj = np.maximum(j - 1,0)
+        differ = s1[rows,np.minimum(ci,s1.shape[1]-1)] != s2[rows,np.minimum(cj,s2.shape[1]-1)]
+        diagonal = active & (i > 0) & (j > 0) & (here == table[ci,cj,rows] + differ)
+        up = active & ~diagonal & (i > 0) & (here == table[ci,j,rows] + 1)
+        left = active & ~diagonal & ~up
+        for (name,mask,position) in (('substitution',diagonal & differ,ci),('deletion',up,ci),('insertion',left,np.minimum(i,last))):
+            edits[name][0].append(rows[mask])
+            edits[name][1].append(position[mask])
+        i = i - (diagonal | up)
+        j = j - (diagonal | left)
+    return dict((name,(np.concatenate(edits[name][0]),np.concatenate(edits[name][1]))) for name in edits)
+
+def payload_errors(expected,received):
+    # Per-position error counts for the payloads of a list of (expected, received) text pairs.
+    # Returns a dictionary with:
+    #   framed          Pairs where the payload framing was found in the received text.
+    #   substitution, deletion, insertion
+    #                   Arrays of how many of each error there were at each payload position.
+    #   length          The payload length.
+    # Pairs where the framing can't be found aren't counted.
+    if not numpy_enabled:
+        raise ImportError("NumPy is needed for payload error histograms")
+    pairs = []
+    for (a,b) in zip(expected,received):
+        payload = find_payload(a)
+        found = find_payload(b)
+        if payload is None or found is None or len(payload) == 0:
+            continue
+        # Without closing framing, only the payload's length of text can be part of it.
+        pairs.append((payload,found[:2*len(payload)]))
+    length = max([len(p[0]) for p in pairs] + [0])
+    result = {'framed': len(pairs), 'length': length}
+    for name in ['substitution','deletion','insertion']:
+        result[name] = np.zeros(length,dtype=np.int64)
+    for first in range(0,len(pairs),chunk_size):
+        chunk = pairs[first:first+chunk_size]
+        edits = _align([p[0] for p in chunk],[p[1] for p in chunk])
+        for name in edits:
+            result[name] += np.bincount(edits[name][1],minlength=length)[:length]
+    return result
+
+
+def load_pairs(folder,mode):
+    # (expected, received) text for every result in an rx_archive.py archive or a folder of JSON files.
+    import rx_archive
+    if os.path.exists(os.path.join(folder,rx_archive.traces_file)):
+        results = rx_archive.BeaconArchive(folder).query(0,2**62,traces=False)
+    else:
+        filenames = sorted(glob.glob(os.path.join(folder,"*.json")) + glob.glob(os.path.join(folder,"*","*.json")))
+        results = (json.loads(open(filename).read()) for filename in filenames)
+    expected = []
+    received = []
+    for result in results:
+        expected.append(result["expected_data"])
+        received.append(result[mode + "_data"])
+    return expected,received
+
+def print_errors(folder,mode):
+    expected, received = load_pairs(folder,mode)
+    began = time.time()
+    errors = payload_errors(expected,received)
+    print("%d results, payload framing found in %d. Aligned in %.2f seconds." % (len(expected),errors['framed'],time.time()-began))
+    if errors['framed'] == 0:
+        return
+    print("Position  Substitution  Deletion  Insertion  Error rate")
+    for k in range(errors['length']):
+        total = errors['substitution'][k] + errors['deletion'][k] + errors['insertion'][k]
+        print("%8d  %12d  %8d  %9d  %9.2f%%" % (k,errors['substitution'][k],errors['deletion'][k],errors['insertion'][k],100.0*total/errors['framed']))
+
+def benchmark(folder):
+    # Times scoring every result's PSK text one call at a time (with python-Levenshtein if it's
+    # installed, and with jaro() here) against the batch functions, and checks they agree.
+    expected, received = load_pairs(folder,"psk")
+    print("%d results." % len(expected))
+    timings = []
+    try:
+        import Levenshtein
+        began = time.time()
+        reference = [Levenshtein.jaro(a,b) for (a,b) in zip(expected,received)]
+        timings.append(("Levenshtein.jaro() per call",time.time()-began))
+    except ImportError:
+        reference = None
+    began = time.time()
+    single = [jaro(a,b) for (a,b) in zip(expected,received)]
+    timings.append(("jaro() per call",time.time()-began))
+    began = time.time()
+    batch = batch_jaro(expected,received)
+    timings.append(("batch_jaro()",time.time()-began))
+    began = time.time()
+    single_distance = [levenshtein(a,b) for (a,b) in zip(expected[:1000],received[:1000])]
+    timings.append(("levenshtein() per call, first 1000",time.time()-began))
+    began = time.time()
+    distance = batch_levenshtein(expected,received)
+    timings.append(("batch_levenshtein()",time.time()-began))
+    for (name,seconds) in timings:
+        print("%-40s %7.3f s" % (name,seconds))
+    difference = max([abs(a-b) for (a,b) in zip(single,batch)] + [0])
+    print("Largest difference, jaro() and batch_jaro(): %g" % difference)
+    if reference is not None:
+        print("Largest difference, Levenshtein.jaro() and jaro(): %g" % max([abs(a-b) for (a,b) in zip(reference,single)] + [0]))
+    print("levenshtein() and batch_levenshtein() agree: %s" % (list(single_distance) == list(distance[:1000])))
+
+def main():
+    if len(sys.argv) >= 3 and sys.argv[1] == "errors":
+        print_errors(sys.argv[2],sys.argv[3] if len(sys.argv) >= 4 else "psk")
+    elif len(sys.argv) == 3 and sys.argv[1] == "bench":
+        benchmark(sys.argv[2])
+    else:
+        print("Usage: scoring.py errors <archive or json folder> [psk|domex]")
+        print("       scoring.py bench <archive or json folder>")
+
+if __name__ == "__main__":
+    main()